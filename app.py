@@ -1,22 +1,97 @@
 from __future__ import annotations
 
-from fastapi import Depends, FastAPI, Header, HTTPException
-from fastapi.responses import JSONResponse
+import asyncio
+import json
+import time
+from contextlib import aclosing, asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Literal
 
-from gl_service.api_models import N8nItemsRequest, N8nItemsResponse, N8nSendResponse
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+from gl_service.api_models import (
+    CacheInvalidateRequest,
+    JobSubmittedResponse,
+    N8nItemsRequest,
+    N8nItemsResponse,
+    N8nSendResponse,
+    PipelineRequest,
+    PipelineResponse,
+    SendQueuedResponse,
+)
+from gl_service import metrics
+from gl_service.blob_store import externalize_item
+from gl_service.cache import analysis_cache
+from gl_service.capture import CaptureMiddleware, capture_writer
+from gl_service.concurrency import BatchStats, gather_bounded, iter_bounded
+from gl_service.extract_pool import extract_pool
+from gl_service.http_clients import http_clients
+from gl_service.jobs import JobQueueFullError, ItemCallback, job_queue
+from gl_service.models import ClassifyResult
 from gl_service.n8n_adapter import email_from_n8n_item
 from gl_service.settings import settings
+from gl_service.pipeline import run_pipeline
+from gl_service.resilience import guards
+from gl_service.send_queue import send_queue
 from gl_service.steps import (
+    UPSTREAM_ERRORS,
+    analyze_meta,
+    iter_classify,
     step_analyze_attachment,
     step_build_message,
-    step_classify,
+    step_classify_many,
+    step_commit_watermarks,
     step_dedupe_latest,
+    step_drop_seen,
     step_no_attachment_fallback,
 )
-from gl_service.whapi_client import send_text_and_optional_doc
+from gl_service.watermarks import watermark_store
+from gl_service.whapi_client import SendInProgressError, send_text_and_optional_doc
+
+
+async def _warm_up() -> None:
+    # Startup lifespan-а завершается до того, как uvicorn начинает слушать порт: ждём немного,
+    # чтобы прогрев не задерживал первые запросы (и healthcheck scale-to-zero хостинга).
+    await asyncio.sleep(settings.warmup_delay_s)
+    started = time.perf_counter()
+    try:
+        await extract_pool.warm_up()
+    except Exception as e:
+        print(f"⚠️ Warm-up failed: {e!r}")
+        return
+    print(f"📦 Warm-up done in {time.perf_counter() - started:.2f}s")
+
 
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    extract_pool.start()
+    await http_clients.start()
+    # Прогрев в фоне: недоступный upstream не должен задерживать старт (и /health).
+    prewarm = asyncio.create_task(http_clients.prewarm()) if settings.http_prewarm else None
+    warmup = asyncio.create_task(_warm_up()) if settings.warmup else None
+    if send_queue is not None:
+        await send_queue.start()
+    if job_queue is not None:
+        await job_queue.start()
+    try:
+        yield
+    finally:
+        if prewarm is not None:
+            prewarm.cancel()
+        if warmup is not None:
+            warmup.cancel()
+        if job_queue is not None:
+            await job_queue.stop()
+        if send_queue is not None:
+            await send_queue.stop()
+        await http_clients.aclose()
+        extract_pool.shutdown()
 
-app = FastAPI(title="Guarantee Letters Service", version="0.1.0")
+
+app = FastAPI(title="Guarantee Letters Service", version="0.1.0", lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
+if capture_writer is not None:
+    app.add_middleware(CaptureMiddleware, writer=capture_writer)
 
 
 def require_api_key(x_api_key: str | None = Header(default=None, alias="X-API-Key")) -> None:
@@ -35,18 +110,100 @@ async def unhandled_exception_handler(_request, exc: Exception):
     )
 
 
+@app.exception_handler(SendInProgressError)
+async def send_in_progress_handler(_request, exc: SendInProgressError):
+    # Ретрай n8n, пока первый запрос ещё отправляет то же письмо: повторить позже
+    return JSONResponse(status_code=409, content={"detail": str(exc), "type": exc.__class__.__name__})
+
+
 @app.get("/health")
 def health() -> dict[str, str]:
     return {"status": "ok"}
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_api(_: None = Depends(require_api_key)) -> PlainTextResponse:
+    # Prometheus text format: задержки шагов и upstream-ов, извлечение, кэши, параллельность.
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/diagnostics/http")
+def diagnostics_http(_: None = Depends(require_api_key)) -> dict:
+    # Статистика пулов соединений к OpenAI/Gemini/Whapi (открыто, переиспользовано, создано).
+    return http_clients.stats()
+
+
+@app.get("/diagnostics/upstreams")
+def diagnostics_upstreams(_: None = Depends(require_api_key)) -> dict:
+    # Состояние ретраев / circuit breaker / hedging по OpenAI и Gemini.
+    return {name: guard.stats() for name, guard in guards.items()}
+
+
 # --- n8n-friendly “step” endpoints (для оркестрации n8n cloud через HTTP Request) ---
 
 
+async def _out_items(items: list[dict]) -> list[dict]:
+    """
+    С GL_BLOB_REFS вложения уходят в blob store уже на первом шаге,
+    дальше по n8n гуляет только ссылка вместо base64.
+    """
+
+    if not settings.blob_refs:
+        return items
+    return await asyncio.to_thread(lambda: [externalize_item(it) for it in items])
+
+
+async def _out_item(item: dict) -> dict:
+    if not settings.blob_refs:
+        return item
+    return await asyncio.to_thread(externalize_item, item)
+
+
+# --- потоковый режим (NDJSON): строка на item по мере готовности + финальная строка с meta ---
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def _wants_ndjson(request: Request, stream: bool) -> bool:
+    return stream or NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def _ndjson_line(obj: dict[str, Any]) -> bytes:
+    return (json.dumps(obj, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+
+def _ndjson_response(
+    results: AsyncIterator[tuple[int, dict | Exception]], meta: Callable[[], dict[str, Any]]
+) -> StreamingResponse:
+    """
+    {"index": i, "item": {...}} — готовый item (i — позиция во входном items);
+    {"index": i, "error": {"type", "error"}} — item упал, остальные продолжают;
+    {"meta": {...}} — последняя строка.
+    """
+
+    async def body() -> AsyncIterator[bytes]:
+        async with aclosing(results) as rs:
+            async for i, res in rs:
+                if isinstance(res, Exception):
+                    yield _ndjson_line({"index": i, "error": {"type": res.__class__.__name__, "error": str(res)}})
+                else:
+                    yield _ndjson_line({"index": i, "item": res})
+        yield _ndjson_line({"meta": meta()})
+
+    return StreamingResponse(body(), media_type=NDJSON_MEDIA_TYPE)
+
+
 @app.post("/step/dedupe", response_model=N8nItemsResponse)
-async def step_dedupe(req: N8nItemsRequest, _: None = Depends(require_api_key)) -> N8nItemsResponse:
+async def step_dedupe(
+    req: N8nItemsRequest, watermark: bool = True, _: None = Depends(require_api_key)
+) -> N8nItemsResponse:
+    metrics.batch_items.labels("dedupe").observe(len(req.items))
     emails = [email_from_n8n_item(it) for it in req.items]
     kept, dropped = step_dedupe_latest(emails)
+    # + письма, уже обработанные в прошлых запусках (если настроен GL_WATERMARK_DB)
+    seen = 0
+    if watermark:
+        kept, seen = await step_drop_seen(kept)
     # Возвращаем в исходном формате item-ов (как минимум json-часть + binary если был)
     out_items = []
     kept_ids = {e.id for e in kept}
@@ -54,45 +211,157 @@ async def step_dedupe(req: N8nItemsRequest, _: None = Depends(require_api_key))
         eid = str((it.get("json") or {}).get("id") or "")
         if eid in kept_ids:
             out_items.append(it)
-    return N8nItemsResponse(items=out_items, meta={"dropped": dropped})
+    return N8nItemsResponse(items=await _out_items(out_items), meta={"dropped": dropped, "seen": seen})
+
+
+def _require_watermarks() -> None:
+    if watermark_store is None:
+        raise HTTPException(status_code=400, detail="GL_WATERMARK_DB is not set")
+
+
+def _require_send(commit_watermark: bool) -> None:
+    if not settings.whapi_to:
+        raise HTTPException(status_code=400, detail="GL_WHAPI_TO is not set")
+    if commit_watermark:
+        _require_watermarks()
+
+
+@app.post("/watermarks/commit")
+async def commit_watermarks(req: N8nItemsRequest, _: None = Depends(require_api_key)) -> dict[str, int]:
+    # Отметить письма обработанными: следующий /step/dedupe их (и всё, что старше в треде) отбросит.
+    _require_watermarks()
+    emails = [email_from_n8n_item(it) for it in req.items]
+    return {"advanced": await step_commit_watermarks(emails)}
+
+
+def _with_classification(it: dict, res: ClassifyResult) -> dict:
+    it2 = dict(it)
+    it2["json"] = dict(it2.get("json") or {})
+    it2["json"]["is_guarantee_letter"] = res.is_guarantee_letter
+    it2["json"]["classified_by"] = res.decided_by
+    return it2
+
+
+async def _iter_classified(items: list[dict], meta: dict) -> AsyncIterator[tuple[int, dict | Exception]]:
+    """Классифицированные item-ы по мере готовности (NDJSON и /jobs/classify)."""
+
+    emails = [email_from_n8n_item(it) for it in items]
+    async with aclosing(iter_classify(emails, meta)) as rs:
+        async for j, res in rs:
+            if isinstance(res, Exception):
+                yield j, res
+            else:
+                yield j, await _out_item(_with_classification(items[j], res))
 
 
 @app.post("/step/classify", response_model=N8nItemsResponse)
-async def step_classify_api(req: N8nItemsRequest, _: None = Depends(require_api_key)) -> N8nItemsResponse:
-    out = []
-    for it in req.items:
-        email = email_from_n8n_item(it)
-        res = await step_classify(email)
+async def step_classify_api(
+    req: N8nItemsRequest,
+    request: Request,
+    stream: bool = False,
+    _: None = Depends(require_api_key),
+) -> N8nItemsResponse | StreamingResponse:
+    metrics.batch_items.labels("classify").observe(len(req.items))
+    # Параллельно, но не больше GL_CLASSIFY_CONCURRENCY запросов к OpenAI; порядок item-ов сохраняется.
+    meta: dict = {}
+
+    if _wants_ndjson(request, stream):
+        return _ndjson_response(_iter_classified(req.items, meta), lambda: meta)
+
+    emails = [email_from_n8n_item(it) for it in req.items]
+    results = await step_classify_many(emails, meta)
+    out = [_with_classification(it, res) for it, res in zip(req.items, results)]
+    return N8nItemsResponse(items=await _out_items(out), meta=meta)
+
+
+async def _analyze_item(it: dict, infos: list[dict]) -> dict:
+    email = email_from_n8n_item(it)
+    info: dict = {}
+    infos.append(info)
+    ai, att = await step_analyze_attachment(email, info)
+    if ai is None:
+        ai = step_no_attachment_fallback(email)
+    it2 = dict(it)
+    it2["json"] = dict(it2.get("json") or {})
+    it2["json"]["ai_response"] = ai.model_dump()
+    it2["json"]["has_attachment"] = email.attachment is not None
+    if att is not None and att.binary_key:
+        # Какое вложение send_whatsapp отправит документом (главное по рангу, не обязательно attachment_0)
+        it2["json"]["primary_attachment"] = att.binary_key
+    if "extract" in info:
+        it2["json"]["extract"] = info["extract"]
+    if "attachments" in info:
+        it2["json"]["attachments"] = info["attachments"]
+    return it2
+
+
+async def _iter_analyzed(
+    items: list[dict], infos: list[dict], stats: BatchStats
+) -> AsyncIterator[tuple[int, dict | Exception]]:
+    """Проанализированные item-ы по мере готовности (NDJSON и /jobs/analyze)."""
+
+    results = iter_bounded(
+        items, lambda it: _analyze_item(it, infos), limit=settings.analyze_concurrency, stats=stats
+    )
+    async with aclosing(results) as rs:
+        async for i, res in rs:
+            yield i, res if isinstance(res, Exception) else await _out_item(res)
+
+
+async def _analyze_item_or_error(it: dict, infos: list[dict]) -> dict:
+    # Обычный (не потоковый) ответ: сбой Gemini — ошибка этого item-а, а не 500 на весь батч
+    try:
+        return await _analyze_item(it, infos)
+    except UPSTREAM_ERRORS as e:
         it2 = dict(it)
         it2["json"] = dict(it2.get("json") or {})
-        it2["json"]["is_guarantee_letter"] = res.is_guarantee_letter
-        out.append(it2)
-    return N8nItemsResponse(items=out)
+        it2["json"]["analyze_error"] = f"{e.__class__.__name__}: {e}"
+        return it2
 
 
 @app.post("/step/analyze", response_model=N8nItemsResponse)
-async def step_analyze_api(req: N8nItemsRequest, _: None = Depends(require_api_key)) -> N8nItemsResponse:
-    out = []
-    for it in req.items:
-        email = email_from_n8n_item(it)
-        ai, _att = await step_analyze_attachment(email)
-        if ai is None:
-            ai = step_no_attachment_fallback(email)
-        it2 = dict(it)
-        it2["json"] = dict(it2.get("json") or {})
-        it2["json"]["ai_response"] = ai.model_dump()
-        it2["json"]["has_attachment"] = email.attachment is not None
-        out.append(it2)
-    return N8nItemsResponse(items=out)
+async def step_analyze_api(
+    req: N8nItemsRequest,
+    request: Request,
+    stream: bool = False,
+    _: None = Depends(require_api_key),
+) -> N8nItemsResponse | StreamingResponse:
+    metrics.batch_items.labels("analyze").observe(len(req.items))
+    infos: list[dict] = []
+
+    if _wants_ndjson(request, stream):
+        stats = BatchStats()
+        return _ndjson_response(
+            _iter_analyzed(req.items, infos, stats), lambda: {"batch": stats.to_meta(), **analyze_meta(infos)}
+        )
+
+    # Извлечение идёт в пуле процессов, поэтому Gemini-запросы соседних item-ов идут параллельно с ним.
+    out, stats = await gather_bounded(
+        req.items, lambda it: _analyze_item_or_error(it, infos), limit=settings.analyze_concurrency
+    )
+    return N8nItemsResponse(items=await _out_items(out), meta={"batch": stats.to_meta(), **analyze_meta(infos)})
+
+
+@app.post("/cache/analysis/invalidate")
+async def invalidate_analysis_cache(
+    req: CacheInvalidateRequest, _: None = Depends(require_api_key)
+) -> dict[str, int]:
+    tags = [h.lower() for h in req.sha256] if req.sha256 else None
+    return {"removed": await analysis_cache.invalidate(tags)}
 
 
 @app.post("/step/message", response_model=N8nItemsResponse)
 async def step_message_api(req: N8nItemsRequest, _: None = Depends(require_api_key)) -> N8nItemsResponse:
     from gl_service.models import GuaranteeDocExtract
 
+    metrics.batch_items.labels("message").observe(len(req.items))
     out = []
     for it in req.items:
         js = it.get("json") or {}
+        if js.get("analyze_error"):
+            # Анализа нет (Gemini недоступен) — без message_text, send_whatsapp такой item пропустит
+            out.append(it)
+            continue
         ai = js.get("ai_response")
         ai_obj = None if ai is None else GuaranteeDocExtract.model_validate(ai)
         msg = step_build_message(ai_obj)
@@ -100,29 +369,214 @@ async def step_message_api(req: N8nItemsRequest, _: None = Depends(require_api_k
         it2["json"] = dict(it2.get("json") or {})
         it2["json"]["message_text"] = msg
         out.append(it2)
-    return N8nItemsResponse(items=out)
+    return N8nItemsResponse(items=await _out_items(out))
 
 
 @app.post("/step/send_whatsapp", response_model=N8nSendResponse)
 async def step_send_whatsapp_api(
-    req: N8nItemsRequest, _: None = Depends(require_api_key)
-) -> N8nSendResponse:
-    if not settings.whapi_to:
-        raise HTTPException(status_code=400, detail="GL_WHAPI_TO is not set")
+    req: N8nItemsRequest,
+    commit_watermark: bool = False,
+    queue: bool = False,
+    _: None = Depends(require_api_key),
+) -> N8nSendResponse | JSONResponse:
+    _require_send(commit_watermark)
+    metrics.batch_items.labels("send_whatsapp").observe(len(req.items))
+    if queue:
+        return await _enqueue_sends(req, commit_watermark)
 
     sent = []
-    for it in req.items:
-        js = it.get("json") or {}
-        body = js.get("message_text") or ""
+    sent_emails = []
+    try:
+        for it in req.items:
+            js = it.get("json") or {}
+            body = js.get("message_text") or ""
+            if not body:
+                continue
+            email = email_from_n8n_item(it)
+            res = await send_text_and_optional_doc(
+                to=settings.whapi_to,
+                text=body,
+                attachment=email.send_attachment(js.get("primary_attachment")),
+                email_id=email.id,
+            )
+            sent.append(res.model_dump())
+            sent_emails.append(email)
+    finally:
+        # Даже если упали посередине — уже отправленные письма повторно не берём
+        if commit_watermark:
+            await step_commit_watermarks(sent_emails)
+    return N8nSendResponse(sent=sent)
+
+
+async def _enqueue_sends(req: N8nItemsRequest, commit_watermark: bool) -> JSONResponse:
+    """Фоновая отправка: задания в персистентную очередь, сразу 202 с job id."""
+
+    if send_queue is None:
+        raise HTTPException(status_code=400, detail="GL_SEND_QUEUE_DB is not set")
+
+    indexes, jobs, emails = [], [], []
+    for i, it in enumerate(req.items):
+        body = (it.get("json") or {}).get("message_text") or ""
         if not body:
             continue
         email = email_from_n8n_item(it)
-        res = await send_text_and_optional_doc(
-            to=settings.whapi_to,
-            text=body,
-            attachment=email.attachment,
-        )
-        sent.append(res.model_dump())
-    return N8nSendResponse(sent=sent)
+        att = email.send_attachment((it.get("json") or {}).get("primary_attachment"))
+        job: dict[str, Any] = {"to": settings.whapi_to, "text": body, "email_id": email.id}
+        if att is not None:
+            job.update(file_name=att.file_name, mime_type=att.mime_type, data=att.raw_bytes())
+        indexes.append(i)
+        jobs.append(job)
+        emails.append(email)
+
+    ids = await send_queue.submit(jobs)
+    meta: dict[str, Any] = {"queued": len(ids)}
+    if commit_watermark:
+        # Задание уже лежит в очереди на диске — письмо считаем обработанным
+        meta["watermarks_advanced"] = await step_commit_watermarks(emails)
+    out = SendQueuedResponse(jobs=[{"index": i, "job_id": j} for i, j in zip(indexes, ids)], meta=meta)
+    return JSONResponse(status_code=202, content=out.model_dump())
+
+
+@app.get("/send_queue/jobs/{job_id}")
+async def send_job_status(job_id: str, _: None = Depends(require_api_key)) -> dict:
+    if send_queue is None:
+        raise HTTPException(status_code=400, detail="GL_SEND_QUEUE_DB is not set")
+    jobs = await asyncio.to_thread(send_queue.get_many, [job_id])
+    if not jobs:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return jobs[0]
+
+
+@app.get("/send_queue/jobs")
+async def send_jobs_status(ids: str, _: None = Depends(require_api_key)) -> dict:
+    # Для опроса пачкой из n8n: ?ids=<id>,<id>,...
+    if send_queue is None:
+        raise HTTPException(status_code=400, detail="GL_SEND_QUEUE_DB is not set")
+    job_ids = [j for j in ids.split(",") if j]
+    return {"jobs": await asyncio.to_thread(send_queue.get_many, job_ids)}
+
+
+@app.post("/pipeline", response_model=PipelineResponse)
+async def pipeline_api(req: PipelineRequest, _: None = Depends(require_api_key)) -> PipelineResponse:
+    # Все шаги за один HTTP-вызов: n8n не гоняет base64 вложений туда-обратно между шагами.
+    if req.send:
+        _require_send(req.commit_watermark)
+    elif req.commit_watermark:
+        _require_watermarks()
+
+    metrics.batch_items.labels("pipeline").observe(len(req.items))
+    results, meta = await run_pipeline(
+        req.items,
+        dedupe=req.dedupe,
+        classify=req.classify,
+        analyze=req.analyze,
+        message=req.message,
+        send=req.send,
+        commit_watermark=req.commit_watermark,
+    )
+    return PipelineResponse(items=results, meta=meta)
+
+
+# --- асинхронные задания: POST /jobs/{step} -> 202 + job id, шаг выполняется в фоне ---
+
+
+async def _job_dedupe(body: dict, params: dict, _on_item: ItemCallback) -> dict:
+    req = N8nItemsRequest.model_validate(body)
+    return (await step_dedupe(req, watermark=params.get("watermark", True), _=None)).model_dump()
+
+
+async def _job_classify(body: dict, _params: dict, on_item: ItemCallback) -> dict:
+    req = N8nItemsRequest.model_validate(body)
+    metrics.batch_items.labels("classify").observe(len(req.items))
+    meta: dict = {}
+    async with aclosing(_iter_classified(req.items, meta)) as rs:
+        async for i, res in rs:
+            await on_item(i, res)
+    return {"meta": meta}
+
+
+async def _job_analyze(body: dict, _params: dict, on_item: ItemCallback) -> dict:
+    req = N8nItemsRequest.model_validate(body)
+    metrics.batch_items.labels("analyze").observe(len(req.items))
+    infos: list[dict] = []
+    stats = BatchStats()
+    async with aclosing(_iter_analyzed(req.items, infos, stats)) as rs:
+        async for i, res in rs:
+            await on_item(i, res)
+    return {"meta": {"batch": stats.to_meta(), **analyze_meta(infos)}}
+
+
+async def _job_message(body: dict, _params: dict, _on_item: ItemCallback) -> dict:
+    return (await step_message_api(N8nItemsRequest.model_validate(body), _=None)).model_dump()
+
+
+async def _job_send_whatsapp(body: dict, params: dict, _on_item: ItemCallback) -> dict:
+    req = N8nItemsRequest.model_validate(body)
+    res = await step_send_whatsapp_api(req, commit_watermark=params.get("commit_watermark", False), _=None)
+    return res.model_dump()
+
+
+async def _job_pipeline(body: dict, _params: dict, _on_item: ItemCallback) -> dict:
+    return (await pipeline_api(PipelineRequest.model_validate(body), _=None)).model_dump()
+
+
+if job_queue is not None:
+    for _step, _handler in {
+        "dedupe": _job_dedupe,
+        "classify": _job_classify,
+        "analyze": _job_analyze,
+        "message": _job_message,
+        "send_whatsapp": _job_send_whatsapp,
+        "pipeline": _job_pipeline,
+    }.items():
+        job_queue.register(_step, _handler)
+
+
+def _require_jobs() -> None:
+    if job_queue is None:
+        raise HTTPException(status_code=400, detail="GL_JOBS_DB is not set")
+
+
+async def _submit_job(step: str, body: dict, params: dict, *, sends: bool = False) -> JSONResponse:
+    try:
+        job_id = await job_queue.submit(step, body, params, sends=sends)
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=429, detail=f"Job queue is full: {e}") from None
+    out = JobSubmittedResponse(job_id=job_id, total=len(body.get("items") or []))
+    return JSONResponse(status_code=202, content=out.model_dump(), headers={"Location": f"/jobs/{job_id}"})
+
+
+@app.post("/jobs/pipeline", status_code=202, response_model=JobSubmittedResponse)
+async def submit_pipeline_job(req: PipelineRequest, _: None = Depends(require_api_key)) -> JSONResponse:
+    _require_jobs()
+    if req.send:
+        _require_send(req.commit_watermark)
+    elif req.commit_watermark:
+        _require_watermarks()
+    return await _submit_job("pipeline", req.model_dump(), {}, sends=req.send)
+
+
+@app.post("/jobs/{step}", status_code=202, response_model=JobSubmittedResponse)
+async def submit_step_job(
+    step: Literal["dedupe", "classify", "analyze", "message", "send_whatsapp"],
+    req: N8nItemsRequest,
+    watermark: bool = True,
+    commit_watermark: bool = False,
+    _: None = Depends(require_api_key),
+) -> JSONResponse:
+    # Тот же вход, что у /step/{step}; query-параметры шага сохраняются вместе с заданием
+    _require_jobs()
+    if step == "send_whatsapp":
+        _require_send(commit_watermark)
+    params = {"watermark": watermark, "commit_watermark": commit_watermark}
+    return await _submit_job(step, req.model_dump(), params, sends=step == "send_whatsapp")
 
 
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str, items: bool = True, _: None = Depends(require_api_key)) -> dict:
+    # ?items=false — только статус и прогресс, без готовых item-ов (лёгкий опрос)
+    _require_jobs()
+    job = await asyncio.to_thread(job_queue.get, job_id, with_items=items)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
@@ -0,0 +1,154 @@
+"""
+Пиковый RSS на МБ вложения: путь "inline_data в Gemini + документ в Whapi" до и после
+однократного декодирования вложений.
+
+- before — повтор старой логики: decode в extract, encode обратно в base64 для Gemini,
+  ещё один decode в whapi_client.send_document;
+- after — текущий код сервиса (`step_analyze_attachment` + `send_document`) с httpx MockTransport
+  вместо настоящих Gemini/Whapi.
+
+Каждый замер — в отдельном процессе. Пик RSS перед замером сбрасывается через
+/proc/self/clear_refs (Linux), иначе в него попадает генерация входных данных;
+дополнительно пишем пик Python-аллокаций по tracemalloc.
+
+    python -m benchmarks.attachment_memory --sizes 1 5 20 [--json out.json]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import gc
+import json
+import os
+import subprocess
+import sys
+import tracemalloc
+
+from benchmarks.rss import current_rss_mb, max_rss_mb, reset_peak_rss
+
+
+def _input_base64(size_mb: int) -> str:
+    # Случайные байты не сжимаются и не интернируются — как настоящий скан
+    return base64.b64encode(os.urandom(size_mb * 1024 * 1024)).decode("ascii")
+
+
+async def _run_before(data_base64: str) -> None:
+    import httpx
+
+    from gl_service.gemini_client import _prompt_for_inline
+
+    def gemini(request: httpx.Request) -> httpx.Response:
+        request.read()
+        return httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": "{}"}]}}]})
+
+    def whapi(request: httpx.Request) -> httpx.Response:
+        request.read()
+        return httpx.Response(200, json={"id": "x"})
+
+    # extract_from_attachment: decode, raw_bytes живёт в Extracted до конца шага
+    raw = base64.b64decode(data_base64, validate=False)
+    # gemini_generate_from_inline_file: encode обратно
+    encoded = base64.b64encode(raw).decode("ascii")
+    prompt = _prompt_for_inline("", "")
+    payload = {"contents": [{"parts": [{"text": prompt}, {"inline_data": {"mime_type": "image/jpeg", "data": encoded}}]}]}
+    async with httpx.AsyncClient(transport=httpx.MockTransport(gemini)) as client:
+        await client.post("https://gemini.local/generate", json=payload)
+    del encoded, payload
+    # whapi_client.send_document: ещё один decode
+    raw2 = base64.b64decode(data_base64, validate=False)
+    async with httpx.AsyncClient(transport=httpx.MockTransport(whapi)) as client:
+        await client.post("https://whapi.local/messages/document", data={"to": "x"}, files={"media": ("f.jpg", raw2, "image/jpeg")})
+    del raw, raw2
+
+
+async def _run_after(data_base64: str) -> None:
+    import httpx
+
+    from gl_service.http_clients import http_clients
+    from gl_service.models import Attachment, Email
+    from gl_service.steps import step_analyze_attachment
+    from gl_service.whapi_client import send_document
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        request.read()
+        if "generateContent" in request.url.path:
+            return httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": "{}"}]}}]})
+        return httpx.Response(200, json={"id": "x"})
+
+    for name in ("gemini", "whapi"):
+        http_clients._clients[name] = httpx.AsyncClient(
+            base_url=f"https://{name}.local", transport=httpx.MockTransport(handler)
+        )
+
+    att = Attachment(file_name="scan.jpg", mime_type="image/jpeg", data_base64=data_base64)
+    email = Email(id="bench", attachment=att)
+    await step_analyze_attachment(email)
+    await send_document(to="x", caption="bench", attachment=att)
+    await http_clients.aclose()
+
+
+def _child(variant: str, size_mb: int) -> None:
+    # Настройки читаются при импорте gl_service
+    os.environ.setdefault("GL_GEMINI_API_KEY", "bench")
+    os.environ.setdefault("GL_WHAPI_TOKEN", "bench")
+    os.environ["GL_ANALYSIS_CACHE_ENABLED"] = "false"
+    os.environ["GL_EXTRACT_WORKERS"] = "0"
+
+    data_base64 = _input_base64(size_mb)
+    # Прогреваем импорты, чтобы они не попали в дельту
+    import httpx  # noqa: F401
+    import gl_service.steps  # noqa: F401
+    import gl_service.whapi_client  # noqa: F401
+
+    gc.collect()
+    reset_peak_rss()
+    base = current_rss_mb()
+    tracemalloc.start()
+    asyncio.run(_run_before(data_base64) if variant == "before" else _run_after(data_base64))
+    _, py_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    peak = max_rss_mb()
+    print(json.dumps({
+        "variant": variant,
+        "size_mb": size_mb,
+        "peak_rss_delta_mb": round(peak - base, 1),
+        "peak_py_alloc_mb": round(py_peak / 1024 / 1024, 1),
+    }))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", type=int, nargs="+", default=[1, 5, 20], help="размеры вложений, МБ")
+    ap.add_argument("--json", help="куда записать результаты (JSON)")
+    ap.add_argument("--child", nargs=2, metavar=("VARIANT", "SIZE_MB"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        _child(args.child[0], int(args.child[1]))
+        return
+
+    rows = []
+    for size in args.sizes:
+        for variant in ("before", "after"):
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.attachment_memory", "--child", variant, str(size)],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            row = json.loads(out.strip().splitlines()[-1])
+            row["rss_per_attachment_mb"] = round(row["peak_rss_delta_mb"] / size, 2)
+            rows.append(row)
+            print(f"{variant:>6}  {size:>4} MB  peak ΔRSS {row['peak_rss_delta_mb']:>7.1f} MB  "
+                  f"({row['rss_per_attachment_mb']:.2f} MB per MB)  "
+                  f"python peak {row['peak_py_alloc_mb']:>7.1f} MB")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
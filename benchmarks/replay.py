@@ -0,0 +1,203 @@
+"""
+Воспроизведение записанного трафика n8n (GL_CAPTURE_PATH) против сервиса.
+
+Запросы уходят с исходными интервалами, ускоренными в `--speed` раз (`1`, `10`, ...), или
+`--speed max` — все сразу с ограничением `--concurrency`. Вложения берутся из каталога
+GL_CAPTURE_ATTACHMENTS_DIR по sha256; если файла нет — подставляются случайные байты того же
+размера (форма нагрузки сохраняется, содержимое — нет).
+
+Без `--target` сервис поднимается в этом же процессе с заглушками OpenAI/Gemini/Whapi
+(`benchmarks.stubs`). С `--target` — запросы идут в запущенный инстанс: его upstream-ы должны
+смотреть на заглушки (см. README), иначе воспроизведение отправит сообщения в WhatsApp.
+
+    python -m benchmarks.replay capture.jsonl --attachments /data/capture_att --speed 10 [--json out.json]
+    python -m benchmarks.replay capture.jsonl --target http://127.0.0.1:8000 --speed max --concurrency 8
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from benchmarks.stubs import add_profile_args, create_app, install, profiles_from_args
+from benchmarks.throughput import _percentile
+
+
+def load_capture(path: str, paths: list[str] | None = None) -> list[dict]:
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            if paths and not any(rec["path"].startswith(p) for p in paths):
+                continue
+            records.append(rec)
+    records.sort(key=lambda r: r["ts"])
+    return records
+
+
+def _attachment_data(att: dict, attachments_dir: Path | None) -> str | None:
+    digest = att.get("sha256")
+    if not digest:
+        return None
+    if attachments_dir is not None:
+        path = attachments_dir / digest[:2] / digest
+        if path.exists():
+            return base64.b64encode(path.read_bytes()).decode("ascii")
+    return base64.b64encode(os.urandom(int(att.get("size") or att.get("fileSize") or 0))).decode("ascii")
+
+
+def rehydrate(body: object, attachments_dir: Path | None) -> object:
+    """Тело запроса из записи: `sha256`/`size` вложений снова превращаются в base64 `data`."""
+
+    if not (isinstance(body, dict) and isinstance(body.get("items"), list)):
+        return body
+    items = []
+    for it in body["items"]:
+        bn = it.get("binary") if isinstance(it, dict) else None
+        if isinstance(bn, dict):
+            new_bn = {}
+            for key, att in bn.items():
+                if key.startswith("attachment_") and isinstance(att, dict) and "sha256" in att:
+                    att = {k: v for k, v in att.items() if k not in ("sha256", "size")}
+                    att["data"] = _attachment_data(bn[key], attachments_dir)
+                new_bn[key] = att
+            it = {**it, "binary": new_bn}
+        items.append(it)
+    return {**body, "items": items}
+
+
+async def replay(client, records: list[dict], *, speed: float | None, concurrency: int,
+                 attachments_dir: Path | None, api_key: str | None) -> dict:
+    sem = asyncio.Semaphore(concurrency if speed is None else 10_000)
+    by_path: dict[str, list[float]] = defaultdict(list)
+    errors: dict[str, int] = defaultdict(int)
+    items: dict[str, int] = defaultdict(int)
+    lag: list[float] = []
+    t0 = records[0]["ts"] if records else 0.0
+    started = time.perf_counter()
+
+    async def one(rec: dict) -> None:
+        if speed is not None:
+            due = (rec["ts"] - t0) / speed
+            await asyncio.sleep(max(0.0, due - (time.perf_counter() - started)))
+            lag.append(max(0.0, time.perf_counter() - started - due) * 1000)
+        body = rehydrate(rec.get("body"), attachments_dir)
+        headers = {}
+        if rec.get("accept"):
+            headers["Accept"] = rec["accept"]
+        if api_key:
+            headers["X-API-Key"] = api_key
+        url = rec["path"] + (f"?{rec['query']}" if rec.get("query") else "")
+        async with sem:
+            t = time.perf_counter()
+            try:
+                resp = await client.post(url, json=body, headers=headers)
+                await resp.aread()
+                failed = resp.status_code >= 400
+            except Exception as e:
+                print(f"❌ {rec['path']}: {e!r}", file=sys.stderr)
+                failed = True
+            by_path[rec["path"]].append((time.perf_counter() - t) * 1000)
+        errors[rec["path"]] += failed
+        if isinstance(body, dict) and isinstance(body.get("items"), list):
+            items[rec["path"]] += len(body["items"])
+
+    await asyncio.gather(*(one(r) for r in records))
+    wall = time.perf_counter() - started
+    rows = []
+    for path, lat in sorted(by_path.items()):
+        lat.sort()
+        rows.append({
+            "path": path,
+            "requests": len(lat),
+            "items": items[path],
+            "errors": errors[path],
+            "p50_ms": _percentile(lat, 50),
+            "p95_ms": _percentile(lat, 95),
+            "p99_ms": _percentile(lat, 99),
+        })
+    lag.sort()
+    return {
+        "requests": len(records),
+        "wall_s": round(wall, 3),
+        "requests_per_s": round(len(records) / wall, 2) if wall else None,
+        "schedule_lag_p95_ms": _percentile(lag, 95) if lag else None,
+        "paths": rows,
+    }
+
+
+async def _run(args: argparse.Namespace, records: list[dict]) -> dict:
+    import httpx
+
+    speed = None if args.speed == "max" else float(args.speed)
+    attachments_dir = Path(args.attachments) if args.attachments else None
+    opts = dict(speed=speed, concurrency=args.concurrency, attachments_dir=attachments_dir, api_key=args.api_key)
+    if args.target:
+        async with httpx.AsyncClient(base_url=args.target, timeout=None) as client:
+            return await replay(client, records, **opts)
+
+    from app import app
+    from gl_service.http_clients import http_clients
+
+    install(http_clients, create_app(profiles_from_args(args)))
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://service", timeout=None) as client:
+            return await replay(client, records, **opts)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("capture", help="JSONL из GL_CAPTURE_PATH")
+    ap.add_argument("--attachments", help="каталог GL_CAPTURE_ATTACHMENTS_DIR")
+    ap.add_argument("--target", help="URL запущенного сервиса (по умолчанию — в этом процессе с заглушками)")
+    ap.add_argument("--speed", default="1", help="ускорение: 1, 10, ... или max")
+    ap.add_argument("--concurrency", type=int, default=16, help="параллельных запросов при --speed max")
+    ap.add_argument("--paths", nargs="+", help="только эти пути (префиксы), например /step/analyze")
+    ap.add_argument("--api-key", default=os.environ.get("GL_API_KEY"), help="X-API-Key (по умолчанию GL_API_KEY)")
+    ap.add_argument("--json", help="куда записать результаты (JSON)")
+    add_profile_args(ap)
+    args = ap.parse_args()
+    if args.speed != "max" and float(args.speed) <= 0:
+        ap.error("--speed must be positive or 'max'")
+
+    if not args.target:
+        # Как в benchmarks.throughput: настройки читаются при импорте app
+        os.environ.update(
+            GL_OPENAI_API_KEY="replay",
+            GL_GEMINI_API_KEY="replay",
+            GL_WHAPI_TOKEN="replay",
+            GL_WHAPI_TO="replay@g.us",
+            GL_HTTP_PREWARM="false",
+            GL_LLM_RETRY_BASE_S="0.05",
+        )
+        for key in ("GL_API_KEY", "GL_CAPTURE_PATH", "GL_SEND_QUEUE_DB", "GL_SEND_LEDGER_DB", "GL_WATERMARK_DB"):
+            os.environ.pop(key, None)
+        args.api_key = None
+
+    records = load_capture(args.capture, args.paths)
+    if not records:
+        ap.error(f"no records in {args.capture}")
+    result = {"config": {k: v for k, v in vars(args).items() if k not in ("json", "api_key")}}
+    result.update(asyncio.run(_run(args, records)))
+    for row in result["paths"]:
+        print(f"{row['path']:>20}  {row['requests']:>5} req  p50 {row['p50_ms']:>8} ms  p95 {row['p95_ms']:>8} ms  "
+              f"p99 {row['p99_ms']:>8} ms  errors {row['errors']}", file=sys.stderr)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    else:
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Пиковый и текущий RSS процесса и его дочерних процессов (Linux /proc, с запасным вариантом через getrusage)."""
+
+from __future__ import annotations
+
+import os
+import resource
+import sys
+
+
+def child_pids() -> list[int]:
+    """Живые дочерние процессы (воркеры ExtractPool); без /proc — пустой список."""
+
+    pids: list[int] = []
+    try:
+        for tid in os.listdir("/proc/self/task"):
+            with open(f"/proc/self/task/{tid}/children") as f:
+                pids.extend(int(p) for p in f.read().split())
+    except OSError:
+        pass
+    return pids
+
+
+def _vm_hwm_kb(pid: int | str) -> int | None:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def reset_peak_rss() -> None:
+    # Сбрасывает VmHWM свой и дочерних процессов: иначе в пик попадает всё, что было до замера
+    # (генерация входных данных, прошлый endpoint)
+    for pid in ["self", *child_pids()]:
+        try:
+            with open(f"/proc/{pid}/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            pass
+
+
+def _ru_maxrss_mb(who: int) -> float:
+    # ru_maxrss: Linux — KiB, macOS — байты; сбросить его нельзя
+    rss = resource.getrusage(who).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == "darwin" else rss / 1024
+
+
+def max_rss_mb() -> float:
+    """Пиковый RSS только этого процесса."""
+
+    kb = _vm_hwm_kb("self")
+    return kb / 1024 if kb is not None else _ru_maxrss_mb(resource.RUSAGE_SELF)
+
+
+def children_max_rss_mb() -> float:
+    """
+    Сумма пиковых RSS живых дочерних процессов (с последнего `reset_peak_rss`). Сумма пиков —
+    оценка сверху: воркеры могли достигать пика в разное время. Без /proc — ru_maxrss
+    RUSAGE_CHILDREN: пик самого большого из завершённых дочерних процессов за всё время.
+    """
+
+    pids = child_pids()
+    if not pids and not os.path.exists("/proc/self/status"):
+        return _ru_maxrss_mb(resource.RUSAGE_CHILDREN)
+    return sum(kb for pid in pids if (kb := _vm_hwm_kb(pid)) is not None) / 1024
+
+
+def current_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return max_rss_mb()
@@ -0,0 +1,115 @@
+"""
+Время извлечения текста из RTF с встроенными картинками: старый путь (decode UTF-8 → cp1251,
+striprtf по всему файлу) против текущего `extract_text("rtf", ...)` (вырезание `\\pict`/`\\objdata`,
+кодировка из `\\ansicpg`).
+
+Документ — как у страховых: cp1251-текст письма через `\\'hh`, логотип в шапке и подпись/печать
+как hex-картинки, плюс OLE-объект; размер задаётся объёмом картинок.
+
+    python -m benchmarks.rtf_extract --sizes 1 5 20 [--repeat 3] [--json out.json]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+
+from striprtf.striprtf import rtf_to_text
+
+from gl_service.extract import extract_text
+
+
+_LETTER = (
+    "Гарантийное письмо № 4512/ДМС\n"
+    "ООО \"Страховая компания\" гарантирует оплату медицинских услуг пациенту Иванову Ивану Ивановичу, "
+    "полис ДМС № 0099-887766, срок действия с 01.02.2025 по 31.12.2025. Лимит 150 000 руб.\n"
+)
+
+
+def _rtf_escape(text: str) -> str:
+    out = []
+    for ch in text:
+        if ch == "\n":
+            out.append("\\par\n")
+        elif ord(ch) < 128:
+            out.append(ch)
+        else:
+            out.append("\\'%02x" % ch.encode("cp1251")[0])
+    return "".join(out)
+
+
+def _picture(size: int) -> str:
+    # hex по 128 символов в строке — как пишут Word и генераторы писем
+    data = os.urandom(size // 2).hex()
+    lines = "\n".join(data[i : i + 128] for i in range(0, len(data), 128))
+    return "{\\pict{\\*\\picprop{\\sp{\\sn wzName}{\\sv logo}}}\\pngblip\\picw800\\pich200\n" + lines + "}"
+
+
+def make_rtf(size_mb: float) -> bytes:
+    blob = int(size_mb * 1024 * 1024)
+    body = _rtf_escape(_LETTER * 20)
+    doc = (
+        "{\\rtf1\\ansi\\ansicpg1251\\deff0{\\fonttbl{\\f0\\fswiss\\fcharset204 Arial;}}\n"
+        "{\\header " + _picture(blob // 4) + "}\n"
+        "\\f0\\fs22 " + body + "\n"
+        "{\\object\\objemb{\\*\\objclass Package}{\\*\\objdata " + os.urandom(blob // 8).hex() + "}"
+        "{\\result " + _rtf_escape("Вложение: печать") + "}}\n"
+        + _picture(blob // 2)
+        + "\\par }"
+    )
+    return doc.encode("ascii")
+
+
+def _before(raw: bytes) -> str:
+    # Повтор старой логики extract_text для RTF
+    decoded = raw.decode("utf-8", errors="ignore")
+    if not decoded.strip():
+        decoded = raw.decode("cp1251", errors="ignore")
+    return (rtf_to_text(decoded) or "").strip()
+
+
+def _after(raw: bytes) -> str:
+    return extract_text("rtf", raw)
+
+
+def _best_time(fn, raw: bytes, repeat: int) -> tuple[float, str]:
+    best, text = float("inf"), ""
+    for _ in range(repeat):
+        started = time.perf_counter()
+        text = fn(raw)
+        best = min(best, time.perf_counter() - started)
+    return best, text
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", type=float, nargs="+", default=[1, 5, 20], help="размер документа, МБ")
+    ap.add_argument("--repeat", type=int, default=3, help="повторов на замер (берётся лучший)")
+    ap.add_argument("--json", help="куда записать результаты (JSON)")
+    args = ap.parse_args()
+
+    rows = []
+    for size in args.sizes:
+        raw = make_rtf(size)
+        for variant, fn in (("before", _before), ("after", _after)):
+            elapsed, text = _best_time(fn, raw, args.repeat)
+            row = {
+                "variant": variant,
+                "size_mb": round(len(raw) / 1024 / 1024, 2),
+                "seconds": round(elapsed, 4),
+                "text_chars": len(text),
+                "has_letter": "Иванову Ивану" in text,
+            }
+            rows.append(row)
+            print(f"{variant:>6}  {row['size_mb']:>6.2f} MB  {row['seconds']:>8.4f} s  "
+                  f"{row['text_chars']:>6} chars  letter found: {row['has_letter']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
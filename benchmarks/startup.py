@@ -0,0 +1,134 @@
+"""
+Профиль холодного старта: время импорта `app` по модулям (`python -X importtime`) и время
+от запуска интерпретатора до ответа `/health`. Каждый прогон — новый процесс.
+
+Для CI: `--max-import-ms` — падать, если медиана импорта `app` больше порога; модули из `--lazy`
+(по умолчанию pdfminer и striprtf) не должны импортироваться вместе с `app` — их грузят при первом
+документе или в фоновом прогреве (GL_WARMUP).
+
+    python -m benchmarks.startup --runs 5 --top 20 [--max-import-ms 1500] [--json out.json]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+_IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+# Старт приложения как у uvicorn (lifespan) + первый /health; без сети и прогрева
+_HEALTH_SCRIPT = """
+import asyncio, httpx
+from app import app
+
+async def main():
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://service") as client:
+            assert (await client.get("/health")).status_code == 200
+
+asyncio.run(main())
+"""
+
+
+def _env() -> dict[str, str]:
+    env = {k: v for k, v in os.environ.items() if not k.startswith("GL_")}
+    # Без фоновых задач старта: меряем только путь до первого ответа
+    env.update(GL_HTTP_PREWARM="false", GL_WARMUP="false", GL_EXTRACT_WORKERS="0")
+    return env
+
+
+def import_profile() -> dict[str, tuple[int, int, int]]:
+    """{модуль: (self мкс, cumulative мкс, глубина вложенности)} для одного `import app`."""
+
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        capture_output=True,
+        text=True,
+        env=_env(),
+    )
+    if proc.returncode != 0:
+        # Сам импорт упал — показываем ошибку, а не профиль
+        sys.exit(proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"import app: exit {proc.returncode}")
+    out = {}
+    for line in proc.stderr.splitlines():
+        m = _IMPORTTIME_RE.match(line)
+        if m:
+            out[m.group(4)] = (int(m.group(1)), int(m.group(2)), len(m.group(3)) // 2)
+    return out
+
+
+def health_ms() -> float:
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", _HEALTH_SCRIPT], env=_env(), check=True, capture_output=True)
+    return (time.perf_counter() - started) * 1000
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--top", type=int, default=20, help="сколько модулей показать")
+    ap.add_argument("--lazy", nargs="*", default=["pdfminer", "striprtf"], help="пакеты, которых не должно быть в импорте app")
+    ap.add_argument("--max-import-ms", type=float, help="порог медианы импорта app, мс")
+    ap.add_argument("--json", help="куда записать результаты (JSON)")
+    args = ap.parse_args()
+
+    runs = [import_profile() for _ in range(args.runs)]
+    self_us: dict[str, list[int]] = defaultdict(list)
+    cum_us: dict[str, list[int]] = defaultdict(list)
+    depth: dict[str, int] = {}
+    for run in runs:
+        for name, (s, c, d) in run.items():
+            self_us[name].append(s)
+            cum_us[name].append(c)
+            depth[name] = d
+    modules = [
+        {
+            "module": name,
+            "self_ms": round(statistics.median(self_us[name]) / 1000, 1),
+            "cumulative_ms": round(statistics.median(cum_us[name]) / 1000, 1),
+            "depth": depth[name],
+        }
+        for name in cum_us
+    ]
+    modules.sort(key=lambda m: -m["cumulative_ms"])
+    import_ms = next((m["cumulative_ms"] for m in modules if m["module"] == "app"), 0.0)
+    health = [health_ms() for _ in range(args.runs)]
+    eager = sorted({name.split(".")[0] for run in runs for name in run} & set(args.lazy))
+
+    print(f"import app: {import_ms} ms (median of {args.runs}), "
+          f"process start → /health: {round(statistics.median(health), 1)} ms", file=sys.stderr)
+    print(f"{'cumulative':>11} {'self':>8}  module", file=sys.stderr)
+    for m in modules[: args.top]:
+        print(f"{m['cumulative_ms']:>8} ms {m['self_ms']:>5} ms  {'  ' * m['depth']}{m['module']}", file=sys.stderr)
+
+    result = {
+        "config": {k: v for k, v in vars(args).items() if k != "json"},
+        "import_app_ms": import_ms,
+        "health_ms": round(statistics.median(health), 1),
+        "eager_lazy_modules": eager,
+        "modules": modules,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+    failed = False
+    if eager:
+        print(f"❌ imported at startup, expected lazy: {', '.join(eager)}", file=sys.stderr)
+        failed = True
+    if args.max_import_ms is not None and import_ms > args.max_import_ms:
+        print(f"❌ import app {import_ms} ms > {args.max_import_ms} ms", file=sys.stderr)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Локальные заглушки OpenAI (chat/completions), Gemini (generateContent) и Whapi (messages/text,
+messages/document) с настраиваемой задержкой и долей ошибок.
+
+Одно ASGI-приложение: в бенчмарках подключается к `http_clients` через `httpx.ASGITransport`
+(без сети), а для ручной проверки сервиса запускается как обычный HTTP-сервер:
+
+    python -m benchmarks.stubs --port 8999 --openai-ms 300 --gemini-ms 1500 --error-rate 0.05
+    GL_OPENAI_BASE_URL=http://127.0.0.1:8999/v1 GL_GEMINI_BASE_URL=http://127.0.0.1:8999/v1beta \\
+    GL_WHAPI_BASE_URL=http://127.0.0.1:8999 uvicorn app:app
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import re
+from collections import Counter
+from dataclasses import dataclass
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+@dataclass(frozen=True)
+class Profile:
+    """
+    Поведение одного upstream-а: задержка ~ логнормальная с медианой `latency_ms`
+    (разброс `sigma`), доля ответов-ошибок `error_rate` со статусами из `error_statuses`.
+    """
+
+    latency_ms: float = 0.0
+    sigma: float = 0.3
+    error_rate: float = 0.0
+    error_statuses: tuple[int, ...] = (429, 503)
+
+    def delay_s(self) -> float:
+        if self.latency_ms <= 0:
+            return 0.0
+        return random.lognormvariate(0, self.sigma) * self.latency_ms / 1000
+
+    def error(self) -> int | None:
+        if self.error_rate > 0 and random.random() < self.error_rate:
+            return random.choice(self.error_statuses)
+        return None
+
+
+_BATCH_ID_RE = re.compile(r'"id": "([^"]+)"')
+
+_GEMINI_ANSWER = {
+    "insurance_company": "СК Стаб",
+    "patient_name": "Иванов Иван Иванович",
+    "policy_number": "0099-887766",
+    "services": "консультации, диагностика",
+    "valid_until": "31.12.2025",
+    "summary": "Гарантийное письмо на амбулаторное обслуживание.",
+}
+
+
+def create_app(profiles: dict[str, Profile]) -> FastAPI:
+    """Профили по именам upstream-ов: "openai", "gemini", "whapi" (нет — без задержек и ошибок)."""
+
+    app = FastAPI(title="GL upstream stubs")
+    app.state.calls = Counter()
+
+    async def behave(upstream: str) -> JSONResponse | None:
+        profile = profiles.get(upstream, Profile())
+        await asyncio.sleep(profile.delay_s())
+        app.state.calls[upstream] += 1
+        status = profile.error()
+        if status is not None:
+            app.state.calls[f"{upstream}_{status}"] += 1
+            return JSONResponse({"error": {"code": status, "message": "stub error"}}, status_code=status)
+        return None
+
+    @app.get("/calls")
+    async def calls() -> dict[str, int]:
+        return dict(app.state.calls)
+
+    @app.post("/{prefix:path}/chat/completions")
+    async def chat(prefix: str, request: Request):
+        if (err := await behave("openai")) is not None:
+            return err
+        prompt = (await request.json())["messages"][-1]["content"]
+        if '"results"' in prompt:
+            # Батч-классификация: по ответу на каждый id из промпта
+            content = {"results": [{"id": i, "is_guarantee_letter": True} for i in _BATCH_ID_RE.findall(prompt)]}
+        else:
+            content = {"is_guarantee_letter": True}
+        return {"choices": [{"message": {"role": "assistant", "content": json.dumps(content)}}]}
+
+    @app.post("/{prefix:path}/models/{model}:generateContent")
+    async def generate(prefix: str, model: str, request: Request):
+        await request.body()
+        if (err := await behave("gemini")) is not None:
+            return err
+        text = json.dumps(_GEMINI_ANSWER, ensure_ascii=False)
+        return {"candidates": [{"content": {"parts": [{"text": text}]}}]}
+
+    @app.post("/messages/{kind}")
+    async def whapi(kind: str, request: Request):
+        await request.body()
+        if (err := await behave("whapi")) is not None:
+            return err
+        return {"sent": True, "message": {"id": f"stub-{kind}-{app.state.calls['whapi']}"}}
+
+    @app.head("/{path:path}")
+    async def head(path: str) -> dict:
+        return {}
+
+    return app
+
+
+def install(http_clients, app: FastAPI) -> None:
+    """Подменяет клиенты `gl_service.http_clients` на in-process транспорт к заглушкам."""
+
+    from gl_service.http_clients import _base_url
+
+    transport = httpx.ASGITransport(app=app)
+    for name in ("openai", "gemini", "whapi"):
+        http_clients._clients[name] = httpx.AsyncClient(base_url=_base_url(name), transport=transport)
+
+
+def add_profile_args(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument("--openai-ms", type=float, default=300, help="медианная задержка OpenAI, мс")
+    ap.add_argument("--gemini-ms", type=float, default=1500, help="медианная задержка Gemini, мс")
+    ap.add_argument("--whapi-ms", type=float, default=200, help="медианная задержка Whapi, мс")
+    ap.add_argument("--sigma", type=float, default=0.3, help="разброс задержек (σ логнормального)")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 429/503 у каждого upstream-а")
+
+
+def profiles_from_args(args: argparse.Namespace) -> dict[str, Profile]:
+    return {
+        name: Profile(latency_ms=ms, sigma=args.sigma, error_rate=args.error_rate)
+        for name, ms in (("openai", args.openai_ms), ("gemini", args.gemini_ms), ("whapi", args.whapi_ms))
+    }
+
+
+def main() -> None:
+    import uvicorn
+
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8999)
+    add_profile_args(ap)
+    args = ap.parse_args()
+    uvicorn.run(create_app(profiles_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+Пропускная способность шагов сервиса без настоящих API: OpenAI, Gemini и Whapi заменены
+заглушками (`benchmarks.stubs`) с заданной задержкой и долей ошибок, вход — синтетические
+item-ы Gmail с PDF / RTF / картинками разного размера.
+
+По каждому endpoint-у: items/sec, p50/p95/p99 задержки запроса, пиковый RSS (VmHWM,
+сбрасывается перед каждым endpoint-ом): `peak_rss_mb` — только главный процесс,
+`peak_rss_children_mb` — сумма пиков воркеров ExtractPool (PDF/RTF разбираются там),
+`peak_rss_total_mb` — их сумма. Воркер, пересозданный посреди замера (таймаут,
+GL_EXTRACT_MAX_TASKS_PER_CHILD), в сумму не попадает. Результат — JSON для сравнения между коммитами.
+
+    python -m benchmarks.throughput --requests 20 --batch 10 --concurrency 4 \\
+        --sizes-kb 50 500 2000 --gemini-ms 1500 --error-rate 0.02 --json out.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import sys
+import time
+
+from benchmarks.rss import children_max_rss_mb, max_rss_mb, reset_peak_rss
+from benchmarks.stubs import add_profile_args, create_app, install, profiles_from_args
+
+
+ENDPOINTS = ("dedupe", "classify", "analyze", "message", "send_whatsapp", "pipeline")
+KINDS = ("pdf", "rtf", "image")
+
+_LETTER_LINES = [
+    "Гарантийное письмо № {n}/ДМС",
+    "Страховая компания гарантирует оплату медицинских услуг",
+    "Пациент: Иванов Иван Иванович, полис ДМС № 0099-{n}",
+    "Срок действия: с 01.02.2025 по 31.12.2025. Лимит 150 000 руб.",
+]
+
+
+def make_pdf(lines: list[str], pad_bytes: int = 0) -> bytes:
+    """
+    Одностраничный PDF с текстовым слоем (Helvetica, латиница) + неиспользуемый поток
+    на `pad_bytes` — "вес" встроенных шрифтов и картинок.
+    """
+
+    content = "".join(f"BT /F1 11 Tf 60 {760 - 16 * i} Td ({ln}) Tj ET\n" for i, ln in enumerate(lines))
+    pad = os.urandom(pad_bytes // 2).hex() if pad_bytes else ""
+    objs = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 5 0 R >> >> /Contents 4 0 R >>",
+        f"<< /Length {len(content)} >>\nstream\n{content}endstream",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        f"<< /Length {len(pad)} >>\nstream\n{pad}\nendstream",
+    ]
+    out, offsets = "%PDF-1.4\n", []
+    for i, obj in enumerate(objs):
+        offsets.append(len(out))
+        out += f"{i + 1} 0 obj\n{obj}\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objs) + 1}\n0000000000 65535 f \n" + "".join(f"{o:010d} 00000 n \n" for o in offsets)
+    out += f"trailer\n<< /Size {len(objs) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    return out.encode("latin-1")
+
+
+def make_attachment(kind: str, size_kb: int, n: int) -> dict:
+    if kind == "pdf":
+        lines = ["Guarantee letter No %d" % n, "Patient Ivanov I.I., policy 0099-%d" % n, "Valid until 31.12.2025"]
+        raw, mime, ext = make_pdf(lines, pad_bytes=size_kb * 1024), "application/pdf", "pdf"
+    elif kind == "rtf":
+        from benchmarks.rtf_extract import make_rtf
+
+        raw, mime, ext = make_rtf(size_kb / 1024), "application/rtf", "rtf"
+    else:
+        # Скан: случайные байты не сжимаются — как настоящий JPEG
+        raw, mime, ext = b"\xff\xd8\xff\xe0" + os.urandom(size_kb * 1024), "image/jpeg", "jpg"
+    return {
+        "data": base64.b64encode(raw).decode("ascii"),
+        "mimeType": mime,
+        "fileName": f"letter_{n}.{ext}",
+        "fileExtension": ext,
+        "fileSize": len(raw),
+    }
+
+
+def make_items(count: int, *, kinds: list[str], sizes_kb: list[int], seed: int) -> list[dict]:
+    """Синтетические item-ы узла Gmail: по вложению на письмо, типы и размеры по кругу/случайно."""
+
+    rnd = random.Random(seed)
+    items = []
+    for n in range(count):
+        letter = "\n".join(line.format(n=n) for line in _LETTER_LINES)
+        items.append({
+            "json": {
+                "id": f"msg-{seed}-{n}",
+                "threadId": f"thr-{seed}-{n % max(1, count // 2)}",
+                # Нейтральные темы: решает OpenAI, а не локальные правила
+                "subject": f"Письмо по пациенту {n}",
+                "from": "ДМС <dms@insurer.example>",
+                "snippet": letter[:200],
+                "date": f"2025-03-{1 + n % 28:02d}T10:{n % 60:02d}:00Z",
+                "labelIds": ["INBOX"],
+                "message_text": letter,
+                "ai_response": {"policy_number": f"0099-{n}", "summary": "Гарантийное письмо"},
+            },
+            "binary": {"attachment_0": make_attachment(kinds[n % len(kinds)], rnd.choice(sizes_kb), n)},
+        })
+    return items
+
+
+def _percentile(sorted_ms: list[float], q: float) -> float:
+    if not sorted_ms:
+        return 0.0
+    idx = min(len(sorted_ms) - 1, max(0, int(round(q / 100 * len(sorted_ms) + 0.5)) - 1))
+    return round(sorted_ms[idx], 1)
+
+
+async def _run_endpoint(client, endpoint: str, batches: list[list[dict]], concurrency: int) -> dict:
+    path = "/pipeline" if endpoint == "pipeline" else f"/step/{endpoint}"
+    body_extra = {"send": True} if endpoint == "pipeline" else {}
+    sem = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    errors = 0
+
+    async def one(batch: list[dict]) -> None:
+        nonlocal errors
+        async with sem:
+            started = time.perf_counter()
+            resp = await client.post(path, json={"items": batch, **body_extra})
+            latencies.append((time.perf_counter() - started) * 1000)
+            if resp.status_code >= 400:
+                errors += 1
+
+    reset_peak_rss()
+    started = time.perf_counter()
+    await asyncio.gather(*(one(b) for b in batches))
+    wall = time.perf_counter() - started
+    items = sum(len(b) for b in batches)
+    latencies.sort()
+    main_rss, children_rss = max_rss_mb(), children_max_rss_mb()
+    return {
+        "endpoint": endpoint,
+        "requests": len(batches),
+        "items": items,
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "items_per_s": round(items / wall, 2) if wall else None,
+        "p50_ms": _percentile(latencies, 50),
+        "p95_ms": _percentile(latencies, 95),
+        "p99_ms": _percentile(latencies, 99),
+        "peak_rss_mb": round(main_rss, 1),
+        "peak_rss_children_mb": round(children_rss, 1),
+        "peak_rss_total_mb": round(main_rss + children_rss, 1),
+    }
+
+
+async def _bench(args: argparse.Namespace) -> list[dict]:
+    import httpx
+
+    from app import app
+    from gl_service.http_clients import http_clients
+
+    install(http_clients, create_app(profiles_from_args(args)))
+    rows = []
+    async with app.router.lifespan_context(app):
+        # 500 сервиса — это строка "errors" в отчёте, а не исключение в бенчмарке
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://service", timeout=None) as client:
+            for i, endpoint in enumerate(args.endpoints):
+                batches = [
+                    make_items(args.batch, kinds=args.kinds, sizes_kb=args.sizes_kb, seed=i * 10_000 + r)
+                    for r in range(args.requests)
+                ]
+                row = await _run_endpoint(client, endpoint, batches, args.concurrency)
+                rows.append(row)
+                print(f"{endpoint:>14}  {row['items_per_s']:>8} items/s  p50 {row['p50_ms']:>8} ms  "
+                      f"p95 {row['p95_ms']:>8} ms  p99 {row['p99_ms']:>8} ms  "
+                      f"peak RSS {row['peak_rss_mb']:>7} + {row['peak_rss_children_mb']:>7} MB (workers)  errors {row['errors']}", file=sys.stderr)
+    return rows
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    ap.add_argument("--requests", type=int, default=20, help="запросов на endpoint")
+    ap.add_argument("--batch", type=int, default=10, help="item-ов в запросе")
+    ap.add_argument("--concurrency", type=int, default=4, help="параллельных запросов")
+    ap.add_argument("--kinds", nargs="+", choices=KINDS, default=list(KINDS), help="типы вложений")
+    ap.add_argument("--sizes-kb", type=int, nargs="+", default=[50, 500, 2000], help="размеры вложений, КБ")
+    ap.add_argument("--extract-workers", type=int, default=2, help="GL_EXTRACT_WORKERS")
+    ap.add_argument("--json", help="куда записать результаты (JSON)")
+    add_profile_args(ap)
+    args = ap.parse_args()
+
+    # Настройки читаются при импорте gl_service: задаём до импорта app.
+    # Кэши выключены — иначе повторные прогоны меряют кэш, а не путь запроса.
+    os.environ.update(
+        GL_OPENAI_API_KEY="bench",
+        GL_GEMINI_API_KEY="bench",
+        GL_WHAPI_TOKEN="bench",
+        GL_WHAPI_TO="bench@g.us",
+        GL_API_KEY="",
+        GL_HTTP_PREWARM="false",
+        GL_ANALYSIS_CACHE_ENABLED="false",
+        GL_CLASSIFY_CACHE_ENABLED="false",
+        GL_EXTRACT_WORKERS=str(args.extract_workers),
+        GL_LLM_RETRY_BASE_S="0.05",
+        GL_BLOB_REFS="false",
+    )
+    for key in ("GL_WATERMARK_DB", "GL_SEND_LEDGER_DB", "GL_SEND_QUEUE_DB", "GL_ANALYSIS_CACHE_PATH", "GL_CLASSIFY_CACHE_PATH"):
+        os.environ.pop(key, None)
+
+    rows = asyncio.run(_bench(args))
+    result = {
+        "config": {k: v for k, v in vars(args).items() if k != "json"},
+        "results": rows,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+    else:
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,6 @@
+# Корень репозитория в sys.path для `pytest` (как у `python -m pytest`). Настройки читаются при
+# импорте gl_service — тесты не должны подхватывать GL_* окружения разработчика (базы, токены).
+import os
+
+for _key in [k for k in os.environ if k.startswith("GL_")]:
+    del os.environ[_key]
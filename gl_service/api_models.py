@@ -21,8 +21,61 @@ class N8nItemsResponse(BaseModel):
     meta: dict[str, Any] = Field(default_factory=dict)
 
 
+class PipelineRequest(N8nItemsRequest):
+    """
+    Сырые item-ы Gmail + какие стадии запускать.
+    """
+
+    dedupe: bool = True
+    classify: bool = True
+    analyze: bool = True
+    message: bool = True
+    send: bool = False
+    # Сдвинуть водяные знаки тредов (GL_WATERMARK_DB) на успешно обработанные письма
+    commit_watermark: bool = False
+
+
+class PipelineResponse(BaseModel):
+    """
+    Компактные результаты по письмам (без binary): index, id, threadId, subject,
+    is_guarantee_letter, has_attachment, ai_response, message_text, sent / send_error.
+    """
+
+    items: list[dict[str, Any]] = Field(default_factory=list)
+    meta: dict[str, Any] = Field(default_factory=dict)
+
+
+class CacheInvalidateRequest(BaseModel):
+    """
+    Какие записи кэша сбросить: sha256 файлов (hex). Пусто/не задано — весь кэш.
+    """
+
+    sha256: list[str] | None = None
+
+
 class N8nSendResponse(BaseModel):
     sent: list[dict[str, Any]] = Field(default_factory=list)
     meta: dict[str, Any] = Field(default_factory=dict)
 
 
+class SendQueuedResponse(BaseModel):
+    """
+    Ответ 202 на `/step/send_whatsapp?queue=true`: по заданию на item с message_text —
+    {"index": позиция во входном items, "job_id": ...}. Статус: GET /send_queue/jobs/{job_id}.
+    """
+
+    jobs: list[dict[str, Any]] = Field(default_factory=list)
+    meta: dict[str, Any] = Field(default_factory=dict)
+
+
+
+
+class JobSubmittedResponse(BaseModel):
+    """
+    Ответ 202 на `POST /jobs/{step}`: id задания и число item-ов.
+    Прогресс и результаты: GET /jobs/{job_id}.
+    """
+
+    job_id: str
+    status: str = "queued"
+    total: int = 0
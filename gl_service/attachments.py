@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+import re
+
+from .blob_store import BlobStoreError, blob_store
+from .extract import Extracted, guess_mode
+from .models import Attachment
+
+
+# Не документы: подписи S/MIME, приглашения, визитки
+_SKIP_EXTENSIONS = {"p7s", "p7m", "asc", "sig", "ics", "vcf", "eml", "html", "htm"}
+_SKIP_MIME_PREFIXES = ("application/pkcs7", "application/x-pkcs7", "text/calendar", "text/vcard", "text/x-vcard", "text/html")
+# Картинки из подписи письма: image001.png, logo.jpg, соцсети
+_JUNK_IMAGE_NAME_RE = re.compile(
+    r"^(image\d{3}|logo|signature|podpis|подпись|banner|icon|facebook|vk|telegram|whatsapp|instagram)", re.I
+)
+# Имя файла намекает на само гарантийное письмо
+_LETTER_NAME_RE = re.compile(r"гарант|\bгп\b|guarantee|garant|письмо|letter|полис|направлени", re.I)
+# Картинки меньше — логотипы и иконки, а не сканы
+MIN_IMAGE_BYTES = 15_000
+
+
+def _size(att: Attachment) -> int:
+    # Без декодирования: fileSize из n8n, размер файла в blob store или оценка по длине base64
+    if att.file_size:
+        return att.file_size
+    if att.blob_ref:
+        try:
+            return blob_store.size(att.blob_ref)
+        except BlobStoreError:
+            # Блоба нет — ошибку покажет чтение вложения
+            return 0
+    return len(att.data_base64) * 3 // 4
+
+
+def _extension(att: Attachment) -> str:
+    ext = (att.file_extension or "").lower().lstrip(".")
+    if not ext and "." in att.file_name:
+        ext = att.file_name.rsplit(".", 1)[1].lower()
+    return ext
+
+
+def attachment_score(att: Attachment) -> float | None:
+    """
+    Дешёвая оценка "похоже на гарантийное письмо" по режиму, размеру и имени файла —
+    до декодирования и извлечения. None — вложение в анализ не берём.
+    """
+
+    ext = _extension(att)
+    mime = (att.mime_type or "").lower()
+    if ext in _SKIP_EXTENSIONS or mime.startswith(_SKIP_MIME_PREFIXES):
+        return None
+    size = _size(att)
+    mode = guess_mode(att)
+    is_image = mime.startswith("image/")
+    if is_image and (size < MIN_IMAGE_BYTES or _JUNK_IMAGE_NAME_RE.match(att.file_name)):
+        return None
+
+    score = {"pdf": 3.0, "rtf": 3.0}.get(mode, 2.0 if is_image else 1.0)
+    if _LETTER_NAME_RE.search(att.file_name):
+        score += 5.0
+    # При прочих равных крупный файл содержательнее (скан, многостраничный PDF); вклад ограничен
+    score += min(size / 1_000_000, 1.0)
+    return score
+
+
+def rank_attachments(attachments: list[Attachment]) -> tuple[list[Attachment], list[Attachment]]:
+    """(кандидаты по убыванию оценки, отброшенные); при равной оценке — исходный порядок."""
+
+    scored = [(attachment_score(a), n, a) for n, a in enumerate(attachments)]
+    candidates = sorted((s for s in scored if s[0] is not None), key=lambda s: (-s[0], s[1]))
+    return [a for _s, _n, a in candidates], [a for s, _n, a in scored if s is None]
+
+
+def choose_for_gemini(
+    ranked: list[tuple[Attachment, Extracted]], *, max_files: int, max_inline_bytes: int
+) -> list[tuple[Attachment, Extracted]]:
+    """
+    Что из извлечённого (в порядке ранга) пойдёт в один запрос Gemini: не больше `max_files`,
+    файлы inline_data — в пределах `max_inline_bytes` суммарно (лимит размера запроса Gemini).
+    Первый кандидат берётся всегда; текстовые документы дешёвые и бюджет не тратят.
+    """
+
+    chosen: list[tuple[Attachment, Extracted]] = []
+    inline_bytes = 0
+    for att, ex in ranked:
+        if len(chosen) >= max(1, max_files):
+            break
+        size = 0 if ex.text is not None else len(ex.raw_bytes)
+        if chosen and inline_bytes + size > max_inline_bytes:
+            continue
+        chosen.append((att, ex))
+        inline_bytes += size
+    return chosen
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+
+from .models import decode_base64
+from .settings import settings
+
+
+# Так выглядит `binary.attachment_N.data`, если вложение лежит в blob store, а не inline.
+BLOB_REF_PREFIX = "gl-blob:sha256:"
+
+
+class BlobStoreError(RuntimeError):
+    pass
+
+
+def is_blob_ref(data: object) -> bool:
+    return isinstance(data, str) and data.startswith(BLOB_REF_PREFIX)
+
+
+class BlobStore:
+    """
+    Локальное content-addressed хранилище вложений: файл `<root>/<sha[:2]>/<sha>`.
+
+    Нужно, чтобы n8n между шагами гонял короткую ссылку `gl-blob:sha256:<hex>`
+    вместо мегабайтов base64. Лимиты: суммарный размер и возраст (по mtime,
+    чтение освежает mtime — вытесняются давно не используемые).
+    """
+
+    def __init__(self, *, root: str, max_bytes: int, max_age_s: float, prune_interval_s: float = 60.0) -> None:
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self.prune_interval_s = prune_interval_s
+        self._lock = threading.Lock()
+        self._last_prune = 0.0
+        self._approx_bytes = 0
+
+    def _path(self, digest: str) -> Path:
+        if len(digest) != 64 or not all(c in "0123456789abcdef" for c in digest):
+            raise BlobStoreError(f"Bad blob digest: {digest!r}")
+        return self.root / digest[:2] / digest
+
+    def put(self, data: bytes) -> str:
+        """Сохраняет байты, возвращает ссылку `gl-blob:sha256:<hex>`."""
+
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if path.exists():
+            os.utime(path)
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{digest}.{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, path)
+            with self._lock:
+                self._approx_bytes += len(data)
+        self._maybe_prune()
+        return BLOB_REF_PREFIX + digest
+
+    def get(self, ref: str) -> bytes:
+        if not is_blob_ref(ref):
+            raise BlobStoreError(f"Not a blob reference: {ref[:40]!r}")
+        path = self._path(ref[len(BLOB_REF_PREFIX):])
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            raise BlobStoreError(f"Blob {ref} not found (evicted or stored on another instance)") from None
+        os.utime(path)
+        return data
+
+    def size(self, ref: str) -> int:
+        """Размер блоба в байтах — без чтения файла."""
+
+        if not is_blob_ref(ref):
+            raise BlobStoreError(f"Not a blob reference: {ref[:40]!r}")
+        try:
+            return self._path(ref[len(BLOB_REF_PREFIX):]).stat().st_size
+        except FileNotFoundError:
+            raise BlobStoreError(f"Blob {ref} not found (evicted or stored on another instance)") from None
+
+    def _maybe_prune(self) -> None:
+        now = time.time()
+        with self._lock:
+            due = now - self._last_prune >= self.prune_interval_s or self._approx_bytes > self.max_bytes
+            if not due:
+                return
+            self._last_prune = now
+        self.prune()
+
+    def prune(self) -> None:
+        """Удаляет блобы старше max_age_s, затем самые давно использованные сверх max_bytes."""
+
+        now = time.time()
+        files: list[tuple[float, int, Path]] = []
+        for path in self.root.glob("??/*"):
+            if path.suffix == ".tmp":
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            if now - st.st_mtime > self.max_age_s:
+                path.unlink(missing_ok=True)
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _mtime, size, _path in files)
+        files.sort()
+        for _mtime, size, path in files:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+        with self._lock:
+            self._approx_bytes = total
+
+
+blob_store = BlobStore(
+    root=settings.blob_dir,
+    max_bytes=settings.blob_max_bytes,
+    max_age_s=settings.blob_max_age_s,
+)
+
+
+def externalize_item(item: dict) -> dict:
+    """
+    Копия n8n item-а, где inline `binary.attachment_N.data` заменены ссылками на blob store.
+    Уже вынесенные вложения не трогаем; исходный item не меняется.
+    """
+
+    bn = item.get("binary")
+    if not isinstance(bn, dict):
+        return item
+
+    new_bn = dict(bn)
+    changed = False
+    for key, att in bn.items():
+        if not (key.startswith("attachment_") and isinstance(att, dict)):
+            continue
+        data = att.get("data")
+        if not data or not isinstance(data, str) or is_blob_ref(data):
+            continue
+        # Тот же декодер, что у inline-вложения: URL-safe / data:-префикс не должны портить байты
+        ref = blob_store.put(decode_base64(data))
+        new_bn[key] = {**att, "data": ref}
+        changed = True
+
+    if not changed:
+        return item
+    return {**item, "binary": new_bn}
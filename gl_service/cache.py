@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any
+
+from . import metrics
+from .settings import settings
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+
+
+class TieredCache:
+    """
+    Двухуровневый кэш JSON-значений:
+    - в памяти: LRU на `max_entries` записей;
+    - на диске (опционально): SQLite-файл `disk_path`, не больше `disk_max_entries` записей.
+
+    У записи есть TTL и `tag` — по тегу записи можно сбрасывать пачкой
+    (например, все версии анализа одного файла).
+    """
+
+    def __init__(
+        self,
+        *,
+        name: str,
+        max_entries: int,
+        ttl_s: float,
+        disk_path: str | None = None,
+        disk_max_entries: int = 10_000,
+    ) -> None:
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.disk_path = disk_path
+        self.disk_max_entries = disk_max_entries
+        self.stats = CacheStats()
+        self._mem: OrderedDict[str, tuple[float, str, Any]] = OrderedDict()
+        self._db: sqlite3.Connection | None = None
+        self._db_lock = threading.Lock()
+
+    # --- SQLite (синхронно, вызывается через asyncio.to_thread) ---
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            db = sqlite3.connect(self.disk_path, check_same_thread=False)
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY, tag TEXT NOT NULL, value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL, used_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS cache_tag ON cache(tag)")
+            db.execute("CREATE INDEX IF NOT EXISTS cache_used ON cache(used_at)")
+            self._db = db
+        return self._db
+
+    def _disk_get(self, key: str) -> tuple[float, str, Any] | None:
+        with self._db_lock:
+            db = self._conn()
+            row = db.execute("SELECT expires_at, tag, value FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[0] < time.time():
+                db.execute("DELETE FROM cache WHERE key = ?", (key,))
+                db.commit()
+                return None
+            db.execute("UPDATE cache SET used_at = ? WHERE key = ?", (time.time(), key))
+            db.commit()
+            return row[0], row[1], json.loads(row[2])
+
+    def _disk_put(self, key: str, tag: str, value: Any, expires_at: float) -> None:
+        now = time.time()
+        with self._db_lock:
+            db = self._conn()
+            db.execute(
+                "INSERT OR REPLACE INTO cache (key, tag, value, expires_at, used_at) VALUES (?, ?, ?, ?, ?)",
+                (key, tag, json.dumps(value, ensure_ascii=False), expires_at, now),
+            )
+            db.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+            # Вытесняем самые давно использованные сверх лимита
+            db.execute(
+                "DELETE FROM cache WHERE key IN ("
+                " SELECT key FROM cache ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.disk_max_entries,),
+            )
+            db.commit()
+
+    def _disk_invalidate(self, tags: list[str] | None) -> int:
+        with self._db_lock:
+            db = self._conn()
+            if tags is None:
+                cur = db.execute("DELETE FROM cache")
+            else:
+                cur = db.execute(
+                    f"DELETE FROM cache WHERE tag IN ({','.join('?' * len(tags))})", tags
+                )
+            db.commit()
+            return cur.rowcount
+
+    # --- память ---
+
+    def _mem_put(self, key: str, tag: str, value: Any, expires_at: float) -> None:
+        self._mem[key] = (expires_at, tag, value)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+
+    async def get(self, key: str) -> Any | None:
+        entry = self._mem.get(key)
+        if entry is not None and entry[0] < time.time():
+            del self._mem[key]
+            entry = None
+        if entry is not None:
+            self._mem.move_to_end(key)
+        elif self.disk_path:
+            entry = await asyncio.to_thread(self._disk_get, key)
+            if entry is not None:
+                self._mem_put(key, *entry[1:], entry[0])
+
+        if entry is None:
+            self.stats.misses += 1
+            metrics.cache_requests.labels(self.name, "miss").inc()
+            return None
+        self.stats.hits += 1
+        metrics.cache_requests.labels(self.name, "hit").inc()
+        return entry[2]
+
+    async def put(self, key: str, value: Any, *, tag: str = "") -> None:
+        expires_at = time.time() + self.ttl_s
+        self._mem_put(key, tag, value, expires_at)
+        if self.disk_path:
+            await asyncio.to_thread(self._disk_put, key, tag, value, expires_at)
+
+    async def invalidate(self, tags: list[str] | None = None) -> int:
+        """Сбросить записи с указанными тегами (None — весь кэш). Возвращает число удалённых записей."""
+
+        keys = [k for k, (_exp, tag, _v) in self._mem.items() if tags is None or tag in tags]
+        for k in keys:
+            del self._mem[k]
+        removed = len(keys)
+        if self.disk_path and tags != []:
+            # На диске могут лежать записи, которых уже нет в памяти
+            removed = max(removed, await asyncio.to_thread(self._disk_invalidate, tags))
+        return removed
+
+
+# Результаты анализа документов Gemini (GuaranteeDocExtract), ключ — sha256 файла + модель + версия промпта.
+analysis_cache = TieredCache(
+    name="analysis",
+    max_entries=settings.analysis_cache_max_entries,
+    ttl_s=settings.analysis_cache_ttl_s,
+    disk_path=settings.analysis_cache_path,
+    disk_max_entries=settings.analysis_cache_disk_max_entries,
+)
+
+
+# Ответы OpenAI-классификации: по id письма и по хэшу нормализованных subject/from/snippet.
+classify_cache = TieredCache(
+    name="classify",
+    max_entries=settings.classify_cache_max_entries,
+    ttl_s=settings.classify_cache_ttl_s,
+    disk_path=settings.classify_cache_path,
+    disk_max_entries=settings.classify_cache_disk_max_entries,
+)
@@ -0,0 +1,198 @@
+"""
+Запись входящих запросов шагов в JSONL — для воспроизведения реальной нагрузки n8n
+(`python -m benchmarks.replay`).
+
+Строка — один запрос: время, путь, query, статус, длительность и тело, где
+- `binary.attachment_N.data` заменено на `sha256` + `size` (байты — в отдельном каталоге,
+  если он задан: content-addressed, как blob store; одинаковые файлы лежат один раз);
+- значения ключей, похожих на секреты (`token`, `api_key`, `password`, ...), — `"***"`.
+Заголовки не пишутся, кроме `Accept` (он выбирает потоковый режим).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Awaitable, Callable
+
+from .blob_store import BLOB_REF_PREFIX, BlobStore, BlobStoreError, blob_store, is_blob_ref
+from .models import decode_base64
+from .settings import settings
+
+
+CAPTURE_PREFIXES = ("/step/", "/pipeline")
+REDACTED = "***"
+_SECRET_KEY_RE = re.compile(r"token|secret|password|passwd|api[_-]?key|authorization|credential", re.I)
+
+
+def redact(value: Any) -> Any:
+    """Копия JSON-значения, где значения секретных ключей заменены на `***`."""
+
+    if isinstance(value, dict):
+        return {k: REDACTED if _SECRET_KEY_RE.search(str(k)) else redact(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact(v) for v in value]
+    return value
+
+
+class CaptureWriter:
+    """
+    Дописывает записи в JSONL-файл (из потоков — через `asyncio.to_thread`).
+    После `max_bytes` запись останавливается: захват — диагностика, а не архив.
+    """
+
+    def __init__(self, path: str, *, attachments_dir: str | None, max_bytes: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        # Каталог вложений не чистится по возрасту — записи ссылаются на файлы, пока лежит JSONL
+        self.attachments = (
+            BlobStore(root=attachments_dir, max_bytes=max_bytes, max_age_s=float("inf")) if attachments_dir else None
+        )
+        self._lock = threading.Lock()
+        self._full = False
+
+    def _attachment(self, att: dict[str, Any]) -> dict[str, Any]:
+        data = att.get("data")
+        out = {k: v for k, v in att.items() if k != "data"}
+        if not isinstance(data, str) or not data:
+            return out
+        raw: bytes | None
+        if is_blob_ref(data):
+            try:
+                raw = blob_store.get(data)
+            except BlobStoreError:
+                # Файл уже вытеснен — остаётся только хэш из ссылки
+                out["sha256"] = data[len(BLOB_REF_PREFIX):]
+                return out
+        else:
+            # Те же байты, что обработал сервис (URL-safe, data:-префикс) — иначе replay пошлёт другой файл
+            raw = decode_base64(data)
+        out["sha256"] = hashlib.sha256(raw).hexdigest()
+        out["size"] = len(raw)
+        if self.attachments is not None:
+            self.attachments.put(raw)
+        return out
+
+    def _item(self, item: Any) -> Any:
+        if not isinstance(item, dict):
+            return item
+        bn = item.get("binary")
+        if not isinstance(bn, dict):
+            return item
+        new_bn = {
+            k: self._attachment(v) if k.startswith("attachment_") and isinstance(v, dict) else v
+            for k, v in bn.items()
+        }
+        return {**item, "binary": new_bn}
+
+    def sanitize(self, body: bytes) -> Any:
+        try:
+            payload = json.loads(body) if body else None
+        except ValueError:
+            return {"unparsed_bytes": len(body)}
+        if isinstance(payload, dict) and isinstance(payload.get("items"), list):
+            payload = {**payload, "items": [self._item(it) for it in payload["items"]]}
+        return redact(payload)
+
+    def write(self, record: dict[str, Any], body: bytes) -> None:
+        record["body"] = self.sanitize(body)
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._lock:
+            if self._full:
+                return
+            size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+            if size + len(line) > self.max_bytes:
+                self._full = True
+                print(f"⚠️ Capture {self.path} reached {self.max_bytes} bytes, recording stopped")
+                return
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+class CaptureMiddleware:
+    """
+    ASGI-middleware: буферизует тело POST-запросов к шагам, отдаёт его приложению как есть
+    и после ответа пишет запись в фоне (хэширование вложений — вне event loop).
+    """
+
+    def __init__(self, app: Callable[..., Awaitable[None]], *, writer: CaptureWriter) -> None:
+        self.app = app
+        self.writer = writer
+        self._pending: set[asyncio.Task] = set()
+
+    async def __call__(self, scope: dict[str, Any], receive: Callable, send: Callable) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or not scope["path"].startswith(CAPTURE_PREFIXES)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        chunks: list[bytes] = []
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                break
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        body = b"".join(chunks)
+        replayed = False
+
+        async def replay_receive() -> dict[str, Any]:
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        status = 500
+
+        async def send_wrapper(message: dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started_at = time.time()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, replay_receive, send_wrapper)
+        finally:
+            headers = dict(scope.get("headers") or [])
+            record = {
+                "ts": round(started_at, 3),
+                "method": "POST",
+                "path": scope["path"],
+                "query": scope.get("query_string", b"").decode("latin-1"),
+                "accept": headers.get(b"accept", b"").decode("latin-1") or None,
+                "status": status,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            }
+            task = asyncio.create_task(self._write(record, body))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    async def _write(self, record: dict[str, Any], body: bytes) -> None:
+        try:
+            await asyncio.to_thread(self.writer.write, record, body)
+        except Exception as e:
+            print(f"❌ Capture write failed: {e!r}")
+
+
+# None — запись выключена (GL_CAPTURE_PATH не задан)
+capture_writer = (
+    CaptureWriter(
+        settings.capture_path,
+        attachments_dir=settings.capture_attachments_dir,
+        max_bytes=settings.capture_max_bytes,
+    )
+    if settings.capture_path
+    else None
+)
@@ -0,0 +1,120 @@
+from __future__ import annotations
+
+import math
+import re
+from dataclasses import dataclass
+
+
+# Грубая оценка для русского текста: ~3 символа на токен (точный счёт — отдельный запрос countTokens)
+_CHARS_PER_TOKEN = 3
+
+_WS_RE = re.compile(r"[^\S\n]+")
+# "Стр. 2 из 5", "Page 1 of 2" — только явные номера страниц: голое число в строке может быть полисом
+_PAGE_NO_RE = re.compile(r"^[-–\s]*(стр\.?|страница|page)\s*\d+(\s*(из|of|/)\s*\d+)?[-–\s]*$", re.IGNORECASE)
+# Строка из одних цифр / даты ("0012345678", "12/2025", "01.02.2025") — значение поля, не колонтитул
+_VALUE_LINE_RE = re.compile(r"^[№#]?\s*\d[\d\s./\-–]*$")
+
+# Типовой "подвал" писем страховых: на анализ не влияет, а токены ест. Проверяется раньше защиты
+# значений — дисклеймер с датой или номером закона всё равно дисклеймер
+BOILERPLATE = [
+    r"конфиденциальн",
+    r"предназначен\w*\s+(только\s+)?для\s+(адресат|получател|указанн|лиц|использован)",
+    r"если\s+вы\s+(получили|не\s+являетесь)",
+    r"не\s+является\s+(публичной\s+)?офертой",
+    r"(просьба|просим)\s+не\s+отвечать",
+    r"сформирован\w*\s+автоматически",
+    r"152-ФЗ|обработк\w*\s+персональных\s+данных",
+]
+_BOILERPLATE_RE = re.compile("|".join(f"(?:{p})" for p in BOILERPLATE), re.IGNORECASE)
+
+# Значения полей письма: номер полиса / письма, ФИО, даты — такие строки не выкидываются как
+# колонтитулы и первыми попадают в бюджет
+KEY_VALUE = [
+    r"(полис\w*|договор\w*|№|\bN)\s*[:№]?\s*[\w/-]*\d",
+    r"\b[А-ЯЁ][а-яё]+(-[А-ЯЁ][а-яё]+)?\s+[А-ЯЁ]\.\s*[А-ЯЁ]\.",
+    r"\b[А-ЯЁ][а-яё]+\s+[А-ЯЁ][а-яё]+\s+[А-ЯЁ][а-яё]+(ович|евич|ич|овна|евна|ична|инична)\b",
+    r"\b\d{1,2}[./]\d{1,2}[./]\d{2,4}\b|\b\d{1,2}[./]\d{4}\b",
+]
+_KEY_VALUE_RE = re.compile("|".join(f"(?:{p})" for p in KEY_VALUE))
+
+# Строки по теме письма (страховая, услуги, лимит) — в бюджет после значений, перед остальным текстом
+KEY_LINE = [
+    r"страхов|\bСК\b|\b(ООО|АО|ПАО|САО)\b",
+    r"пациент|застрахованн|срок\s+действ",
+    r"гаранти|лимит|услуг|оплат|стоимост|руб",
+]
+_KEY_LINE_RE = re.compile("|".join(f"(?:{p})" for p in KEY_LINE), re.IGNORECASE)
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / _CHARS_PER_TOKEN)
+
+
+@dataclass(frozen=True)
+class Compacted:
+    text: str
+    tokens_before: int
+    tokens_after: int
+
+
+def _rank(line: str) -> int:
+    """0 — значение поля (полис, ФИО, дата, строка из цифр), 1 — строка по теме письма, 2 — остальное."""
+
+    if _VALUE_LINE_RE.match(line) or _KEY_VALUE_RE.search(line):
+        return 0
+    if _KEY_LINE_RE.search(line):
+        return 1
+    return 2
+
+
+def compact_document(text: str, *, token_budget: int) -> Compacted:
+    """
+    Ужимает текст документа перед промптом Gemini:
+    1) схлопывает пробелы и пустые строки;
+    2) выкидывает явные номера страниц ("Стр. 2 из 5") и типовой boilerplate страховых (`BOILERPLATE`);
+    3) убирает повторы строк, которые встречаются на 2+ страницах (`\f`) — колонтитулы; первое
+       вхождение остаётся, строки со значениями полей (`KEY_VALUE`, строки из цифр) не трогаются;
+    4) если всё ещё больше `token_budget` — набирает строки до бюджета: сначала значения полей,
+       затем строки `KEY_LINE`, затем остальные, каждая группа по порядку. Исходный порядок строк
+       сохраняется, `tokens_after <= token_budget` при ненулевом бюджете.
+    """
+
+    pages = [
+        [ln for ln in (_WS_RE.sub(" ", raw).strip() for raw in page.splitlines()) if ln]
+        for page in text.split("\f")
+    ]
+    pages_with: dict[str, int] = {}
+    for page in pages:
+        for norm in {ln.casefold() for ln in page}:
+            pages_with[norm] = pages_with.get(norm, 0) + 1
+
+    seen: set[str] = set()
+    lines: list[str] = []
+    ranks: list[int] = []
+    for page in pages:
+        for line in page:
+            if _PAGE_NO_RE.match(line) or _BOILERPLATE_RE.search(line):
+                continue
+            norm = line.casefold()
+            rank = _rank(line)
+            if rank and pages_with[norm] >= 2 and norm in seen:
+                continue
+            seen.add(norm)
+            lines.append(line)
+            ranks.append(rank)
+
+    budget = token_budget * _CHARS_PER_TOKEN
+    # +1 — перевод строки; у последней строки его нет, так что итог не больше бюджета
+    if token_budget and sum(len(ln) + 1 for ln in lines) - 1 > budget:
+        used = 0
+        keep_idx: set[int] = set()
+        for i in sorted(range(len(lines)), key=lambda i: ranks[i]):
+            cost = len(lines[i]) + 1
+            if used + cost - 1 > budget:
+                continue
+            keep_idx.add(i)
+            used += cost
+        lines = [ln for i, ln in enumerate(lines) if i in keep_idx]
+
+    out = "\n".join(lines)
+    return Compacted(text=out, tokens_before=estimate_tokens(text), tokens_after=estimate_tokens(out))
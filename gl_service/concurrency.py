@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Sequence, TypeVar
+
+from . import metrics
+
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+@dataclass
+class BatchStats:
+    """
+    Статистика одного батча: сколько шло по времени и сколько задач
+    одновременно было "в полёте" в пике.
+    """
+
+    items: int = 0
+    elapsed_ms: float = 0.0
+    max_in_flight: int = 0
+
+    def to_meta(self) -> dict[str, float | int]:
+        return {
+            "items": self.items,
+            "elapsed_ms": round(self.elapsed_ms, 1),
+            "max_in_flight": self.max_in_flight,
+        }
+
+
+async def gather_bounded(
+    items: Sequence[T],
+    fn: Callable[[T], Awaitable[R]],
+    *,
+    limit: int,
+) -> tuple[list[R], BatchStats]:
+    """
+    Запускает `fn` по всем items с ограничением параллельности `limit`.
+    Результаты возвращаются в исходном порядке; первое исключение пробрасывается
+    (как у обычного последовательного цикла).
+    """
+
+    stats = BatchStats(items=len(items))
+    sem = asyncio.Semaphore(max(1, limit))
+    in_flight = 0
+
+    async def run(item: T) -> R:
+        nonlocal in_flight
+        async with sem:
+            in_flight += 1
+            stats.max_in_flight = max(stats.max_in_flight, in_flight)
+            metrics.tasks_in_flight.labels().inc()
+            try:
+                return await fn(item)
+            finally:
+                in_flight -= 1
+                metrics.tasks_in_flight.labels().dec()
+
+    started = time.perf_counter()
+    try:
+        results = await asyncio.gather(*(run(it) for it in items))
+    finally:
+        stats.elapsed_ms = (time.perf_counter() - started) * 1000
+    return list(results), stats
+
+
+async def iter_bounded(
+    items: Sequence[T],
+    fn: Callable[[T], Awaitable[R]],
+    *,
+    limit: int,
+    stats: BatchStats | None = None,
+) -> AsyncIterator[tuple[int, R | Exception]]:
+    """
+    Как `gather_bounded`, но отдаёт (index, результат) по мере готовности.
+    Исключение item-а не валит остальные — приходит вместо результата.
+    Если итерацию бросили (клиент отключился), незавершённые задачи отменяются.
+    """
+
+    stats = BatchStats() if stats is None else stats
+    stats.items = len(items)
+    sem = asyncio.Semaphore(max(1, limit))
+    in_flight = 0
+
+    async def run(i: int, item: T) -> tuple[int, R | Exception]:
+        nonlocal in_flight
+        async with sem:
+            in_flight += 1
+            stats.max_in_flight = max(stats.max_in_flight, in_flight)
+            metrics.tasks_in_flight.labels().inc()
+            try:
+                return i, await fn(item)
+            except Exception as e:
+                return i, e
+            finally:
+                in_flight -= 1
+                metrics.tasks_in_flight.labels().dec()
+
+    started = time.perf_counter()
+    tasks = [asyncio.create_task(run(i, it)) for i, it in enumerate(items)]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            yield await fut
+    finally:
+        for t in tasks:
+            t.cancel()
+        stats.elapsed_ms = (time.perf_counter() - started) * 1000
+
+
+class TokenBucket:
+    """
+    Токен-бакет: `rate` токенов в секунду, не больше `burst` про запас.
+    `acquire` ждёт, пока токенов хватит (ожидающие обслуживаются по очереди);
+    запрос больше `burst` берётся частями по `burst`.
+    """
+
+    def __init__(self, *, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while tokens > 0:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                # Больше burst в бакете не накопится — иначе acquire(2) при burst=1 ждал бы вечно
+                take = min(tokens, self.burst)
+                if self._tokens >= take:
+                    self._tokens -= take
+                    tokens -= take
+                    continue
+                await asyncio.sleep((take - self._tokens) / self.rate)
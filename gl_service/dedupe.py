@@ -4,6 +4,7 @@ from dataclasses import dataclass
 from datetime import datetime
 
 from .models import Email
+from .watermarks import Watermark
 
 
 @dataclass(frozen=True)
@@ -18,6 +19,10 @@ def _ts(dt: datetime | None) -> float:
     return dt.timestamp()
 
 
+def thread_key(email: Email) -> str:
+    return email.thread_id or email.id
+
+
 def dedupe_latest_per_thread(emails: list[Email]) -> DedupeResult:
     """
     Аналог ноды `dedupe-emails`:
@@ -43,3 +48,34 @@ def dedupe_latest_per_thread(emails: list[Email]) -> DedupeResult:
     return DedupeResult(kept=kept, dropped=dropped)
 
 
+def drop_not_newer(emails: list[Email], marks: dict[str, Watermark]) -> DedupeResult:
+    """
+    Инкрементальный dedupe между запусками: выкидываем письма, которые не новее
+    водяного знака своего треда (то же письмо по id или более ранняя дата).
+    Письма без даты отбрасываются только по совпадению id.
+    """
+
+    kept: list[Email] = []
+    dropped: list[Email] = []
+    for email in emails:
+        wm = marks.get(thread_key(email))
+        seen = wm is not None and (
+            email.id == wm.message_id or (email.date is not None and _ts(email.date) < wm.ts)
+        )
+        (dropped if seen else kept).append(email)
+    return DedupeResult(kept=kept, dropped=dropped)
+
+
+def latest_marks(emails: list[Email]) -> dict[str, Watermark]:
+    """Водяные знаки, которые надо поставить после обработки писем: самое позднее письмо треда."""
+
+    out: dict[str, Watermark] = {}
+    for email in emails:
+        key = thread_key(email)
+        if not key:
+            continue
+        ts = _ts(email.date)
+        prev = out.get(key)
+        if prev is None or ts > prev.ts:
+            out[key] = Watermark(ts=ts, message_id=email.id)
+    return out
@@ -1,13 +1,20 @@
 from __future__ import annotations
 
-import base64
+import codecs
 import io
+import itertools
+import re
+import unicodedata
 from dataclasses import dataclass
-
-from pdfminer.high_level import extract_text as pdf_extract_text
-from striprtf.striprtf import rtf_to_text
+from typing import TYPE_CHECKING
 
 from .models import Attachment, ExtractMode
+from .settings import settings
+
+# pdfminer (~0.1 с на импорт) и striprtf импортируются при первом документе или в `preload()`:
+# холодный старт сервиса и /health их не ждут.
+if TYPE_CHECKING:
+    from pdfminer.pdfpage import PDFPage
 
 
 @dataclass(frozen=True)
@@ -16,10 +23,41 @@ class Extracted:
     text: str | None
     mime_type: str
     raw_bytes: bytes
+    # Почему файл ушёл в Gemini как inline_data (None — ушёл текст)
+    inline_reason: str | None = None
+
+    @property
+    def route(self) -> str:
+        return "text" if self.text is not None else "inline"
+
+
+# pdfminer пишет "(cid:123)" на месте глифов без ToUnicode — это мусор, а не текст
+_CID_RE = re.compile(r"\(cid:\d+\)")
 
 
-def _decode_base64(data_base64: str) -> bytes:
-    return base64.b64decode(data_base64, validate=False)
+def text_quality_issue(mode: ExtractMode, text: str) -> str | None:
+    """
+    Годится ли извлечённый текст для анализа Gemini как текст.
+    Возвращает причину отказа ("empty" / "too_short" / "garbage" / "sparse_pages") или None.
+
+    PDF-страницы считаются по разделителям "\f", которые ставит pdfminer.
+    """
+
+    cleaned = _CID_RE.sub("\ufffd", text)
+    chars = [c for c in cleaned if not c.isspace()]
+    if not chars:
+        return "empty"
+    if len(chars) < settings.extract_min_chars:
+        return "too_short"
+    # Control / private use / unassigned / U+FFFD — битая кодировка или шрифт без ToUnicode
+    good = sum(1 for c in chars if c != "\ufffd" and unicodedata.category(c)[0] != "C")
+    if good / len(chars) < settings.extract_min_printable_ratio:
+        return "garbage"
+    if mode == "pdf":
+        pages = text.count("\f") + 1
+        if good / pages < settings.extract_min_chars_per_page:
+            return "sparse_pages"
+    return None
 
 
 def guess_mode(att: Attachment) -> ExtractMode:
@@ -31,8 +69,156 @@ def guess_mode(att: Attachment) -> ExtractMode:
     return "other"
 
 
+# Группы с бинарными данными: картинки и OLE-объекты (логотипы, подписи) — мегабайты hex без текста.
+# `{\object ...}` целиком не трогаем: в его `{\result ...}` бывает отрисованный текст.
+_RTF_BLOB_OPEN_RE = re.compile(rb"\{\\(?:\*\\)?(?:pict|objdata)(?![a-z])|\\bin(\d+) ?")
+_RTF_TOKEN_RE = re.compile(rb"\\[\\{}]|\\bin(\d+) ?|[{}]")
+_RTF_ANSICPG_RE = re.compile(rb"\\ansicpg(\d+)")
+
+
+def _rtf_strip_binary(raw: bytes) -> bytes:
+    """
+    Один проход по RTF: вырезает группы `\\pict` / `\\objdata` и сырые данные `\\binN`.
+    Поиск токенов — regex-ом на C, hex внутри картинок не разбирается посимвольно.
+    """
+
+    out: list[bytes] = []
+    pos = 0
+    while (m := _RTF_BLOB_OPEN_RE.search(raw, pos)) is not None:
+        out.append(raw[pos : m.start()])
+        if m.group(1) is not None:
+            pos = m.end() + int(m.group(1))
+            continue
+        depth, p = 1, m.end()
+        while depth:
+            t = _RTF_TOKEN_RE.search(raw, p)
+            if t is None:
+                p = len(raw)
+                break
+            p = t.end()
+            if t.group(1) is not None:
+                p += int(t.group(1))
+            elif t.group(0) == b"{":
+                depth += 1
+            elif t.group(0) == b"}":
+                depth -= 1
+        pos = p
+    if not out:
+        return raw
+    out.append(raw[pos:])
+    return b"".join(out)
+
+
+def _rtf_codepage(raw: bytes) -> str:
+    # \ansicpg — в заголовке документа; без него — ANSI по умолчанию для RTF (cp1252)
+    m = _RTF_ANSICPG_RE.search(raw, 0, 4096)
+    if m is not None:
+        try:
+            return codecs.lookup(f"cp{int(m.group(1))}").name
+        except LookupError:
+            pass
+    return "cp1252"
+
+
+def preload() -> None:
+    """Импорт тяжёлых зависимостей извлечения заранее (прогрев после старта, воркеры пула)."""
+
+    import pdfminer.converter  # noqa: F401
+    import pdfminer.pdfinterp  # noqa: F401
+    import pdfminer.pdfpage  # noqa: F401
+    import striprtf.striprtf  # noqa: F401
+
+
+def _page_has_text_layer(page: PDFPage) -> bool:
+    from pdfminer.pdftypes import resolve1
+
+    # Текст на странице — только через шрифты: напрямую или внутри Form XObject.
+    # У скана в ресурсах одни картинки, layout-анализ ему не нужен.
+    res = resolve1(page.resources) or {}
+    if resolve1(res.get("Font")):
+        return True
+    xobjects = resolve1(res.get("XObject")) or {}
+    return any(getattr(resolve1(x).get("Subtype"), "name", None) == "Form" for x in xobjects.values())
+
+
+def _pdf_text(raw: bytes, max_pages: int, max_chars: int) -> str:
+    from pdfminer.converter import TextConverter
+    from pdfminer.layout import LAParams
+    from pdfminer.pdfdocument import PDFDocument
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
+    from pdfminer.pdfparser import PDFParser
+    from pdfminer.pdftypes import resolve1
+
+    doc = PDFDocument(PDFParser(io.BytesIO(raw)))
+    total = resolve1(resolve1(doc.catalog.get("Pages")) or {}).get("Count")
+    pages = list(itertools.islice(PDFPage.create_pages(doc), max_pages or None))
+    print(f"📦 PDF pages: {total}, reading {len(pages)}")
+    if not any(_page_has_text_layer(p) for p in pages):
+        return ""
+
+    rsrc = PDFResourceManager()
+    out = io.StringIO()
+    device = TextConverter(rsrc, out, laparams=LAParams())
+    interpreter = PDFPageInterpreter(rsrc, device)
+    try:
+        for page in pages:
+            interpreter.process_page(page)
+            # Бюджет набран — остальные страницы не разбираем
+            if max_chars and out.tell() >= max_chars:
+                break
+    finally:
+        device.close()
+    return out.getvalue()
+
+
+def extract_text(mode: ExtractMode, raw: bytes, max_pages: int = 0, max_chars: int = 0) -> str:
+    """
+    Чистая CPU-часть извлечения текста (PDF/RTF).
+    Без побочных эффектов и глобального состояния — запускается в процессах пула (`extract_pool`).
+
+    `max_pages` — сколько первых страниц PDF разбирать, `max_chars` — бюджет текста
+    (разбор PDF останавливается, как только набран; результат обрезается). 0 — без лимита.
+    """
+
+    if mode == "pdf":
+        text = _pdf_text(raw, max_pages, max_chars)
+    elif mode == "rtf":
+        from striprtf.striprtf import rtf_to_text
+
+        # Сначала выкидываем картинки/объекты, потом один decode в кодировке из \ansicpg
+        # (RTF по стандарту 7-битный, но встречаются и "сырые" байты кодовой страницы)
+        raw = _rtf_strip_binary(raw)
+        encoding = _rtf_codepage(raw)
+        text = rtf_to_text(raw.decode(encoding, errors="replace"), encoding=encoding, errors="replace") or ""
+    else:
+        raise ValueError(f"No text extractor for mode {mode!r}")
+    if max_chars:
+        text = text[:max_chars]
+    return text.strip()
+
+
+def extracted_from_text(att: Attachment, mode: ExtractMode, raw: bytes, text: str | None) -> Extracted:
+    """
+    Собирает результат: text=None означает "текст не извлекли" — файл уйдёт в Gemini как inline_data.
+    Текст, не прошедший `text_quality_issue` (скан без текстового слоя, мусор вместо букв),
+    тоже уходит inline: один полезный запрос вместо пустого текстового и повтора из n8n.
+    """
+
+    if text is None:
+        return Extracted(
+            mode="other", text=None, mime_type=att.mime_type, raw_bytes=raw, inline_reason="extract_failed"
+        )
+    print(f"📦 {mode.upper()} text extracted: {len(text)} chars")
+    issue = text_quality_issue(mode, text)
+    if issue is not None:
+        print(f"⚠️ {mode.upper()} text rejected ({issue}), sending file inline")
+        return Extracted(mode=mode, text=None, mime_type=att.mime_type, raw_bytes=raw, inline_reason=issue)
+    return Extracted(mode=mode, text=text, mime_type=att.mime_type, raw_bytes=raw)
+
+
 def extract_from_attachment(att: Attachment) -> Extracted:
-    raw = _decode_base64(att.data_base64)
+    raw = att.raw_bytes()
     mode = guess_mode(att)
     
     # Диагностика
@@ -41,31 +227,14 @@ def extract_from_attachment(att: Attachment) -> Extracted:
     print(f"📦 First 30 bytes: {raw[:30]}")
     print(f"📦 Mode: {mode}")
 
-    if mode == "pdf":
-        try:
-            text = pdf_extract_text(io.BytesIO(raw)) or ""
-            print(f"📦 PDF text extracted: {len(text)} chars")
-            if not text.strip():
-                print("⚠️ PDF parsed but text is empty!")
-            return Extracted(mode=mode, text=text.strip(), mime_type=att.mime_type, raw_bytes=raw)
-        except Exception as e:
-            # PDF поврежден или это не PDF — отправляем как inline_data в Gemini
-            print(f"❌ PDF extraction failed: {e}")
-            return Extracted(mode="other", text=None, mime_type=att.mime_type, raw_bytes=raw)
-
-    if mode == "rtf":
-        try:
-            # RTF часто в cp1251/ansi; striprtf работает по строке — декодируем максимально мягко
-            decoded = raw.decode("utf-8", errors="ignore")
-            if not decoded.strip():
-                decoded = raw.decode("cp1251", errors="ignore")
-            text = rtf_to_text(decoded) or ""
-            return Extracted(mode=mode, text=text.strip(), mime_type=att.mime_type, raw_bytes=raw)
-        except Exception:
-            # RTF поврежден — отправляем как inline_data в Gemini
-            return Extracted(mode="other", text=None, mime_type=att.mime_type, raw_bytes=raw)
-
-    # other: текст не извлекаем, остаётся base64/inline_data для Gemini
-    return Extracted(mode=mode, text=None, mime_type=att.mime_type, raw_bytes=raw)
-
-
+    if mode == "other":
+        # other: текст не извлекаем, остаётся base64/inline_data для Gemini
+        return Extracted(mode=mode, text=None, mime_type=att.mime_type, raw_bytes=raw, inline_reason="binary")
+
+    try:
+        text = extract_text(mode, raw, settings.extract_pdf_max_pages, settings.extract_max_chars)
+    except Exception as e:
+        # PDF/RTF поврежден или это не PDF/RTF — отправляем как inline_data в Gemini
+        print(f"❌ {mode.upper()} extraction failed: {e}")
+        text = None
+    return extracted_from_text(att, mode, raw, text)
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from . import metrics
+from .extract import Extracted, extract_text, extracted_from_text, guess_mode, preload
+from .models import Attachment
+from .settings import settings
+
+
+class ExtractPool:
+    """
+    Пул процессов для PDF/RTF-извлечения, чтобы pdfminer/striprtf не блокировали event loop.
+
+    - `workers` процессов (0 — без пула, извлечение в отдельном потоке);
+    - `timeout_s` на документ: зависший воркер убиваем, пул пересоздаём,
+      а документ уходит в Gemini как inline_data (как при битом PDF);
+    - `max_tasks_per_child`: пул перезапускается после N документов на воркер (утечки pdfminer).
+      Делаем это сами, а не через `ProcessPoolExecutor(max_tasks_per_child=...)`:
+      в Python 3.11 он может зависнуть (CPython gh-115634).
+    """
+
+    def __init__(self, *, workers: int, timeout_s: float, max_tasks_per_child: int) -> None:
+        self.workers = workers
+        self.timeout_s = timeout_s
+        self.max_tasks_per_child = max_tasks_per_child
+        self._executor: ProcessPoolExecutor | None = None
+        self._submitted = 0
+
+    def start(self) -> None:
+        if self.workers <= 0 or self._executor is not None:
+            return
+        # spawn: fork из процесса с event loop и потоками небезопасен
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        self._submitted = 0
+
+    def shutdown(self) -> None:
+        ex, self._executor = self._executor, None
+        if ex is not None:
+            ex.shutdown(wait=True, cancel_futures=True)
+
+    async def warm_up(self) -> None:
+        """
+        Поднимает процессы пула и импортирует в них pdfminer/striprtf (без пула — в этом процессе):
+        первый документ после холодного старта не ждёт spawn и импорты.
+        """
+
+        ex = self._executor
+        if ex is None:
+            await asyncio.to_thread(preload)
+            return
+        loop = asyncio.get_running_loop()
+        # По задаче на воркер: пул с spawn поднимает процессы по требованию, пока нет свободных
+        await asyncio.gather(*(loop.run_in_executor(ex, preload) for _ in range(self.workers)))
+
+    def _recycle(self, broken: ProcessPoolExecutor) -> None:
+        """Убиваем процессы зависшего пула и поднимаем новый (если его ещё не подменили)."""
+
+        if self._executor is not broken:
+            return
+        self._executor = None
+        procs = list((getattr(broken, "_processes", None) or {}).values())
+        broken.shutdown(wait=False, cancel_futures=True)
+        for p in procs:
+            p.terminate()
+        self.start()
+
+    def _submit_executor(self) -> ProcessPoolExecutor | None:
+        """Текущий пул; после N задач на воркер старый пул дорабатывает очередь и завершается."""
+
+        ex = self._executor
+        if ex is None or self.max_tasks_per_child <= 0:
+            return ex
+        if self._submitted >= self.max_tasks_per_child * self.workers:
+            self._executor = None
+            ex.shutdown(wait=False)
+            self.start()
+            ex = self._executor
+        self._submitted += 1
+        return ex
+
+    async def _run(self, mode, raw: bytes) -> str:
+        loop = asyncio.get_running_loop()
+        for attempt in (1, 2):
+            ex = self._submit_executor()
+            limits = (settings.extract_pdf_max_pages, settings.extract_max_chars)
+            if ex is None:
+                return await asyncio.to_thread(extract_text, mode, raw, *limits)
+            try:
+                fut = loop.run_in_executor(ex, extract_text, mode, raw, *limits)
+                return await asyncio.wait_for(fut, self.timeout_s)
+            except asyncio.TimeoutError:
+                self._recycle(ex)
+                raise TimeoutError(f"extraction exceeded {self.timeout_s}s") from None
+            except BrokenProcessPool:
+                # Пул сломал соседний документ (таймаут/краш) — одна повторная попытка на новом пуле.
+                self._recycle(ex)
+                if attempt == 2:
+                    raise
+        raise AssertionError("unreachable")
+
+    async def extract(self, att: Attachment) -> Extracted:
+        """Асинхронный аналог `extract_from_attachment`."""
+
+        raw = att.raw_bytes()
+        mode = guess_mode(att)
+        print(f"📦 File: {att.file_name}, {len(raw)} bytes, mode={mode}")
+
+        if mode == "other":
+            metrics.extract_seconds.labels(mode).observe(0.0)
+            return Extracted(mode=mode, text=None, mime_type=att.mime_type, raw_bytes=raw, inline_reason="binary")
+
+        started = time.perf_counter()
+        try:
+            text: str | None = await self._run(mode, raw)
+        except Exception as e:
+            print(f"❌ {mode.upper()} extraction failed: {e!r}")
+            text = None
+        finally:
+            metrics.extract_seconds.labels(mode).observe(time.perf_counter() - started)
+        return extracted_from_text(att, mode, raw, text)
+
+
+extract_pool = ExtractPool(
+    workers=settings.extract_workers,
+    timeout_s=settings.extract_timeout_s,
+    max_tasks_per_child=settings.extract_max_tasks_per_child,
+)
@@ -1,9 +1,10 @@
 from __future__ import annotations
 
 import base64
+import json
 
-import httpx
-
+from .http_clients import http_clients
+from .resilience import guards
 from .models import GuaranteeDocExtract
 from .settings import settings
 
@@ -12,15 +13,25 @@ class GeminiError(RuntimeError):
     pass
 
 
+# Меняй при любой правке промптов ниже: версия входит в ключ кэша анализа (см. steps.analysis_cache_key).
+PROMPT_VERSION = "4"  # 2: doc_text проходит compact_document; 3: compact_document не теряет поля письма; 4: бюджет соблюдается всегда
+# То же для промпта по нескольким вложениям письма (_prompt_for_documents)
+DOCUMENTS_PROMPT_VERSION = "1"
+
+_JSON_SPEC = (
+    "Извлеки и верни ТОЛЬКО JSON (без markdown, без ```json):\n"
+    '{"insurance_company": "название страховой", "patient_name": "ФИО пациента", '
+    '"policy_number": "номер полиса", "services": "услуги/лимит", '
+    '"valid_until": "срок действия", "summary": "резюме 2-3 предложения"}\n\n'
+)
+
+
 def _prompt_for_text(doc_text: str, subject: str, snippet: str) -> str:
     # По смыслу повторяет ваши промпты в n8n: "верни только JSON без markdown"
     return (
         "Проанализируй документ - гарантийное письмо от страховой.\n\n"
         f"Текст документа:\n{doc_text}\n\n"
-        "Извлеки и верни ТОЛЬКО JSON (без markdown, без ```json):\n"
-        '{"insurance_company": "название страховой", "patient_name": "ФИО пациента", '
-        '"policy_number": "номер полиса", "services": "услуги/лимит", '
-        '"valid_until": "срок действия", "summary": "резюме 2-3 предложения"}\n\n'
+        f"{_JSON_SPEC}"
         f'Письмо: {subject} - {snippet}'
     )
 
@@ -28,56 +39,70 @@ def _prompt_for_text(doc_text: str, subject: str, snippet: str) -> str:
 def _prompt_for_inline(subject: str, snippet: str) -> str:
     return (
         "Проанализируй документ - гарантийное письмо от страховой.\n\n"
-        "Извлеки и верни ТОЛЬКО JSON (без markdown, без ```json):\n"
-        '{"insurance_company": "название страховой", "patient_name": "ФИО пациента", '
-        '"policy_number": "номер полиса", "services": "услуги/лимит", '
-        '"valid_until": "срок действия", "summary": "резюме 2-3 предложения"}\n\n'
+        f"{_JSON_SPEC}"
         f'Письмо: {subject} - {snippet}'
     )
 
 
+def _prompt_for_documents(texts: list[tuple[str, str]], file_names: list[str], subject: str, snippet: str) -> str:
+    docs = "".join(f"Документ «{name}»:\n{text}\n\n" for name, text in texts)
+    files = f"Файлы во вложении (по порядку): {', '.join(file_names)}\n\n" if file_names else ""
+    return (
+        "Проанализируй документы одного письма от страховой: гарантийное письмо и сопутствующие файлы "
+        "(сопроводительное письмо, скан, приложение). Данные могут быть разнесены по файлам — "
+        "объедини их в один ответ; при расхождениях верь самому гарантийному письму.\n\n"
+        f"{docs}{files}{_JSON_SPEC}"
+        f'Письмо: {subject} - {snippet}'
+    )
+
+
+def _candidate_text(data: dict) -> str:
+    return (
+        data.get("candidates", [{}])[0]
+        .get("content", {})
+        .get("parts", [{}])[0]
+        .get("text", "")
+    )
+
+
 async def gemini_generate_from_text(doc_text: str, *, subject: str = "", snippet: str = "") -> str:
     if not settings.gemini_api_key:
         raise GeminiError("GL_GEMINI_API_KEY is not set")
 
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{settings.gemini_model}:generateContent"
+    url = f"/models/{settings.gemini_model}:generateContent"
 
     payload = {
         "contents": [{"parts": [{"text": _prompt_for_text(doc_text, subject, snippet)}]}],
         "generationConfig": {"temperature": 0.2, "maxOutputTokens": 1000},
     }
 
-    async with httpx.AsyncClient(timeout=60) as client:
-        resp = await client.post(url, params={"key": settings.gemini_api_key}, json=payload)
-        if resp.status_code >= 400:
-            raise GeminiError(f"Gemini HTTP {resp.status_code}: {resp.text}")
-        data = resp.json()
-
-    return (
-        data.get("candidates", [{}])[0]
-        .get("content", {})
-        .get("parts", [{}])[0]
-        .get("text", "")
+    client = http_clients.get("gemini")
+    resp = await guards["gemini"].request(
+        lambda: client.post(url, params={"key": settings.gemini_api_key}, json=payload)
     )
+    if resp.status_code >= 400:
+        raise GeminiError(f"Gemini HTTP {resp.status_code}: {resp.text}")
+    return _candidate_text(resp.json())
 
 
 async def gemini_generate_from_inline_file(
-    file_bytes: bytes,
+    file_base64: str,
     *,
     mime_type: str,
     subject: str = "",
     snippet: str = "",
 ) -> str:
+    """
+    file_base64 — содержимое файла в base64 (обычно исходная строка из n8n, без перекодирования).
+    """
+
     if not settings.gemini_api_key:
         raise GeminiError("GL_GEMINI_API_KEY is not set")
 
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{settings.gemini_model}:generateContent"
+    url = f"/models/{settings.gemini_model}:generateContent"
     
     # Диагностика
-    print(f"🤖 Sending to Gemini: {len(file_bytes)} bytes, mime={mime_type}")
-    print(f"🤖 First 30 bytes: {file_bytes[:30]}")
-    encoded = base64.b64encode(file_bytes).decode("ascii")
-    print(f"🤖 Base64 length: {len(encoded)} chars")
+    print(f"🤖 Sending to Gemini: base64 length {len(file_base64)} chars, mime={mime_type}")
 
     payload = {
         "contents": [
@@ -87,7 +112,7 @@ async def gemini_generate_from_inline_file(
                     {
                         "inline_data": {
                             "mime_type": mime_type or "application/octet-stream",
-                            "data": encoded,
+                            "data": file_base64,
                         }
                     },
                 ]
@@ -96,25 +121,73 @@ async def gemini_generate_from_inline_file(
         "generationConfig": {"temperature": 0.2, "maxOutputTokens": 1000},
     }
 
-    async with httpx.AsyncClient(timeout=60) as client:
-        resp = await client.post(url, params={"key": settings.gemini_api_key}, json=payload)
-        if resp.status_code >= 400:
-            print(f"❌ Gemini error: {resp.text}")
-            raise GeminiError(f"Gemini HTTP {resp.status_code}: {resp.text}")
-        data = resp.json()
+    # Тело собираем сами: с ensure_ascii=False (как делает httpx для json=) кириллица промпта
+    # превращает всю многомегабайтную JSON-строку в UCS-2 — вдвое больше памяти на base64.
+    body = json.dumps(payload, ensure_ascii=True, separators=(",", ":")).encode("ascii")
+    client = http_clients.get("gemini")
+    resp = await guards["gemini"].request(
+        lambda: client.post(
+            url,
+            params={"key": settings.gemini_api_key},
+            content=body,
+            headers={"Content-Type": "application/json"},
+        )
+    )
+    if resp.status_code >= 400:
+        print(f"❌ Gemini error: {resp.text}")
+        raise GeminiError(f"Gemini HTTP {resp.status_code}: {resp.text}")
+    return _candidate_text(resp.json())
 
-    return (
-        data.get("candidates", [{}])[0]
-        .get("content", {})
-        .get("parts", [{}])[0]
-        .get("text", "")
+
+async def gemini_generate_from_documents(
+    *,
+    texts: list[tuple[str, str]],
+    files: list[tuple[str, str, str]],
+    subject: str = "",
+    snippet: str = "",
+) -> str:
+    """
+    Несколько вложений одного письма одним запросом: тексты — в промпте,
+    файлы — частями inline_data. texts: (имя, текст); files: (имя, mime_type, base64).
+    """
+
+    if not settings.gemini_api_key:
+        raise GeminiError("GL_GEMINI_API_KEY is not set")
+
+    url = f"/models/{settings.gemini_model}:generateContent"
+    print(f"🤖 Sending to Gemini: {len(texts)} text document(s), {len(files)} inline file(s), "
+          f"base64 {sum(len(f[2]) for f in files)} chars")
+
+    parts: list[dict] = [{"text": _prompt_for_documents(texts, [f[0] for f in files], subject, snippet)}]
+    for _name, mime_type, file_base64 in files:
+        parts.append({"inline_data": {"mime_type": mime_type or "application/octet-stream", "data": file_base64}})
+    payload = {
+        "contents": [{"parts": parts}],
+        "generationConfig": {"temperature": 0.2, "maxOutputTokens": 1000},
+    }
+
+    # Как в gemini_generate_from_inline_file: ASCII-тело, без UCS-2 копии base64
+    body = json.dumps(payload, ensure_ascii=True, separators=(",", ":")).encode("ascii")
+    client = http_clients.get("gemini")
+    resp = await guards["gemini"].request(
+        lambda: client.post(
+            url,
+            params={"key": settings.gemini_api_key},
+            content=body,
+            headers={"Content-Type": "application/json"},
+        )
     )
+    if resp.status_code >= 400:
+        print(f"❌ Gemini error: {resp.text}")
+        raise GeminiError(f"Gemini HTTP {resp.status_code}: {resp.text}")
+    return _candidate_text(resp.json())
 
 
 async def analyze_document_with_gemini(
     *,
     doc_text: str | None,
-    file_bytes: bytes | None,
+    file_bytes: bytes | None = None,
+    file_base64: str | None = None,
     mime_type: str,
     subject: str,
     snippet: str,
@@ -123,19 +196,21 @@ async def analyze_document_with_gemini(
     """
     Единая точка как в n8n:
     - PDF/RTF -> doc_text
-    - other -> inline_data (file_bytes + mime_type)
+    - other -> inline_data (file_base64 + mime_type; file_bytes — если base64 под рукой нет)
     """
 
     if doc_text is not None:
         raw = await gemini_generate_from_text(doc_text, subject=subject, snippet=snippet)
         return parser(raw)
 
-    if file_bytes is not None:
+    if file_base64 is None and file_bytes is not None:
+        file_base64 = base64.b64encode(file_bytes).decode("ascii")
+    if file_base64 is not None:
         raw = await gemini_generate_from_inline_file(
-            file_bytes, mime_type=mime_type, subject=subject, snippet=snippet
+            file_base64, mime_type=mime_type, subject=subject, snippet=snippet
         )
         return parser(raw)
 
-    raise GeminiError("No doc_text or file_bytes provided")
+    raise GeminiError("No doc_text or file provided")
 
 
@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Any, Literal
+
+import httpx
+
+from . import metrics
+from .settings import settings
+
+
+Upstream = Literal["openai", "gemini", "whapi"]
+UPSTREAMS: tuple[Upstream, ...] = ("openai", "gemini", "whapi")
+
+
+@dataclass
+class PoolStats:
+    requests: int = 0
+    connections_created: int = 0
+
+    @property
+    def connections_reused(self) -> int:
+        # Каждый запрос либо открыл соединение, либо взял уже открытое из пула.
+        return max(0, self.requests - self.connections_created)
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _base_url(name: Upstream) -> str:
+    return {
+        "openai": settings.openai_base_url,
+        "gemini": settings.gemini_base_url,
+        "whapi": settings.whapi_base_url,
+    }[name].rstrip("/")
+
+
+class _MeteredTransport(httpx.AsyncBaseTransport):
+    """Время до заголовков ответа, статусы и запросы в полёте по upstream-у (metrics.py)."""
+
+    def __init__(self, name: str, inner: httpx.AsyncBaseTransport) -> None:
+        self.inner = inner
+        self.seconds = metrics.upstream_seconds.labels(name)
+        self.in_flight = metrics.upstream_in_flight.labels(name)
+        self.name = name
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        self.in_flight.inc()
+        status = "error"
+        try:
+            resp = await self.inner.handle_async_request(request)
+            status = str(resp.status_code)
+            return resp
+        finally:
+            self.in_flight.dec()
+            self.seconds.observe(time.perf_counter() - started)
+            metrics.upstream_responses.labels(self.name, status).inc()
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+class HttpClients:
+    """
+    Один долгоживущий `httpx.AsyncClient` на каждый upstream (OpenAI, Gemini, Whapi):
+    keep-alive вместо DNS+TCP+TLS на каждый вызов.
+
+    Создаются в lifespan FastAPI (`start`) и закрываются на shutdown (`aclose`).
+    Вне lifespan (скрипты, ноутбук) клиент создаётся лениво при первом `get`.
+    """
+
+    def __init__(self) -> None:
+        self._clients: dict[str, httpx.AsyncClient] = {}
+        self._transports: dict[str, httpx.AsyncHTTPTransport] = {}
+        self._stats: dict[str, PoolStats] = {name: PoolStats() for name in UPSTREAMS}
+        self._http2 = False
+
+    def _make_client(self, name: Upstream) -> httpx.AsyncClient:
+        self._http2 = settings.http2 and _http2_available()
+        if settings.http2 and not self._http2:
+            print("⚠️ GL_HTTP2=true, но пакет h2 не установлен — работаем по HTTP/1.1")
+
+        stats = self._stats[name]
+
+        async def trace(event: str, _info: dict[str, Any]) -> None:
+            if event == "connection.connect_tcp.complete":
+                stats.connections_created += 1
+            elif event.endswith("send_request_headers.started"):
+                stats.requests += 1
+
+        async def on_request(request: httpx.Request) -> None:
+            request.extensions["trace"] = trace
+
+        transport = httpx.AsyncHTTPTransport(
+            http2=self._http2,
+            limits=httpx.Limits(
+                max_connections=settings.http_max_connections,
+                max_keepalive_connections=settings.http_max_keepalive_connections,
+                keepalive_expiry=settings.http_keepalive_expiry_s,
+            ),
+        )
+        self._transports[name] = transport
+        return httpx.AsyncClient(
+            base_url=_base_url(name),
+            transport=_MeteredTransport(name, transport),
+            timeout=httpx.Timeout(settings.http_timeout_s, connect=settings.http_connect_timeout_s),
+            event_hooks={"request": [on_request]},
+        )
+
+    def get(self, name: Upstream) -> httpx.AsyncClient:
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = self._clients[name] = self._make_client(name)
+        return client
+
+    async def start(self) -> None:
+        for name in UPSTREAMS:
+            self.get(name)
+
+    async def prewarm(self) -> None:
+        """
+        Открываем соединения заранее (TCP+TLS), чтобы первый запрос из n8n их не ждал.
+        Ответ не важен (404/401 — норм), ошибки сети игнорируем.
+        """
+
+        async def warm(name: Upstream) -> None:
+            try:
+                await self.get(name).head("/", timeout=settings.http_connect_timeout_s)
+            except httpx.HTTPError as e:
+                print(f"⚠️ prewarm {name} failed: {e!r}")
+
+        await asyncio.gather(*(warm(name) for name in UPSTREAMS))
+
+    async def aclose(self) -> None:
+        clients, self._clients = self._clients, {}
+        self._transports = {}
+        await asyncio.gather(*(c.aclose() for c in clients.values()))
+
+    def stats(self) -> dict[str, dict[str, Any]]:
+        out: dict[str, dict[str, Any]] = {}
+        for name in UPSTREAMS:
+            st = self._stats[name]
+            # httpx не отдаёт пул публично — берём его у httpcore, если получится
+            pool = getattr(self._transports.get(name), "_pool", None)
+            conns = list(getattr(pool, "connections", None) or [])
+            out[name] = {
+                "base_url": _base_url(name),
+                "http2": self._http2,
+                "connections_open": sum(1 for c in conns if not c.is_closed()),
+                "connections_idle": sum(1 for c in conns if c.is_idle()),
+                "connections_created": st.connections_created,
+                "connections_reused": st.connections_reused,
+                "requests": st.requests,
+            }
+        return out
+
+
+http_clients = HttpClients()
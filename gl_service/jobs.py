@@ -0,0 +1,358 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable
+
+from .settings import settings
+
+
+class JobQueueFullError(RuntimeError):
+    pass
+
+
+INTERRUPTED_SEND_ERROR = "interrupted while sending; not re-run without GL_SEND_LEDGER_DB (would duplicate messages)"
+
+
+# (индекс во входном items, готовый item или исключение) — частичный результат
+ItemCallback = Callable[[int, "dict[str, Any] | Exception"], Awaitable[None]]
+# (тело запроса шага, query-параметры, колбэк частичных результатов) -> итог (meta или весь ответ)
+JobHandler = Callable[[dict[str, Any], dict[str, Any], ItemCallback], Awaitable[dict[str, Any]]]
+
+
+def _dumps(obj: Any) -> str:
+    return json.dumps(obj, ensure_ascii=False, default=str)
+
+
+def _error_text(exc: BaseException) -> str:
+    detail = getattr(exc, "detail", None)
+    if detail is not None:
+        # HTTPException шага (например, "GL_WHAPI_TO is not set")
+        return f"HTTP {getattr(exc, 'status_code', '?')}: {detail}"
+    return f"{exc.__class__.__name__}: {exc}"
+
+
+class JobQueue:
+    """
+    Асинхронные задания шагов (SQLite) с пулом воркеров: `POST /jobs/{step}` сразу отдаёт id,
+    шаг выполняется в фоне, `GET /jobs/{id}` показывает прогресс и готовые item-ы.
+
+    - задание берёт один процесс (`owner`) под аренду `lease_s`, пока оно выполняется, аренда
+      продлевается; с истёкшей арендой (процесс умер) задание возвращается в "queued" и выполняется
+      заново — при старте и раз в минуту, в том числе живым соседом по тому же файлу (несколько
+      воркеров uvicorn). Частичные результаты прерванного прогона сбрасываются;
+    - задания с отправкой в WhatsApp (`sends=True`) заново выполняются только с журналом отправок
+      (`GL_SEND_LEDGER_DB`), без него прерванное задание становится "failed": повтор продублировал бы
+      уже доставленные сообщения;
+    - тело запроса хранится только до завершения задания;
+    - завершённые задания удаляются через `ttl_s`.
+
+    Статусы: queued → running → done | failed.
+    """
+
+    def __init__(
+        self, path: str, *, workers: int, ttl_s: float, max_queued: int, lease_s: float = 60.0,
+        resend_safe: bool = False,
+    ) -> None:
+        self.path = path
+        self.workers = workers
+        self.ttl_s = ttl_s
+        self.max_queued = max_queued
+        self.lease_s = lease_s
+        # True — повтор отправки не дублирует сообщения (настроен журнал отправок)
+        self.resend_safe = resend_safe
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.handlers: dict[str, JobHandler] = {}
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        self._wake = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+        self._running: set[str] = set()
+        self._last_prune = 0.0
+
+    def register(self, step: str, handler: JobHandler) -> None:
+        self.handlers[step] = handler
+
+    # --- SQLite (синхронно, вызывается через asyncio.to_thread) ---
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, step TEXT NOT NULL, status TEXT NOT NULL, params TEXT NOT NULL,"
+                " request TEXT, total INTEGER NOT NULL, done INTEGER NOT NULL DEFAULT 0,"
+                " failed INTEGER NOT NULL DEFAULT 0, result TEXT, error TEXT,"
+                " created_at REAL NOT NULL, updated_at REAL NOT NULL, finished_at REAL,"
+                " sends INTEGER NOT NULL DEFAULT 0, owner TEXT, lease_until REAL)"
+            )
+            # Файл от версии без аренды
+            columns = {r[1] for r in db.execute("PRAGMA table_info(jobs)")}
+            for name, ddl in (("sends", "INTEGER NOT NULL DEFAULT 0"), ("owner", "TEXT"), ("lease_until", "REAL")):
+                if name not in columns:
+                    db.execute(f"ALTER TABLE jobs ADD COLUMN {name} {ddl}")
+            db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, created_at)")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS job_items ("
+                " job_id TEXT NOT NULL, idx INTEGER NOT NULL, item TEXT, error TEXT,"
+                " PRIMARY KEY (job_id, idx))"
+            )
+            db.commit()
+            self._db = db
+        return self._db
+
+    def _insert(self, step: str, body: dict[str, Any], params: dict[str, Any], sends: bool = False) -> str:
+        now = time.time()
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            db = self._conn()
+            queued = db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if queued >= self.max_queued:
+                raise JobQueueFullError(f"{queued} jobs already queued")
+            db.execute(
+                "INSERT INTO jobs (id, step, status, params, request, total, created_at, updated_at, sends)"
+                " VALUES (?, ?, 'queued', ?, ?, ?, ?, ?, ?)",
+                (job_id, step, _dumps(params), _dumps(body), len(body.get("items") or []), now, now, int(sends)),
+            )
+            db.commit()
+        return job_id
+
+    def _claim(self) -> tuple[str, str, dict[str, Any], dict[str, Any]] | None:
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            while True:
+                row = db.execute(
+                    "SELECT id, step, params, request FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    return None
+                # Файл общий для нескольких процессов: задание достаётся тому, чей UPDATE прошёл первым
+                cur = db.execute(
+                    "UPDATE jobs SET status = 'running', owner = ?, lease_until = ?, updated_at = ?"
+                    " WHERE id = ? AND status = 'queued'",
+                    (self.owner, now + self.lease_s, now, row[0]),
+                )
+                db.commit()
+                if cur.rowcount:
+                    return row[0], row[1], json.loads(row[2]), json.loads(row[3] or "{}")
+
+    def _add_item(self, job_id: str, index: int, item: dict[str, Any] | None, error: dict[str, str] | None) -> None:
+        with self._lock:
+            db = self._conn()
+            # Аренду перехватил другой процесс — результаты этого прогона уже не нужны
+            cur = db.execute(
+                f"UPDATE jobs SET done = done + 1, {'failed = failed + 1, ' if error else ''}updated_at = ?"
+                " WHERE id = ? AND owner = ? AND status = 'running'",
+                (time.time(), job_id, self.owner),
+            )
+            if cur.rowcount:
+                db.execute(
+                    "INSERT OR REPLACE INTO job_items (job_id, idx, item, error) VALUES (?, ?, ?, ?)",
+                    (job_id, index, None if item is None else _dumps(item), None if error is None else _dumps(error)),
+                )
+            db.commit()
+
+    def _finish(self, job_id: str, *, result: dict[str, Any] | None, error: str | None) -> None:
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, request = NULL, updated_at = ?, finished_at = ?,"
+                " lease_until = NULL WHERE id = ? AND owner = ? AND status = 'running'",
+                ("failed" if error else "done", None if result is None else _dumps(result), error, now, now, job_id,
+                 self.owner),
+            )
+            db.commit()
+
+    def _renew_leases(self, job_ids: list[str]) -> None:
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            db.executemany(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND owner = ? AND status = 'running'",
+                [(now + self.lease_s, job_id, self.owner) for job_id in job_ids],
+            )
+            db.commit()
+
+    def _requeue_expired(self) -> tuple[int, int]:
+        """Задания с истёкшей арендой: (возвращено в очередь, помечено failed)."""
+
+        now = time.time()
+        expired = "status = 'running' AND (lease_until IS NULL OR lease_until < ?)"
+        with self._lock:
+            db = self._conn()
+            failed = 0
+            if not self.resend_safe:
+                failed = db.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, request = NULL, owner = NULL, lease_until = NULL,"
+                    f" updated_at = ?, finished_at = ? WHERE sends = 1 AND {expired}",
+                    (INTERRUPTED_SEND_ERROR, now, now, now),
+                ).rowcount
+            db.execute(f"DELETE FROM job_items WHERE job_id IN (SELECT id FROM jobs WHERE {expired})", (now,))
+            requeued = db.execute(
+                "UPDATE jobs SET status = 'queued', done = 0, failed = 0, owner = NULL, lease_until = NULL,"
+                f" updated_at = ? WHERE {expired}",
+                (now, now),
+            ).rowcount
+            db.commit()
+            return requeued, failed
+
+    def _prune(self) -> int:
+        cutoff = time.time() - self.ttl_s
+        with self._lock:
+            db = self._conn()
+            db.execute(
+                "DELETE FROM job_items WHERE job_id IN (SELECT id FROM jobs WHERE finished_at < ?)", (cutoff,)
+            )
+            cur = db.execute("DELETE FROM jobs WHERE finished_at < ?", (cutoff,))
+            db.commit()
+            return cur.rowcount
+
+    def get(self, job_id: str, *, with_items: bool = True) -> dict[str, Any] | None:
+        with self._lock:
+            db = self._conn()
+            row = db.execute(
+                "SELECT id, step, status, total, done, failed, result, error, created_at, updated_at, finished_at"
+                " FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+            rows = (
+                db.execute("SELECT idx, item, error FROM job_items WHERE job_id = ? ORDER BY idx", (job_id,)).fetchall()
+                if row is not None and with_items
+                else []
+            )
+        if row is None:
+            return None
+        out: dict[str, Any] = {
+            "id": row[0],
+            "step": row[1],
+            "status": row[2],
+            "progress": {"total": row[3], "done": row[4], "failed": row[5]},
+            "result": json.loads(row[6]) if row[6] else None,
+            "error": row[7],
+            "created_at": row[8],
+            "updated_at": row[9],
+            "finished_at": row[10],
+            "expires_at": row[10] + self.ttl_s if row[10] is not None else None,
+        }
+        if with_items:
+            out["items"] = [
+                {"index": idx, "item": json.loads(item)} if item is not None else {"index": idx, "error": json.loads(err)}
+                for idx, item, err in rows
+            ]
+        return out
+
+    # --- asyncio ---
+
+    async def submit(self, step: str, body: dict[str, Any], params: dict[str, Any], *, sends: bool = False) -> str:
+        """`sends` — задание отправляет сообщения в WhatsApp (см. повтор прерванных заданий)."""
+
+        if step not in self.handlers:
+            raise KeyError(step)
+        job_id = await asyncio.to_thread(self._insert, step, body, params, sends)
+        self._wake.set()
+        return job_id
+
+    async def _run(self, job_id: str, step: str, params: dict[str, Any], body: dict[str, Any]) -> None:
+        async def on_item(index: int, res: dict[str, Any] | Exception) -> None:
+            if isinstance(res, Exception):
+                error = {"type": res.__class__.__name__, "error": str(res)}
+                await asyncio.to_thread(self._add_item, job_id, index, None, error)
+            else:
+                await asyncio.to_thread(self._add_item, job_id, index, res, None)
+
+        started = time.perf_counter()
+        self._running.add(job_id)
+        try:
+            result = await self.handlers[step](body, params, on_item)
+        except Exception as e:
+            print(f"❌ Job {job_id} ({step}) failed: {_error_text(e)}")
+            await asyncio.to_thread(self._finish, job_id, result=None, error=_error_text(e))
+            return
+        finally:
+            self._running.discard(job_id)
+        print(f"📦 Job {job_id} ({step}) done in {time.perf_counter() - started:.1f}s")
+        await asyncio.to_thread(self._finish, job_id, result=result, error=None)
+
+    async def _recover(self) -> None:
+        requeued, failed = await asyncio.to_thread(self._requeue_expired)
+        if requeued:
+            print(f"📦 Jobs: {requeued} interrupted job(s) requeued")
+            self._wake.set()
+        if failed:
+            print(f"⚠️ Jobs: {failed} interrupted send job(s) marked failed (GL_SEND_LEDGER_DB is not set)")
+
+    async def _maybe_prune(self) -> None:
+        if time.monotonic() - self._last_prune < 60:
+            return
+        self._last_prune = time.monotonic()
+        await self._recover()
+        removed = await asyncio.to_thread(self._prune)
+        if removed:
+            print(f"📦 Jobs: {removed} expired job(s) removed")
+
+    async def _heartbeat(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease_s / 3)
+            if not self._running:
+                continue
+            try:
+                await asyncio.to_thread(self._renew_leases, list(self._running))
+            except Exception as e:
+                print(f"❌ Job lease renewal error: {e!r}")
+
+    async def _worker(self) -> None:
+        while True:
+            self._wake.clear()
+            try:
+                await self._maybe_prune()
+                claimed = await asyncio.to_thread(self._claim)
+            except Exception as e:
+                # Сбой самого хранилища (SQLite) — воркер не должен умирать
+                print(f"❌ Job worker error: {e!r}")
+                claimed = None
+            if claimed is None:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), 5.0)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            job_id, step, params, body = claimed
+            await self._run(job_id, step, params, body)
+
+    async def start(self) -> None:
+        self._wake = asyncio.Event()
+        self._running = set()
+        # Только задания с истёкшей арендой: живой сосед по файлу свои продлевает
+        await self._recover()
+        self._last_prune = time.monotonic()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(max(1, self.workers))]
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+# None — асинхронные задания выключены (GL_JOBS_DB не задан)
+job_queue = (
+    JobQueue(
+        settings.jobs_db,
+        workers=settings.job_workers,
+        ttl_s=settings.job_ttl_s,
+        max_queued=settings.job_max_queued,
+        lease_s=settings.job_lease_s,
+        resend_safe=bool(settings.send_ledger_db),
+    )
+    if settings.jobs_db
+    else None
+)
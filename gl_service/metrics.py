@@ -0,0 +1,198 @@
+"""
+Метрики в текстовом формате Prometheus (без prometheus_client).
+
+Запись — словарь по кортежу меток + инкремент, без блокировок: всё пишется из event loop
+(пул извлечения меряется в основном процессе). Значения меток — только из фиксированных
+наборов (шаблон пути, имя upstream-а, режим извлечения, HTTP-статус), поэтому число рядов ограничено.
+"""
+
+from __future__ import annotations
+
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Iterable
+
+# Секунды: от быстрых шагов до долгих загрузок документов в Whapi
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+ITEMS_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help_
+        self.labelnames = labelnames
+        self._children: dict[tuple[str, ...], Any] = {}
+        REGISTRY.append(self)
+        if not labelnames:
+            self.labels()  # ряд без меток виден в /metrics сразу, с нулём
+
+    def _new_child(self) -> Any:
+        raise NotImplementedError
+
+    def labels(self, *values: str) -> Any:
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {values}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _label_str(self, values: tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{k}="{_escape(v)}"' for k, v in zip(self.labelnames, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def _samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        head = f"# HELP {self.name} {self.help}\n# TYPE {self.name} {self.kind}\n"
+        return head + "".join(line + "\n" for line in self._samples())
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def _samples(self) -> Iterable[str]:
+        for values, child in self._children.items():
+            yield f"{self.name}{self._label_str(values)} {_fmt(child.value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self, name: str, help_: str, labelnames: tuple[str, ...] = (), *, buckets: tuple[float, ...] = LATENCY_BUCKETS
+    ) -> None:
+        super().__init__(name, help_, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def _samples(self) -> Iterable[str]:
+        for values, child in self._children.items():
+            acc = 0
+            for le, n in zip((*self.buckets, float("inf")), child.counts):
+                acc += n
+                le_label = 'le="' + _fmt(le) + '"'
+                yield f"{self.name}_bucket{self._label_str(values, le_label)} {acc}"
+            yield f"{self.name}_sum{self._label_str(values)} {_fmt(child.sum)}"
+            yield f"{self.name}_count{self._label_str(values)} {acc}"
+
+
+REGISTRY: list[_Metric] = []
+
+
+def render() -> str:
+    return "".join(m.render() for m in REGISTRY)
+
+
+# --- метрики сервиса ---
+
+http_request_seconds = Histogram(
+    "gl_http_request_duration_seconds", "Время обработки запроса к сервису", ("path", "status")
+)
+http_in_flight = Gauge("gl_http_requests_in_flight", "Запросы к сервису в обработке")
+upstream_seconds = Histogram(
+    "gl_upstream_request_duration_seconds", "Время ответа upstream-а (до заголовков)", ("upstream",)
+)
+upstream_responses = Counter(
+    "gl_upstream_responses_total", "Ответы upstream-ов по HTTP-статусу (error — сетевая ошибка)", ("upstream", "status")
+)
+upstream_in_flight = Gauge("gl_upstream_requests_in_flight", "Запросы к upstream-у в полёте", ("upstream",))
+extract_seconds = Histogram("gl_extract_duration_seconds", "Время извлечения текста вложения", ("mode",))
+decoded_bytes = Counter("gl_attachment_decoded_bytes_total", "Байты вложений после base64 / blob store", ("source",))
+batch_items = Histogram("gl_batch_items", "Item-ов в одном запросе шага", ("step",), buckets=ITEMS_BUCKETS)
+cache_requests = Counter("gl_cache_requests_total", "Обращения к кэшам: hit / miss", ("cache", "result"))
+tasks_in_flight = Gauge("gl_batch_tasks_in_flight", "Задачи батча, выполняющиеся параллельно")
+
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware: время запроса до конца тела ответа (в т.ч. NDJSON-стримов) и число запросов
+    в обработке. Путь — шаблон маршрута (`/send_queue/jobs/{job_id}`), неизвестные — "other".
+    """
+
+    def __init__(self, app: Callable[..., Awaitable[None]]) -> None:
+        self.app = app
+        self._paths: dict[Any, str] | None = None
+
+    def _path(self, scope: dict[str, Any]) -> str:
+        if self._paths is None:
+            # Маршруты известны только после сборки приложения — строим карту при первом запросе
+            routes = getattr(scope.get("app"), "routes", [])
+            self._paths = {getattr(r, "endpoint", None): r.path for r in routes if hasattr(r, "path")}
+        return self._paths.get(scope.get("endpoint"), "other")
+
+    async def __call__(self, scope: dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = "500"
+        in_flight = http_in_flight.labels()
+        in_flight.inc()
+
+        async def send_wrapper(message: dict[str, Any]) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            http_request_seconds.labels(self._path(scope), status).observe(time.perf_counter() - started)
@@ -1,9 +1,37 @@
 from __future__ import annotations
 
+import base64
+import binascii
 from datetime import datetime
 from typing import Any, Literal
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr, model_validator
+
+from . import metrics
+
+
+_URLSAFE = str.maketrans("-_", "+/")
+
+
+def _b64decode(text: str) -> tuple[bytes, bool]:
+    """(байты, строгий ли это base64). Строгий — стандартный алфавит с padding, без пробелов и префикса."""
+
+    try:
+        # validate=True не медленнее обычного декодирования и заодно проверяет строку
+        return base64.b64decode(text, validate=True), True
+    except binascii.Error:
+        pass
+    # data:-префикс, переносы строк и пробелы, URL-safe алфавит, base64 без padding
+    if text.startswith("data:"):
+        text = text.partition(",")[2]
+    text = "".join(text.split()).translate(_URLSAFE).rstrip("=")
+    return base64.b64decode(text + "=" * (-len(text) % 4), validate=False), False
+
+
+def decode_base64(text: str) -> bytes:
+    """Байты вложения из n8n `data` — так же, как их увидит `Attachment.raw_bytes()`."""
+
+    return _b64decode(text)[0]
 
 
 class Attachment(BaseModel):
@@ -11,13 +39,58 @@ class Attachment(BaseModel):
     Унифицированный формат вложения (аналогично n8n binary.attachment_0).
 
     data_base64 — содержимое файла в base64 (без data: prefix)
+    blob_ref — вместо data_base64: ссылка `gl-blob:sha256:<hex>` на файл в blob store
     """
 
     file_name: str
     mime_type: str = "application/octet-stream"
     file_size: int | None = None
     file_extension: str | None = None
-    data_base64: str
+    data_base64: str = ""
+    blob_ref: str | None = None
+    # Ключ в n8n binary, откуда пришло вложение ("attachment_1") — им шаги ссылаются на файл
+    binary_key: str | None = None
+
+    # Декодированное содержимое: декодируем (или читаем из blob store) не больше одного раза
+    _raw: bytes | None = PrivateAttr(default=None)
+    # data_base64 — строгий base64 (можно отдавать в Gemini как есть)
+    _strict_base64: bool = PrivateAttr(default=False)
+
+    def raw_bytes(self) -> bytes:
+        """
+        Байты файла. Повторные вызовы отдают тот же объект `bytes` без копий —
+        его же получают экстракторы, кэш анализа и Whapi.
+        """
+
+        if self._raw is None:
+            if self.blob_ref:
+                from .blob_store import blob_store
+
+                self._raw = blob_store.get(self.blob_ref)
+            else:
+                self._raw, self._strict_base64 = _b64decode(self.data_base64)
+            metrics.decoded_bytes.labels("blob" if self.blob_ref else "base64").inc(len(self._raw))
+        return self._raw
+
+    @classmethod
+    def from_bytes(cls, raw: bytes, *, file_name: str, mime_type: str) -> Attachment:
+        """Вложение из уже готовых байтов (очередь отправки, тесты) — без base64."""
+
+        att = cls(file_name=file_name, mime_type=mime_type, file_size=len(raw))
+        att._raw = raw
+        return att
+
+    def base64_text(self) -> str:
+        """
+        base64 для Gemini inline_data: исходная строка из n8n как есть, без повторного кодирования,
+        если при декодировании она оказалась строгим base64. Переносы строк, пробелы, URL-safe алфавит,
+        `data:`-префикс Gemini отвергнет — такие (и вложения из blob store) перекодируем из `raw_bytes()`.
+        """
+
+        raw = self.raw_bytes()
+        if self.data_base64 and self._strict_base64:
+            return self.data_base64
+        return base64.b64encode(raw).decode("ascii")
 
 
 class Email(BaseModel):
@@ -29,11 +102,37 @@ class Email(BaseModel):
     date: datetime | None = None
     snippet: str = ""
     label_ids: list[str] | None = None
+    # Первое вложение (binary.attachment_0); документом в WhatsApp уходит главное — `send_attachment`
     attachment: Attachment | None = None
+    # Все binary.attachment_N по порядку N (в анализ идут все, см. steps.step_analyze_attachment)
+    attachments: list[Attachment] = Field(default_factory=list)
+
+    @model_validator(mode="after")
+    def _sync_attachments(self) -> Email:
+        # Можно задать любое из двух полей: Email(attachment=...) — письмо с одним вложением
+        if not self.attachments and self.attachment is not None:
+            self.attachments = [self.attachment]
+        elif self.attachments and self.attachment is None:
+            self.attachment = self.attachments[0]
+        return self
+
+    def send_attachment(self, binary_key: str | None = None) -> Attachment | None:
+        """
+        Вложение для отправки в WhatsApp: выбранное анализом главное (`binary_key` из
+        `json.primary_attachment`), иначе первое.
+        """
+
+        if binary_key:
+            for att in self.attachments:
+                if att.binary_key == binary_key:
+                    return att
+        return self.attachment
 
 
 class ClassifyResult(BaseModel):
     is_guarantee_letter: bool
+    # Кто решил: локальные правила (rules.py), кэш прошлых ответов модели или модель
+    decided_by: Literal["rules", "cache", "openai"] = "openai"
 
 
 class GuaranteeDocExtract(BaseModel):
@@ -48,6 +147,8 @@ class WhatsAppSendResult(BaseModel):
     ok: bool
     text_message_id: str | None = None
     document_message_id: str | None = None
+    # Всё уже было отправлено раньше — ответ из журнала отправок, в Whapi ничего не ушло
+    deduplicated: bool = False
     raw: Any | None = None
 
 
@@ -4,10 +4,12 @@ from datetime import datetime
 import re
 from typing import Any
 
+from .blob_store import is_blob_ref
 from .models import Attachment, Email
 
 
 _SIZE_RE = re.compile(r"^\s*(\d+(?:[.,]\d+)?)\s*([a-zA-Z]{0,3})\s*$")
+_ATTACHMENT_KEY_RE = re.compile(r"^attachment_(\d+)$")
 
 
 def _coerce_file_size(value: Any) -> int | None:
@@ -92,6 +94,23 @@ def _coerce_email_field(value: Any) -> str:
         return ""
 
 
+def _attachment_from_n8n(key: str, value: Any) -> Attachment | None:
+    if not (isinstance(value, dict) and value.get("data")):
+        return None
+    data = value.get("data")
+    # data может быть ссылкой на blob store (GL_BLOB_REFS) — читаем файл лениво, когда понадобится
+    ref = data if is_blob_ref(data) else None
+    return Attachment(
+        file_name=value.get("fileName") or "attachment",
+        mime_type=value.get("mimeType") or "application/octet-stream",
+        file_size=_coerce_file_size(value.get("fileSize")),
+        file_extension=value.get("fileExtension"),
+        data_base64="" if ref else data,
+        blob_ref=ref,
+        binary_key=key,
+    )
+
+
 def email_from_n8n_item(item: dict) -> Email:
     """
     Конвертер из формата n8n item -> Email.
@@ -99,7 +118,7 @@ def email_from_n8n_item(item: dict) -> Email:
     Ожидаем структуру:
     {
       "json": { id, threadId, subject, from, to, date, snippet, labelIds, ... },
-      "binary": { "attachment_0": { data, fileName, mimeType, fileSize, fileExtension, ... } }
+      "binary": { "attachment_0": { data, fileName, mimeType, fileSize, fileExtension, ... }, "attachment_1": ... }
     }
     """
 
@@ -115,16 +134,12 @@ def email_from_n8n_item(item: dict) -> Email:
         except Exception:
             dt = None
 
-    att = None
-    a0 = bn.get("attachment_0")
-    if isinstance(a0, dict) and a0.get("data"):
-        att = Attachment(
-            file_name=a0.get("fileName") or "attachment",
-            mime_type=a0.get("mimeType") or "application/octet-stream",
-            file_size=_coerce_file_size(a0.get("fileSize")),
-            file_extension=a0.get("fileExtension"),
-            data_base64=a0.get("data"),
-        )
+    # attachment_0, attachment_1, ..., attachment_10 — по номеру, а не по строке
+    numbered = sorted(
+        ((int(m.group(1)), key, value) for key, value in bn.items() if (m := _ATTACHMENT_KEY_RE.match(key))),
+        key=lambda row: row[0],
+    )
+    attachments = [att for _n, key, value in numbered if (att := _attachment_from_n8n(key, value)) is not None]
 
     return Email(
         id=str(js.get("id") or ""),
@@ -135,7 +150,8 @@ def email_from_n8n_item(item: dict) -> Email:
         date=dt,
         snippet=js.get("snippet") or "",
         label_ids=js.get("labelIds"),
-        attachment=att,
+        # attachment — первое из них, тот же объект: байты декодируются один раз
+        attachments=attachments,
     )
 
 
@@ -158,13 +174,13 @@ def email_to_n8n_item(email: Email) -> dict:
         "binary": {},
     }
 
-    if email.attachment is not None:
-        out["binary"]["attachment_0"] = {
-            "data": email.attachment.data_base64,
-            "fileName": email.attachment.file_name,
-            "mimeType": email.attachment.mime_type,
-            "fileSize": email.attachment.file_size,
-            "fileExtension": email.attachment.file_extension,
+    for n, att in enumerate(email.attachments):
+        out["binary"][att.binary_key or f"attachment_{n}"] = {
+            "data": att.blob_ref or att.data_base64,
+            "fileName": att.file_name,
+            "mimeType": att.mime_type,
+            "fileSize": att.file_size,
+            "fileExtension": att.file_extension,
         }
 
     return out
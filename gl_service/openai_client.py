@@ -1,7 +1,9 @@
 from __future__ import annotations
 
-import httpx
+import json
 
+from .http_clients import http_clients
+from .resilience import guards
 from .models import ClassifyResult
 from .settings import settings
 
@@ -10,6 +12,10 @@ class OpenAIError(RuntimeError):
     pass
 
 
+# Меняй при любой правке промптов классификации: версия входит в ключ кэша (см. steps.classify_cache_keys).
+CLASSIFY_PROMPT_VERSION = "1"
+
+
 _CLASSIFY_PROMPT = """\
 Проанализируй письмо и определи, является ли оно гарантийным письмом от страховой компании.
 
@@ -29,18 +35,34 @@ _CLASSIFY_PROMPT = """\
 """
 
 
-async def classify_is_guarantee_letter(*, subject: str, from_: str, snippet: str) -> ClassifyResult:
+_CLASSIFY_BATCH_PROMPT = """\
+Проанализируй письма и для каждого определи, является ли оно гарантийным письмом от страховой компании.
+
+Признаки гарантийного письма:
+- Отправитель: страховая компания (АльфаСтрахование, СОГАЗ, Ингосстрах, ВСК, РЕСО и др.)
+- Тема содержит: "гарантийное письмо", "гарантия", "ГП"
+- В тексте есть: ФИО пациента, номер полиса, медицинские услуги
+
+НЕ является гарантийным письмом: реклама, счета, акты, уведомления.
+
+Письма (JSON-массив, поле id — идентификатор письма):
+{emails}
+
+Верни ТОЛЬКО JSON без markdown, строго формата:
+{{"results": [{{"id": "<id письма>", "is_guarantee_letter": true/false}}, ...]}}
+По одному элементу на каждое письмо, id — ровно как во входных данных.
+"""
+
+
+async def _chat_json(prompt: str) -> str:
     """
-    Упрощённый аналог вашего `OpenAI Classify` + structured parser.
+    Chat Completions — минимальная зависимость (без SDK).
+    Просим вернуть JSON object; возвращаем строку content как есть.
     """
 
     if not settings.openai_api_key:
         raise OpenAIError("GL_OPENAI_API_KEY is not set")
 
-    prompt = _CLASSIFY_PROMPT.format(subject=subject or "", from_=from_ or "", snippet=snippet or "")
-
-    # Chat Completions — минимальная зависимость (без SDK).
-    # Просим вернуть JSON object; дальше валидируем pydantic-моделью.
     payload = {
         "model": settings.openai_model,
         "temperature": 0.1,
@@ -53,18 +75,30 @@ async def classify_is_guarantee_letter(*, subject: str, from_: str, snippet: str
 
     headers = {"Authorization": f"Bearer {settings.openai_api_key}"}
 
-    async with httpx.AsyncClient(timeout=60) as client:
-        resp = await client.post("https://api.openai.com/v1/chat/completions", json=payload, headers=headers)
-        if resp.status_code >= 400:
-            raise OpenAIError(f"OpenAI HTTP {resp.status_code}: {resp.text}")
-        data = resp.json()
+    client = http_clients.get("openai")
+    resp = await guards["openai"].request(lambda: client.post("/chat/completions", json=payload, headers=headers))
+    if resp.status_code >= 400:
+        raise OpenAIError(f"OpenAI HTTP {resp.status_code}: {resp.text}")
+    data = resp.json()
 
-    content = (
+    return (
         data.get("choices", [{}])[0]
         .get("message", {})
         .get("content", "")
     )
 
+
+async def classify_is_guarantee_letter(*, subject: str, from_: str, snippet: str) -> ClassifyResult:
+    """
+    Упрощённый аналог вашего `OpenAI Classify` + structured parser.
+    """
+
+    if not settings.openai_api_key:
+        raise OpenAIError("GL_OPENAI_API_KEY is not set")
+
+    prompt = _CLASSIFY_PROMPT.format(subject=subject or "", from_=from_ or "", snippet=snippet or "")
+    content = await _chat_json(prompt)
+
     try:
         # pydantic сам распарсит dict, но тут приходит строка
         return ClassifyResult.model_validate_json(content)
@@ -72,3 +106,47 @@ async def classify_is_guarantee_letter(*, subject: str, from_: str, snippet: str
         raise OpenAIError(f"Failed to parse OpenAI JSON: {content}") from e
 
 
+def _parse_batch_results(content: str, ids: set[str]) -> dict[str, ClassifyResult]:
+    """
+    Берём только корректные элементы с известными id; остальное вызывающий код
+    доклассифицирует по одному письму.
+    """
+
+    try:
+        obj = json.loads(content)
+    except ValueError:
+        return {}
+    rows = obj.get("results") if isinstance(obj, dict) else obj
+    if not isinstance(rows, list):
+        return {}
+
+    out: dict[str, ClassifyResult] = {}
+    for row in rows:
+        if not isinstance(row, dict):
+            continue
+        rid, flag = str(row.get("id")), row.get("is_guarantee_letter")
+        if rid in ids and rid not in out and isinstance(flag, bool):
+            out[rid] = ClassifyResult(is_guarantee_letter=flag)
+    return out
+
+
+async def classify_batch(emails: list[dict[str, str]]) -> dict[str, ClassifyResult]:
+    """
+    Классификация нескольких писем одним запросом.
+
+    emails: [{"id", "subject", "from", "snippet"}, ...] — id должны быть уникальны.
+    Возвращает {id: ClassifyResult} только для писем, по которым модель дала валидный ответ.
+    """
+
+    if not emails:
+        return {}
+    if not settings.openai_api_key:
+        raise OpenAIError("GL_OPENAI_API_KEY is not set")
+
+    rows = [
+        {"id": e["id"], "subject": e.get("subject") or "", "from": e.get("from") or "", "snippet": e.get("snippet") or ""}
+        for e in emails
+    ]
+    prompt = _CLASSIFY_BATCH_PROMPT.format(emails=json.dumps(rows, ensure_ascii=False, indent=1))
+    content = await _chat_json(prompt)
+    return _parse_batch_results(content, {r["id"] for r in rows})
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+from typing import Any
+
+from .concurrency import gather_bounded
+from .models import Email
+from .n8n_adapter import email_from_n8n_item
+from .settings import settings
+from .steps import (
+    UPSTREAM_ERRORS,
+    analyze_meta,
+    step_analyze_attachment,
+    step_build_message,
+    step_classify_many,
+    step_commit_watermarks,
+    step_dedupe_latest,
+    step_drop_seen,
+    step_no_attachment_fallback,
+)
+from .whapi_client import send_text_and_optional_doc
+
+
+def _summary(index: int, email: Email) -> dict[str, Any]:
+    # Компактный результат: без binary/base64, только то, что нужно n8n дальше.
+    return {
+        "index": index,
+        "id": email.id,
+        "threadId": email.thread_id,
+        "subject": email.subject,
+        "has_attachment": email.attachment is not None,
+    }
+
+
+def _finished(res: dict[str, Any], *, send: bool) -> bool:
+    """
+    Письмо можно отметить водяным знаком: классификатор его отбраковал, либо оно отправлено
+    (`send`), либо — без отправки — успешно проанализировано.
+    """
+
+    if res.get("is_guarantee_letter") is False:
+        return True
+    if send:
+        return "sent" in res
+    return "ai_response" in res
+
+
+async def run_pipeline(
+    items: list[dict],
+    *,
+    dedupe: bool = True,
+    classify: bool = True,
+    analyze: bool = True,
+    message: bool = True,
+    send: bool = False,
+    commit_watermark: bool = False,
+) -> tuple[list[dict[str, Any]], dict[str, Any]]:
+    """
+    Весь пайплайн за один вызов: dedupe → classify → analyze → message → (send).
+
+    Item-ы разбираются один раз; стадии выбираются флагами. Письма, которые
+    классификатор отбраковал, возвращаются с `is_guarantee_letter=false` и дальше не идут.
+    Возвращает (results, meta); results — по одному на письмо, оставшееся после dedupe,
+    `index` — позиция во входном `items`. Если анализ упал на upstream-е (Gemini, breaker) —
+    у письма `analyze_error`, сообщение для него не строится и не отправляется.
+
+    dedupe учитывает и водяные знаки прошлых запусков (GL_WATERMARK_DB); `commit_watermark`
+    сдвигает их только на доведённые до конца письма (`_finished`): иначе следующий запуск их отбросит.
+    """
+
+    meta: dict[str, Any] = {"items_in": len(items)}
+    emails = [email_from_n8n_item(it) for it in items]
+    index_of = {id(e): i for i, e in enumerate(emails)}
+
+    if dedupe:
+        emails, dropped = step_dedupe_latest(emails)
+        emails, seen = await step_drop_seen(emails)
+        meta["dropped"] = dropped
+        meta["seen"] = seen
+
+    results = {id(e): _summary(index_of[id(e)], e) for e in emails}
+    processed = list(emails)
+
+    if classify:
+        classify_meta: dict[str, Any] = {}
+        verdicts = await step_classify_many(emails, classify_meta)
+        meta["classify"] = classify_meta
+        for e, v in zip(emails, verdicts):
+            results[id(e)]["is_guarantee_letter"] = v.is_guarantee_letter
+            results[id(e)]["classified_by"] = v.decided_by
+        emails = [e for e, v in zip(emails, verdicts) if v.is_guarantee_letter]
+
+    send_message = send or message
+    infos: list[dict[str, Any]] = []
+
+    async def process(email: Email) -> None:
+        res = results[id(email)]
+        ai = None
+        send_att = email.attachment
+        if analyze:
+            info: dict[str, Any] = {}
+            infos.append(info)
+            try:
+                ai, att = await step_analyze_attachment(email, info)
+            except UPSTREAM_ERRORS as e:
+                # Gemini недоступен — письмо без результата: ни сообщения, ни отправки
+                res["analyze_error"] = f"{e.__class__.__name__}: {e}"
+                return
+            if ai is None:
+                ai = step_no_attachment_fallback(email)
+            if att is not None:
+                # Документом уходит главное вложение по рангу, а не attachment_0 (картинка подписи)
+                send_att = att
+            res["ai_response"] = ai.model_dump()
+            if "extract" in info:
+                res["extract"] = info["extract"]
+            if "attachments" in info:
+                res["attachments"] = info["attachments"]
+        if send_message:
+            res["message_text"] = step_build_message(ai)
+        if send:
+            try:
+                sent = await send_text_and_optional_doc(
+                    to=settings.whapi_to or "",
+                    text=res["message_text"],
+                    attachment=send_att,
+                    email_id=email.id,
+                )
+                res["sent"] = sent.model_dump()
+            except Exception as e:
+                # Не валим весь батч: уже отправленные письма n8n повторять не должен.
+                res["send_error"] = f"{e.__class__.__name__}: {e}"
+
+    if analyze or send_message:
+        _, stats = await gather_bounded(emails, process, limit=settings.analyze_concurrency)
+        meta["batch"] = stats.to_meta()
+    if analyze:
+        meta.update(analyze_meta(infos))
+
+    if commit_watermark:
+        ok = [e for e in processed if _finished(results[id(e)], send=send)]
+        meta["watermarks_advanced"] = await step_commit_watermarks(ok)
+
+    out = sorted(results.values(), key=lambda r: r["index"])
+    return out, meta
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import asyncio
+import random
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable
+
+import httpx
+
+from .settings import settings
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+def is_retryable_status(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
+
+
+def backoff_delay(attempt: int, *, base_s: float, max_s: float) -> float:
+    """Задержка перед попыткой attempt+1: экспонента с "equal jitter" (половина — случайна)."""
+
+    delay = min(max_s, base_s * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def retry_after_s(resp: httpx.Response) -> float | None:
+    """`Retry-After` в секундах (число или HTTP-дата); None — заголовка нет или он битый."""
+
+    value = resp.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class UpstreamGuard:
+    """
+    Обёртка над запросами к одному LLM-upstream-у (OpenAI / Gemini):
+
+    - ретраи на 429 / 5xx / сетевых ошибках: экспонента с джиттером, `Retry-After` имеет приоритет
+      (если он дольше `max_delay_s` — не ждём, отдаём ответ как есть);
+    - circuit breaker: после `breaker_threshold` запросов подряд, упавших после всех ретраев,
+      upstream "открыт" на `breaker_cooldown_s` — запросы сразу получают `CircuitOpenError`;
+      затем пропускается один пробный запрос; `breaker_threshold <= 0` — breaker выключен;
+    - hedging (опционально): если ответа нет дольше p95 последних запросов — параллельно
+      отправляется второй такой же, берётся первый ответ. Только для идемпотентных запросов.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        max_attempts: int,
+        base_delay_s: float,
+        max_delay_s: float,
+        breaker_threshold: int,
+        breaker_cooldown_s: float,
+        hedge: bool = False,
+        hedge_min_samples: int = 20,
+    ) -> None:
+        self.name = name
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay_s = base_delay_s
+        self.max_delay_s = max_delay_s
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown_s = breaker_cooldown_s
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self._latencies: deque[float] = deque(maxlen=200)
+        self._failures = 0
+        self._open_until = 0.0
+        self._probe_in_flight = False
+        self.retries = 0
+        self.hedged = 0
+        self.rejected = 0
+
+    # --- circuit breaker ---
+
+    def _breaker_on(self) -> bool:
+        return self.breaker_threshold > 0
+
+    def _check_breaker(self) -> bool:
+        """True — это пробный запрос после паузы (half-open)."""
+
+        if not self._breaker_on() or self._failures < self.breaker_threshold:
+            return False
+        if time.monotonic() < self._open_until or self._probe_in_flight:
+            self.rejected += 1
+            raise CircuitOpenError(f"{self.name}: circuit open after {self._failures} failures")
+        self._probe_in_flight = True
+        return True
+
+    def _record(self, ok: bool) -> None:
+        if ok:
+            self._failures = 0
+            return
+        self._failures += 1
+        if self._breaker_on() and self._failures >= self.breaker_threshold:
+            self._open_until = time.monotonic() + self.breaker_cooldown_s
+            print(f"⚠️ {self.name}: circuit open for {self.breaker_cooldown_s:g}s")
+
+    # --- hedging ---
+
+    def p95_s(self) -> float | None:
+        if len(self._latencies) < self.hedge_min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    async def _send_hedged(self, send: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+        p95 = self.p95_s() if self.hedge else None
+        if p95 is None:
+            return await send()
+        tasks = [asyncio.ensure_future(send())]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=p95)
+            if done:
+                return tasks[0].result()
+            self.hedged += 1
+            tasks.append(asyncio.ensure_future(send()))
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for fut in done:
+                    if fut.exception() is None:
+                        return fut.result()
+            # Обе попытки упали — пробрасываем ошибку первой
+            return tasks[0].result()
+        finally:
+            for fut in tasks:
+                fut.cancel()
+
+    # --- запрос ---
+
+    async def request(self, send: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+        """
+        `send` — фабрика запроса (вызывается на каждую попытку заново).
+        Возвращает последний ответ (в т.ч. 4xx/5xx — разбирает вызывающий код).
+        """
+
+        probe = self._check_breaker()
+        try:
+            attempt = 0
+            while True:
+                attempt += 1
+                started = time.monotonic()
+                delay: float | None = None
+                try:
+                    resp = await self._send_hedged(send)
+                except httpx.TransportError:
+                    if attempt >= self.max_attempts:
+                        self._record(ok=False)
+                        raise
+                else:
+                    if not is_retryable_status(resp.status_code):
+                        self._latencies.append(time.monotonic() - started)
+                        self._record(ok=True)
+                        return resp
+                    delay = retry_after_s(resp)
+                    if attempt >= self.max_attempts or (delay is not None and delay > self.max_delay_s):
+                        self._record(ok=False)
+                        return resp
+                if delay is None:
+                    delay = backoff_delay(attempt, base_s=self.base_delay_s, max_s=self.max_delay_s)
+                self.retries += 1
+                await asyncio.sleep(delay)
+        finally:
+            if probe:
+                self._probe_in_flight = False
+
+    def stats(self) -> dict[str, object]:
+        p95 = self.p95_s()
+        return {
+            "circuit": (
+                "disabled" if not self._breaker_on()
+                else "open" if self._failures >= self.breaker_threshold
+                else "closed"
+            ),
+            "consecutive_failures": self._failures,
+            "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "retries": self.retries,
+            "hedged": self.hedged,
+            "rejected": self.rejected,
+        }
+
+
+def _guard(name: str) -> UpstreamGuard:
+    return UpstreamGuard(
+        name,
+        max_attempts=settings.llm_max_attempts,
+        base_delay_s=settings.llm_retry_base_s,
+        max_delay_s=settings.llm_retry_max_s,
+        breaker_threshold=settings.llm_breaker_threshold,
+        breaker_cooldown_s=settings.llm_breaker_cooldown_s,
+        hedge=settings.llm_hedge,
+    )
+
+
+# Имена — как у пулов в http_clients
+guards = {"openai": _guard("openai"), "gemini": _guard("gemini")}
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import json
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+from .models import ClassifyResult, Email
+from .settings import settings
+
+
+# Те же признаки, что в _CLASSIFY_PROMPT (openai_client.py), но только однозначные.
+DEFAULT_RULES: dict[str, list[str]] = {
+    # Тема однозначно про гарантийное письмо — "да" от любого отправителя
+    "subject_yes": [r"гарантийн\w*\s+письм", r"(?-i:\bГП\b)"],
+    # Отправитель — страховая и в теме есть намёк на гарантию — "да"
+    "allow_domains": ["alfastrah.ru", "sogaz.ru", "ingos.ru", "vsk.ru", "reso.ru"],
+    "subject_hint": [r"гарант"],
+    # Однозначно "нет"
+    "subject_no": [r"\bакт\w*\s+сверки\b", r"\bсч[её]т[\s-]*фактур", r"\bрассылк", r"\bunsubscribe\b"],
+    "deny_domains": [],
+    "deny_labels": ["SPAM", "CATEGORY_PROMOTIONS", "CATEGORY_SOCIAL"],
+}
+
+_SENDER_DOMAIN_RE = re.compile(r"@([\w.-]+)")
+
+
+def _compile(patterns: list[str]) -> re.Pattern[str] | None:
+    # Один regex на список: matcher проходит по теме один раз
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{p})" for p in patterns), re.IGNORECASE)
+
+
+def _domains(values: list[str]) -> frozenset[str]:
+    return frozenset(d.strip().lower().lstrip("@") for d in values if d.strip())
+
+
+@dataclass(frozen=True)
+class RuleClassifier:
+    """
+    Локальный предклассификатор: уверенное "да"/"нет" по отправителю, теме и labelIds
+    без запроса к OpenAI; None — неоднозначно, решает модель.
+
+    Порядок: deny_labels / deny_domains → subject_yes → allow_domains + subject_hint → subject_no.
+    """
+
+    subject_yes: re.Pattern[str] | None = None
+    subject_hint: re.Pattern[str] | None = None
+    subject_no: re.Pattern[str] | None = None
+    allow_domains: frozenset[str] = field(default_factory=frozenset)
+    deny_domains: frozenset[str] = field(default_factory=frozenset)
+    deny_labels: frozenset[str] = field(default_factory=frozenset)
+
+    @classmethod
+    def from_config(cls, cfg: dict[str, list[str]]) -> RuleClassifier:
+        return cls(
+            subject_yes=_compile(cfg.get("subject_yes", [])),
+            subject_hint=_compile(cfg.get("subject_hint", [])),
+            subject_no=_compile(cfg.get("subject_no", [])),
+            allow_domains=_domains(cfg.get("allow_domains", [])),
+            deny_domains=_domains(cfg.get("deny_domains", [])),
+            deny_labels=frozenset(cfg.get("deny_labels", [])),
+        )
+
+    @staticmethod
+    def _in(domain: str | None, domains: frozenset[str]) -> bool:
+        # mail.sogaz.ru совпадает с sogaz.ru
+        while domain:
+            if domain in domains:
+                return True
+            _, _, domain = domain.partition(".")
+        return False
+
+    def decide(self, email: Email) -> bool | None:
+        m = _SENDER_DOMAIN_RE.findall(email.from_ or "")
+        domain = m[-1].lower().rstrip(".>") if m else None
+        subject = email.subject or ""
+
+        if self.deny_labels and self.deny_labels.intersection(email.label_ids or ()):
+            return False
+        if self._in(domain, self.deny_domains):
+            return False
+        if self.subject_yes and self.subject_yes.search(subject):
+            return True
+        if self._in(domain, self.allow_domains) and self.subject_hint and self.subject_hint.search(subject):
+            return True
+        if self.subject_no and self.subject_no.search(subject):
+            return False
+        return None
+
+    def classify(self, email: Email) -> ClassifyResult | None:
+        verdict = self.decide(email)
+        if verdict is None:
+            return None
+        return ClassifyResult(is_guarantee_letter=verdict, decided_by="rules")
+
+
+@lru_cache(maxsize=1)
+def rule_classifier() -> RuleClassifier | None:
+    """
+    Собирается один раз на процесс: правила по умолчанию, поверх — ключи из
+    JSON-файла GL_CLASSIFY_RULES_PATH. None — предклассификатор выключен.
+    """
+
+    if not settings.classify_rules_enabled:
+        return None
+    cfg = dict(DEFAULT_RULES)
+    if settings.classify_rules_path:
+        with open(settings.classify_rules_path, encoding="utf-8") as f:
+            cfg.update(json.load(f))
+    return RuleClassifier.from_config(cfg)
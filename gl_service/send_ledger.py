@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import threading
+import time
+
+from .models import Attachment
+from .settings import settings
+
+
+def send_key(*, email_id: str, to: str, text: str, attachment: Attachment | None) -> str:
+    """
+    Ключ отправки: id письма + получатель + хэш содержимого (текст и байты вложения).
+    Изменился текст сообщения — это уже другая отправка.
+    """
+
+    content = hashlib.sha256(text.encode("utf-8"))
+    if attachment is not None:
+        content.update(b"\0" + hashlib.sha256(attachment.raw_bytes()).digest())
+    return f"{email_id}:{to}:{content.hexdigest()}"
+
+
+class SendLedger:
+    """
+    Журнал отправок в WhatsApp (SQLite): какие части (text / document) по ключу `send_key`
+    уже ушли и с какими message id. Повторный вызов из n8n отправляет только недостающее.
+
+    Перед отправкой часть резервируется (`reserve`, строка "pending"): параллельный вызов с тем же
+    ключом — ретрай n8n, пока первый ещё заливает документ, — видит резерв и не шлёт часть второй раз.
+    Резерв старше `pending_s` (процесс упал посреди отправки) можно перехватить.
+    """
+
+    def __init__(self, path: str, *, pending_s: float = 600.0) -> None:
+        self.path = path
+        self.pending_s = pending_s
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS sends ("
+                " key TEXT NOT NULL, part TEXT NOT NULL, message_id TEXT,"
+                " sent_at REAL NOT NULL, status TEXT NOT NULL DEFAULT 'sent', PRIMARY KEY (key, part))"
+            )
+            if "status" not in {r[1] for r in db.execute("PRAGMA table_info(sends)")}:
+                db.execute("ALTER TABLE sends ADD COLUMN status TEXT NOT NULL DEFAULT 'sent'")
+            db.commit()
+            self._db = db
+        return self._db
+
+    def get(self, key: str) -> dict[str, str | None]:
+        """Уже отправленные части: {"text": message_id, "document": message_id}."""
+
+        with self._lock:
+            rows = self._conn().execute(
+                "SELECT part, message_id FROM sends WHERE key = ? AND status = 'sent'", (key,)
+            ).fetchall()
+        return dict(rows)
+
+    def reserve(self, key: str, part: str) -> tuple[str, str | None]:
+        """
+        ("reserved", None) — часть наша, отправляй и вызови `record` (или `release` при ошибке);
+        ("sent", message_id) — уже отправлена; ("pending", None) — сейчас отправляет другой вызов.
+        """
+
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            cur = db.execute(
+                "INSERT OR IGNORE INTO sends (key, part, message_id, sent_at, status) VALUES (?, ?, NULL, ?, 'pending')",
+                (key, part, now),
+            )
+            if not cur.rowcount:
+                status, message_id, since = db.execute(
+                    "SELECT status, message_id, sent_at FROM sends WHERE key = ? AND part = ?", (key, part)
+                ).fetchone()
+                if status == "sent":
+                    return "sent", message_id
+                # Резерв брошен упавшим процессом — забираем (условие на sent_at: ровно один перехватчик)
+                cur = db.execute(
+                    "UPDATE sends SET sent_at = ? WHERE key = ? AND part = ? AND status = 'pending' AND sent_at = ?"
+                    " AND sent_at < ?",
+                    (now, key, part, since, now - self.pending_s),
+                )
+            db.commit()
+        return ("reserved", None) if cur.rowcount else ("pending", None)
+
+    def record(self, key: str, part: str, message_id: str | None) -> None:
+        with self._lock:
+            db = self._conn()
+            db.execute(
+                "INSERT OR REPLACE INTO sends (key, part, message_id, sent_at, status) VALUES (?, ?, ?, ?, 'sent')",
+                (key, part, message_id, time.time()),
+            )
+            db.commit()
+
+    def release(self, key: str, part: str) -> None:
+        """Снимает резерв после неудачной отправки: следующий вызов попробует снова."""
+
+        with self._lock:
+            db = self._conn()
+            db.execute("DELETE FROM sends WHERE key = ? AND part = ? AND status = 'pending'", (key, part))
+            db.commit()
+
+
+# None — журнал выключен (GL_SEND_LEDGER_DB не задан)
+send_ledger = (
+    SendLedger(settings.send_ledger_db, pending_s=settings.send_ledger_pending_s) if settings.send_ledger_db else None
+)
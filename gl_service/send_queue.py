@@ -0,0 +1,311 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any
+
+import httpx
+
+from .concurrency import TokenBucket
+from .models import Attachment
+from .resilience import backoff_delay, is_retryable_status
+from .settings import settings
+from .whapi_client import SendInProgressError, WhapiError, send_text_and_optional_doc
+
+
+@dataclass(frozen=True)
+class SendJob:
+    id: str
+    to: str
+    text: str
+    email_id: str | None
+    attempts: int
+    file_name: str | None = None
+    mime_type: str | None = None
+    data: bytes | None = None
+    # Уже отправленные части: {"text": message_id, "document": message_id}
+    parts: dict[str, str | None] = field(default_factory=dict)
+
+    def attachment(self) -> Attachment | None:
+        if self.data is None:
+            return None
+        return Attachment.from_bytes(self.data, file_name=self.file_name or "file", mime_type=self.mime_type or "")
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """
+    429 / 5xx от Whapi, сетевые ошибки и чужая отправка в процессе (журнал) — повторяем;
+    остальное (400, 401, нет токена) — нет.
+    """
+
+    if isinstance(exc, SendInProgressError):
+        return True
+    if isinstance(exc, WhapiError):
+        return exc.status_code is not None and is_retryable_status(exc.status_code)
+    return isinstance(exc, httpx.TransportError)
+
+
+class SendQueue:
+    """
+    Персистентная очередь отправок в WhatsApp (SQLite) с пулом воркеров.
+
+    - задания переживают рестарт: "sending" при старте возвращается в "queued";
+    - отправленные части (текст, документ) сразу пишутся в задание (`parts`): ретрай после 5xx
+      на документе и повтор после рестарта не шлют текст ещё раз — и без журнала GL_SEND_LEDGER_DB.
+      Без журнала может повториться только часть, которая отправлялась в момент падения процесса;
+    - результат после успешной отправки записывается с повторами (SQLite занят) и не считается
+      ошибкой отправки;
+    - лимиты Whapi: токен-бакет на аккаунт и на каждого получателя, токен на сообщение;
+    - 429 / 5xx / сетевые ошибки — ретрай после `Retry-After` или с экспоненциальной задержкой
+      и джиттером (`resilience.backoff_delay`), после `max_attempts` — "failed".
+
+    Статусы: queued → sending → sent | failed.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        workers: int,
+        max_attempts: int,
+        retry_base_s: float,
+        retry_max_s: float,
+        account_rate: float,
+        account_burst: float,
+        recipient_rate: float,
+        recipient_burst: float,
+    ) -> None:
+        self.path = path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base_s = retry_base_s
+        self.retry_max_s = retry_max_s
+        self.account_bucket = TokenBucket(rate=account_rate, burst=account_burst)
+        self.recipient_rate = recipient_rate
+        self.recipient_burst = recipient_burst
+        self._recipient_buckets: dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+        self._wake = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+
+    # --- SQLite (синхронно, вызывается через asyncio.to_thread) ---
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS send_jobs ("
+                " id TEXT PRIMARY KEY, status TEXT NOT NULL, to_ TEXT NOT NULL, text TEXT NOT NULL,"
+                " email_id TEXT, file_name TEXT, mime_type TEXT, data BLOB,"
+                " attempts INTEGER NOT NULL DEFAULT 0, next_at REAL NOT NULL,"
+                " result TEXT, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL, parts TEXT)"
+            )
+            if "parts" not in {r[1] for r in db.execute("PRAGMA table_info(send_jobs)")}:
+                db.execute("ALTER TABLE send_jobs ADD COLUMN parts TEXT")
+            db.execute("CREATE INDEX IF NOT EXISTS send_jobs_due ON send_jobs(status, next_at)")
+            db.commit()
+            self._db = db
+        return self._db
+
+    def _insert(self, jobs: list[dict[str, Any]]) -> list[str]:
+        now = time.time()
+        ids = [uuid.uuid4().hex for _ in jobs]
+        with self._lock:
+            db = self._conn()
+            db.executemany(
+                "INSERT INTO send_jobs (id, status, to_, text, email_id, file_name, mime_type, data,"
+                " next_at, created_at, updated_at) VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (jid, j["to"], j["text"], j.get("email_id"), j.get("file_name"), j.get("mime_type"),
+                     j.get("data"), now, now, now)
+                    for jid, j in zip(ids, jobs)
+                ],
+            )
+            db.commit()
+        return ids
+
+    def _claim(self) -> tuple[SendJob | None, float | None]:
+        """Берёт одно готовое к отправке задание; иначе — (None, время ближайшего)."""
+
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            row = db.execute(
+                "SELECT id, to_, text, email_id, attempts, file_name, mime_type, data, parts FROM send_jobs"
+                " WHERE status = 'queued' AND next_at <= ? ORDER BY next_at LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                nxt = db.execute("SELECT MIN(next_at) FROM send_jobs WHERE status = 'queued'").fetchone()[0]
+                return None, nxt
+            db.execute("UPDATE send_jobs SET status = 'sending', updated_at = ? WHERE id = ?", (now, row[0]))
+            db.commit()
+        return SendJob(*row[:-1], parts=json.loads(row[-1]) if row[-1] else {}), None
+
+    def _update(self, job_id: str, **fields: Any) -> None:
+        fields["updated_at"] = time.time()
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        with self._lock:
+            db = self._conn()
+            db.execute(f"UPDATE send_jobs SET {cols} WHERE id = ?", (*fields.values(), job_id))
+            db.commit()
+
+    def _requeue_inflight(self) -> int:
+        with self._lock:
+            db = self._conn()
+            cur = db.execute("UPDATE send_jobs SET status = 'queued' WHERE status = 'sending'")
+            db.commit()
+            return cur.rowcount
+
+    def get_many(self, job_ids: list[str]) -> list[dict[str, Any]]:
+        if not job_ids:
+            return []
+        with self._lock:
+            rows = self._conn().execute(
+                "SELECT id, status, to_, email_id, attempts, next_at, result, error, created_at, updated_at"
+                f" FROM send_jobs WHERE id IN ({','.join('?' * len(job_ids))})",
+                job_ids,
+            ).fetchall()
+        by_id = {
+            r[0]: {
+                "id": r[0],
+                "status": r[1],
+                "to": r[2],
+                "email_id": r[3],
+                "attempts": r[4],
+                "next_attempt_at": r[5] if r[1] == "queued" else None,
+                "result": json.loads(r[6]) if r[6] else None,
+                "error": r[7],
+                "created_at": r[8],
+                "updated_at": r[9],
+            }
+            for r in rows
+        }
+        return [by_id[j] for j in job_ids if j in by_id]
+
+    # --- asyncio ---
+
+    async def submit(self, jobs: list[dict[str, Any]]) -> list[str]:
+        """
+        Ставит отправки в очередь. Задание: to, text, email_id и, если есть вложение,
+        file_name / mime_type / data (байты). Возвращает job id в том же порядке.
+        """
+
+        ids = await asyncio.to_thread(self._insert, jobs)
+        self._wake.set()
+        return ids
+
+    def _recipient_bucket(self, to: str) -> TokenBucket:
+        bucket = self._recipient_buckets.get(to)
+        if bucket is None:
+            bucket = self._recipient_buckets[to] = TokenBucket(rate=self.recipient_rate, burst=self.recipient_burst)
+        return bucket
+
+    async def _process(self, job: SendJob) -> None:
+        messages = 1 if job.data is None else 2
+        await self.account_bucket.acquire(messages)
+        await self._recipient_bucket(job.to).acquire(messages)
+
+        attempt = job.attempts + 1
+        parts = dict(job.parts)
+
+        async def on_part(name: str, message_id: str | None) -> None:
+            parts[name] = message_id
+            await self._persist(job.id, parts=json.dumps(parts))
+
+        try:
+            res = await send_text_and_optional_doc(
+                to=job.to,
+                text=job.text,
+                attachment=job.attachment(),
+                email_id=job.email_id,
+                sent=job.parts,
+                on_part=on_part,
+            )
+        except Exception as e:
+            error = f"{e.__class__.__name__}: {e}"
+            if is_retryable(e) and attempt < self.max_attempts:
+                delay = getattr(e, "retry_after", None)
+                if delay is None:
+                    delay = backoff_delay(attempt, base_s=self.retry_base_s, max_s=self.retry_max_s)
+                print(f"⚠️ Send job {job.id} attempt {attempt} failed, retry in {delay:.1f}s: {error}")
+                await self._persist(job.id, status="queued", attempts=attempt, next_at=time.time() + delay, error=error)
+            else:
+                print(f"❌ Send job {job.id} failed: {error}")
+                await self._persist(job.id, status="failed", attempts=attempt, error=error)
+            return
+        # Байты вложения после отправки не нужны — не раздуваем файл очереди
+        await self._persist(
+            job.id, status="sent", attempts=attempt, result=res.model_dump_json(), error=None, data=None
+        )
+
+    async def _persist(self, job_id: str, **fields: Any) -> None:
+        """
+        `_update` с повторами: сообщение уже ушло — сбой SQLite (база занята) не должен оставить
+        задание в "sending" и привести к повторной отправке после рестарта.
+        """
+
+        delay = 0.5
+        while True:
+            try:
+                await asyncio.to_thread(self._update, job_id, **fields)
+                return
+            except sqlite3.Error as e:
+                print(f"⚠️ Send job {job_id}: state not saved ({e!r}), retry in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+    async def _worker(self) -> None:
+        while True:
+            self._wake.clear()
+            job, next_at = await asyncio.to_thread(self._claim)
+            if job is None:
+                # Спим до ближайшего ретрая или нового задания (и не дольше 5 с на всякий случай)
+                timeout = 5.0 if next_at is None else min(5.0, max(0.0, next_at - time.time()))
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._process(job)
+            except Exception as e:
+                # Сюда попадают только сбои самой очереди (SQLite) — воркер не должен умирать
+                print(f"❌ Send queue worker error on job {job.id}: {e!r}")
+
+    async def start(self) -> None:
+        requeued = await asyncio.to_thread(self._requeue_inflight)
+        if requeued:
+            print(f"📦 Send queue: {requeued} interrupted job(s) requeued")
+        self._wake = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(max(1, self.workers))]
+
+    async def stop(self) -> None:
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+# None — очередь выключена (GL_SEND_QUEUE_DB не задан)
+send_queue = (
+    SendQueue(
+        settings.send_queue_db,
+        workers=settings.send_queue_workers,
+        max_attempts=settings.send_max_attempts,
+        retry_base_s=settings.send_retry_base_s,
+        retry_max_s=settings.send_retry_max_s,
+        account_rate=settings.whapi_rate_per_s,
+        account_burst=settings.whapi_burst,
+        recipient_rate=settings.whapi_recipient_rate_per_s,
+        recipient_burst=settings.whapi_recipient_burst,
+    )
+    if settings.send_queue_db
+    else None
+)
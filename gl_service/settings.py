@@ -12,20 +12,129 @@ class Settings(BaseSettings):
     # OpenAI
     openai_api_key: str | None = None
     openai_model: str = "gpt-4o-mini"
+    openai_base_url: str = "https://api.openai.com/v1"
 
     # Google Gemini (Generative Language API)
     gemini_api_key: str | None = None
     gemini_model: str = "gemini-2.0-flash"
+    gemini_base_url: str = "https://generativelanguage.googleapis.com/v1beta"
 
     # Whapi (WhatsApp gateway)
     whapi_token: str | None = None
     whapi_base_url: str = "https://gate.whapi.cloud"
     whapi_to: str | None = None  # например: "120363178668706613@g.us"
+    whapi_document_timeout_s: float = 120.0  # загрузка документа дольше обычного запроса
+
+    # Общие HTTP-клиенты к upstream-ам (по одному на OpenAI/Gemini/Whapi, живут всё время процесса).
+    http2: bool = False  # нужен пакет h2 (`pip install httpx[http2]`)
+    http_max_connections: int = 20
+    http_max_keepalive_connections: int = 10
+    http_keepalive_expiry_s: float = 60.0
+    http_connect_timeout_s: float = 10.0
+    http_timeout_s: float = 60.0
+    http_prewarm: bool = True  # открыть соединения к upstream-ам при старте
+    # Прогрев после старта: процессы пула извлечения и импорт pdfminer/striprtf в фоне,
+    # через warmup_delay_s — когда сервер уже слушает порт и отвечает на /health.
+    warmup: bool = True
+    warmup_delay_s: float = 0.5
 
     # Простая защита HTTP эндпоинтов (для Railway + n8n cloud).
     # Если задано — все POST эндпоинты (кроме /health) требуют заголовок `X-API-Key`.
     api_key: str | None = None
 
+    # Сколько писем классифицируем параллельно в /step/classify (1 = по одному, как раньше).
+    classify_concurrency: int = 8
+    # Сколько писем упаковывать в один запрос к OpenAI (1 = по письму на запрос, как раньше).
+    classify_batch_size: int = 1
+    # Локальный предклассификатор (rules.py): очевидные письма решаются без OpenAI.
+    # Opt-in: правила решают без модели, включать после проверки на своей почте
+    classify_rules_enabled: bool = False
+    classify_rules_path: str | None = None  # JSON с ключами из rules.DEFAULT_RULES, заменяет их
+    # Кэш ответов классификации: id письма / хэш нормализованного содержимого + модель + версия промпта.
+    classify_cache_enabled: bool = True
+    classify_cache_max_entries: int = 5000
+    classify_cache_ttl_s: float = 30 * 24 * 3600
+    classify_cache_path: str | None = None  # SQLite-файл, например "/data/classify_cache.sqlite"
+    classify_cache_disk_max_entries: int = 100_000
+
+    # Устойчивость запросов к OpenAI/Gemini (resilience.py): ретраи на 429/5xx/сетевых ошибках,
+    # circuit breaker после N неудачных запросов подряд, опционально — hedging после p95.
+    llm_max_attempts: int = 4
+    llm_retry_base_s: float = 1.0
+    llm_retry_max_s: float = 30.0
+    llm_breaker_threshold: int = 5
+    llm_breaker_cooldown_s: float = 30.0
+    llm_hedge: bool = False
+
+    # Извлечение текста PDF/RTF в пуле процессов (0 воркеров — в потоке внутри процесса сервиса).
+    extract_workers: int = 2
+    extract_timeout_s: float = 60.0  # на один документ; зависший воркер убивается
+    extract_max_tasks_per_child: int = 50  # перезапуск воркера после N документов
+    # Сколько item-ов /step/analyze обрабатывает параллельно (извлечение + Gemini).
+    analyze_concurrency: int = 4
+    # Несколько вложений в письме: сколько лучших (по рангу) отправлять в Gemini одним запросом
+    # и лимит суммарного размера файлов inline_data в нём (у Gemini ~20 МБ на запрос, base64 +33%)
+    analyze_max_attachments: int = 3
+    analyze_max_inline_bytes: int = 14 * 1024**2
+    # Гарантийное письмо — первые 1-2 страницы: дальше PDF не разбираем (0 — без лимита).
+    extract_pdf_max_pages: int = 3
+    extract_max_chars: int = 20_000  # бюджет текста документа; в промпт Gemini больше не попадёт
+    # Ужимание текста документа перед промптом Gemini (compact.py): бюджет — оценка в токенах.
+    compact_enabled: bool = True
+    compact_token_budget: int = 3000
+    # Проверка качества извлечённого текста: не прошёл — файл уходит в Gemini как inline_data.
+    extract_min_chars: int = 50
+    extract_min_printable_ratio: float = 0.85
+    extract_min_chars_per_page: int = 20
+
+    # Кэш анализа документов Gemini: sha256 файла + модель + версия промпта -> GuaranteeDocExtract.
+    analysis_cache_enabled: bool = True
+    analysis_cache_max_entries: int = 512  # LRU в памяти
+    analysis_cache_ttl_s: float = 7 * 24 * 3600
+    analysis_cache_path: str | None = None  # SQLite-файл второго уровня, например "/data/analysis_cache.sqlite"
+    analysis_cache_disk_max_entries: int = 10_000
+
+    # Blob store вложений: с GL_BLOB_REFS=true ответы шагов несут `gl-blob:sha256:<hex>`
+    # вместо base64 в binary.attachment_N.data, а следующие шаги читают файл с диска.
+    blob_refs: bool = False
+    blob_dir: str = "/tmp/gl_service_blobs"
+    blob_max_bytes: int = 1024**3
+    blob_max_age_s: float = 24 * 3600
+
+    # Водяные знаки по threadId между запусками n8n (SQLite-файл). Не задано — выключено.
+    watermark_db: str | None = None
+    # Журнал отправок WhatsApp (SQLite): повторный send того же письма не дублирует сообщения.
+    send_ledger_db: str | None = None
+    # Параллельный вызов с тем же ключом ждёт чужую отправку столько, затем 409
+    send_ledger_wait_s: float = 30.0
+    # Резерв "pending" старше этого (процесс упал посреди отправки) можно перехватить; > whapi_document_timeout_s
+    send_ledger_pending_s: float = 600.0
+    # Фоновая очередь отправок (SQLite). Не задано — `?queue=true` недоступен.
+    send_queue_db: str | None = None
+    send_queue_workers: int = 2
+    send_max_attempts: int = 6
+    send_retry_base_s: float = 2.0
+    send_retry_max_s: float = 300.0
+    # Лимиты Whapi: сообщений в секунду и запас (burst) — на весь аккаунт и на одного получателя
+    whapi_rate_per_s: float = 1.0
+    whapi_burst: float = 5
+    whapi_recipient_rate_per_s: float = 0.5
+    whapi_recipient_burst: float = 3
+
+    # Запись входящих запросов шагов в JSONL для воспроизведения нагрузки (benchmarks/replay.py).
+    # Не задано — выключено. Вложения — хэшем, байты — в capture_attachments_dir (если задан).
+    capture_path: str | None = None
+    capture_attachments_dir: str | None = None
+    capture_max_bytes: int = 1024**3
+
+    # Асинхронные задания шагов (POST /jobs/{step}), SQLite. Не задано — /jobs недоступен.
+    jobs_db: str | None = None
+    job_workers: int = 2
+    job_ttl_s: float = 24 * 3600  # сколько хранить завершённые задания
+    job_max_queued: int = 100
+    # Аренда задания процессом: не продлена дольше — процесс считается упавшим, задание повторяется
+    job_lease_s: float = 60.0
+
 
 settings = Settings()
 
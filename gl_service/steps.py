@@ -1,12 +1,39 @@
 from __future__ import annotations
 
-from .dedupe import dedupe_latest_per_thread
-from .extract import extract_from_attachment
-from .gemini_client import analyze_document_with_gemini
+import asyncio
+import hashlib
+import re
+from contextlib import aclosing
+from typing import Any, AsyncIterator
+
+import httpx
+
+from .attachments import choose_for_gemini, rank_attachments
+from .cache import analysis_cache, classify_cache
+from .compact import compact_document
+from .concurrency import BatchStats, iter_bounded
+from .dedupe import dedupe_latest_per_thread, drop_not_newer, latest_marks, thread_key
+from .extract_pool import extract_pool
+from .gemini_client import (
+    DOCUMENTS_PROMPT_VERSION,
+    PROMPT_VERSION,
+    GeminiError,
+    analyze_document_with_gemini,
+    gemini_generate_from_documents,
+)
 from .gemini_parse import parse_gemini_json_text
 from .message import build_whatsapp_message
 from .models import Attachment, ClassifyResult, Email, GuaranteeDocExtract
-from .openai_client import classify_is_guarantee_letter
+from .openai_client import CLASSIFY_PROMPT_VERSION, classify_batch, classify_is_guarantee_letter
+from .resilience import CircuitOpenError
+from .rules import rule_classifier
+from .settings import settings
+from .watermarks import watermark_store
+
+
+# Сбой Gemini (после всех ретраев), открытый breaker, сеть — это не "битый документ": анализ
+# такого письма пробрасывает ошибку, а не отдаёт заглушку, которая уйдёт в WhatsApp как результат
+UPSTREAM_ERRORS = (GeminiError, CircuitOpenError, httpx.HTTPError)
 
 
 def step_dedupe_latest(emails: list[Email]) -> tuple[list[Email], int]:
@@ -19,6 +46,31 @@ def step_dedupe_latest(emails: list[Email]) -> tuple[list[Email], int]:
     return res.kept, len(res.dropped)
 
 
+async def step_drop_seen(emails: list[Email]) -> tuple[list[Email], int]:
+    """
+    Шаг 1b: отбрасываем письма, не новее водяного знака треда из прошлых запусков.
+    Без GL_WATERMARK_DB — ничего не делает. Возвращает (kept, dropped_count)
+    """
+
+    if watermark_store is None or not emails:
+        return emails, 0
+    keys = list({thread_key(e) for e in emails})
+    marks = await asyncio.to_thread(watermark_store.get_many, keys)
+    res = drop_not_newer(emails, marks)
+    return res.kept, len(res.dropped)
+
+
+async def step_commit_watermarks(emails: list[Email]) -> int:
+    """
+    Сдвигаем водяные знаки тредов на обработанные (отправленные) письма.
+    Возвращает число сдвинутых тредов.
+    """
+
+    if watermark_store is None or not emails:
+        return 0
+    return await asyncio.to_thread(watermark_store.advance, latest_marks(emails))
+
+
 async def step_classify(email: Email) -> ClassifyResult:
     """
     Шаг 2 (аналог `OpenAI Classify` + parser): is_guarantee_letter.
@@ -27,30 +79,320 @@ async def step_classify(email: Email) -> ClassifyResult:
     return await classify_is_guarantee_letter(subject=email.subject, from_=email.from_, snippet=email.snippet)
 
 
-async def step_analyze_attachment(email: Email) -> tuple[GuaranteeDocExtract | None, Attachment | None]:
+_WS_RE = re.compile(r"\s+")
+
+
+def _normalize(text: str) -> str:
+    return _WS_RE.sub(" ", text or "").strip().casefold()
+
+
+def classify_cache_keys(email: Email) -> list[str]:
+    """
+    Ключи кэша классификации: по id письма (повторная доставка того же письма) и по хэшу
+    subject/from/snippet без учёта регистра и пробелов (пересланные копии).
+    Модель и версия промпта в ключе — смена промпта сама "сбрасывает" кэш.
+    """
+
+    prefix = f"{settings.openai_model}:{CLASSIFY_PROMPT_VERSION}"
+    content = "\x1f".join(_normalize(v) for v in (email.subject, email.from_, email.snippet))
+    keys = [f"{prefix}:content:{hashlib.sha256(content.encode('utf-8')).hexdigest()}"]
+    if email.id:
+        keys.insert(0, f"{prefix}:id:{email.id}")
+    return keys
+
+
+async def _classify_cache_get(email: Email) -> ClassifyResult | None:
+    for key in classify_cache_keys(email):
+        cached = await classify_cache.get(key)
+        if cached is not None:
+            return ClassifyResult(is_guarantee_letter=cached["is_guarantee_letter"], decided_by="cache")
+    return None
+
+
+async def _classify_cache_put(email: Email, res: ClassifyResult) -> None:
+    for key in classify_cache_keys(email):
+        await classify_cache.put(key, {"is_guarantee_letter": res.is_guarantee_letter})
+
+
+async def iter_classify(
+    emails: list[Email], info: dict[str, Any] | None = None
+) -> AsyncIterator[tuple[int, ClassifyResult | Exception]]:
+    """
+    Шаг 2 для батча писем: отдаёт (индекс письма, результат или исключение) по мере готовности.
+
+    Сначала локальные правила (`rules.py`): очевидные письма решаются без сети,
+    затем кэш прошлых ответов модели (GL_CLASSIFY_CACHE_*).
+    Остальные — в OpenAI; при GL_CLASSIFY_BATCH_SIZE > 1 до N писем в одном запросе (`classify_batch`),
+    письма, по которым ответ пропущен или битый, доклассифицируются по одному.
+    `info` по окончании заполняется для `meta`: batch, openai_requests, fallback_items, decided_by.
+    """
+
+    info = {} if info is None else info
+    size = max(1, settings.classify_batch_size)
+    limit = settings.classify_concurrency
+    counters = {"openai_requests": 0, "fallback_items": 0}
+
+    rules = rule_classifier()
+    pending: list[int] = []
+    decided_by = {"rules": 0, "cache": 0, "openai": 0}
+    for j, email in enumerate(emails):
+        res = rules.classify(email) if rules is not None else None
+        if res is None and settings.classify_cache_enabled:
+            res = await _classify_cache_get(email)
+        if res is None:
+            pending.append(j)
+        else:
+            decided_by[res.decided_by] += 1
+            yield j, res
+    decided_by["openai"] = len(pending)
+
+    # Один лимит на все запросы к OpenAI — и батчевые, и доклассификацию по одному внутри чанков
+    openai_sem = asyncio.Semaphore(max(1, limit))
+
+    async def classify_one(email: Email) -> ClassifyResult | Exception:
+        counters["openai_requests"] += 1
+        try:
+            async with openai_sem:
+                return await step_classify(email)
+        except Exception as e:
+            return e
+
+    async def run_chunk(idx: list[int]) -> list[ClassifyResult | Exception]:
+        if len(idx) == 1:
+            return [await classify_one(emails[idx[0]])]
+
+        # id внутри батча — позиция письма: Gmail id может быть пустым или повторяться
+        rows = [
+            {"id": str(j), "subject": emails[j].subject, "from": emails[j].from_, "snippet": emails[j].snippet}
+            for j in idx
+        ]
+        counters["openai_requests"] += 1
+        try:
+            async with openai_sem:
+                got: dict[str, ClassifyResult | Exception] = dict(await classify_batch(rows))
+        except Exception as e:
+            print(f"⚠️ Batch classify failed, falling back to per-item: {e!r}")
+            got = {}
+
+        missing = [j for j in idx if str(j) not in got]
+        if missing:
+            counters["fallback_items"] += len(missing)
+            # Ошибка одного письма остаётся ошибкой этого письма: уже классифицированные батчем не теряются
+            rs = await asyncio.gather(*(classify_one(emails[j]) for j in missing))
+            got.update({str(j): res for j, res in zip(missing, rs)})
+        return [got[str(j)] for j in idx]
+
+    chunks = [pending[i : i + size] for i in range(0, len(pending), size)]
+    stats = BatchStats()
+    async with aclosing(iter_bounded(chunks, run_chunk, limit=limit, stats=stats)) as results:
+        async for k, res in results:
+            for pos, j in enumerate(chunks[k]):
+                item = res if isinstance(res, Exception) else res[pos]
+                if isinstance(item, Exception):
+                    yield j, item
+                    continue
+                if settings.classify_cache_enabled:
+                    await _classify_cache_put(emails[j], item)
+                yield j, item
+    stats.items = len(pending)  # в meta — письма, ушедшие в OpenAI, а не чанки
+    info.update(
+        batch=stats.to_meta(),
+        decided_by=decided_by,
+        **counters,
+    )
+
+
+async def step_classify_many(emails: list[Email], info: dict[str, Any] | None = None) -> list[ClassifyResult]:
+    """
+    То же, что `iter_classify`, но целиком и в исходном порядке; первая ошибка пробрасывается.
+    """
+
+    out: list[ClassifyResult | None] = [None] * len(emails)
+    async with aclosing(iter_classify(emails, info)) as results:
+        async for j, res in results:
+            if isinstance(res, Exception):
+                raise res
+            out[j] = res
+    return [r for r in out if r is not None]
+
+
+def analysis_cache_key(digest: str) -> str:
+    # Новая модель или новая версия промпта — новый ключ, старые записи просто устареют по TTL.
+    return f"{digest}:{settings.gemini_model}:{PROMPT_VERSION}"
+
+
+async def step_analyze_attachment(
+    email: Email, info: dict[str, Any] | None = None
+) -> tuple[GuaranteeDocExtract | None, Attachment | None]:
     """
     Шаг 3 (аналог `Проверка формата файла` + `Extract...` + `Gemini...` + `Парсинг Gemini`)
+
+    Вложений несколько — см. `_analyze_attachments`: результат один `GuaranteeDocExtract` на письмо.
+    Возвращает (результат, главное вложение); (None, None) — анализировать нечего.
+    Битый или пустой документ — результат-заглушка "⚠️ Не удалось обработать..."; ошибки upstream-а
+    (`UPSTREAM_ERRORS`) пробрасываются — вызывающий помечает item ошибкой и не отправляет его.
+
+    `info` (если передан) заполняется диагностикой по item-у для `meta`:
+    `analysis_cache` = "hit" / "miss" / "off"; `extract` = {"route": "text" / "inline", "reason": ...}
+    (главного вложения); `doc_tokens` = {"before", "after"} — оценка токенов текста документов до и
+    после `compact_document`; при нескольких вложениях — `attachments` = {"total", "analyzed", "skipped"}.
     """
 
+    info = {} if info is None else info
+    if len(email.attachments) > 1:
+        return await _analyze_attachments(email, info)
     if email.attachment is None:
         return None, None
+    return await _analyze_single(email, email.attachment, info)
+
 
+async def _analyze_single(
+    email: Email, att: Attachment, info: dict[str, Any]
+) -> tuple[GuaranteeDocExtract, Attachment]:
     try:
-        extracted = extract_from_attachment(email.attachment)
+        raw = att.raw_bytes()
+        digest = hashlib.sha256(raw).hexdigest()
+        info["sha256"] = digest
+        key = analysis_cache_key(digest)
+        if settings.analysis_cache_enabled:
+            cached = await analysis_cache.get(key)
+            info["analysis_cache"] = "miss" if cached is None else "hit"
+            if cached is not None:
+                return GuaranteeDocExtract.model_validate(cached), att
+        else:
+            info["analysis_cache"] = "off"
+
+        extracted = await extract_pool.extract(att)
+        info["extract"] = {"route": extracted.route, "reason": extracted.inline_reason}
+        doc_text = extracted.text
+        if doc_text is not None and settings.compact_enabled:
+            compacted = compact_document(doc_text, token_budget=settings.compact_token_budget)
+            info["doc_tokens"] = {"before": compacted.tokens_before, "after": compacted.tokens_after}
+            doc_text = compacted.text
         ai = await analyze_document_with_gemini(
-            doc_text=extracted.text,
-            file_bytes=None if extracted.text is not None else extracted.raw_bytes,
+            doc_text=doc_text,
+            # inline_data — исходная base64-строка вложения, без повторного кодирования байтов
+            file_base64=None if extracted.text is not None else att.base64_text(),
             mime_type=extracted.mime_type,
             subject=email.subject,
             snippet=email.snippet,
             parser=parse_gemini_json_text,
         )
-        return ai, email.attachment
+        if settings.analysis_cache_enabled:
+            await analysis_cache.put(key, ai.model_dump(), tag=digest)
+        return ai, att
+    except UPSTREAM_ERRORS:
+        raise
     except Exception as e:
         # Если вложение не удалось обработать (поврежден, пуст и т.д.)
         return GuaranteeDocExtract(
-            summary=f"⚠️ Не удалось обработать вложение '{email.attachment.file_name}': {str(e)}"
-        ), email.attachment
+            summary=f"⚠️ Не удалось обработать вложение '{att.file_name}': {str(e)}"
+        ), att
+
+
+async def _analyze_attachments(
+    email: Email, info: dict[str, Any]
+) -> tuple[GuaranteeDocExtract | None, Attachment | None]:
+    """
+    Несколько вложений (сопроводительный PDF + скан и т.п.):
+    1. дешёвый ранг по режиму, размеру и имени файла отсекает подписи, логотипы, .p7s;
+    2. оставшиеся извлекаются параллельно (пул процессов);
+    3. лучшие `GL_ANALYZE_MAX_ATTACHMENTS` (inline — в пределах `GL_ANALYZE_MAX_INLINE_BYTES`)
+       уходят в Gemini одним запросом: тексты в промпте, сканы частями inline_data.
+    Кэш — по набору sha256 кандидатов; тег записи — sha256 главного вложения.
+    Если ранг отбросил все вложения, анализируется `attachment_0`.
+    Возвращаемое главное вложение — то, что нужно отправлять в WhatsApp документом.
+    """
+
+    candidates, skipped = rank_attachments(email.attachments)
+    info["attachments"] = {
+        "total": len(email.attachments),
+        "analyzed": [],
+        "skipped": [a.file_name for a in skipped],
+    }
+    if not candidates:
+        # Ранг отбросил всё (например, только картинки) — анализируем хотя бы первое вложение,
+        # а не отвечаем "без вложения" при has_attachment=true
+        candidates = [email.attachments[0]]
+    if len(candidates) == 1:
+        info["attachments"]["analyzed"] = [candidates[0].file_name]
+        return await _analyze_single(email, candidates[0], info)
+
+    primary = candidates[0]
+    try:
+        digests = [hashlib.sha256(a.raw_bytes()).hexdigest() for a in candidates]
+        info["sha256"] = digests[0]
+        combined = hashlib.sha256("\n".join(sorted(digests)).encode("ascii")).hexdigest()
+        key = f"{analysis_cache_key(combined)}:documents{DOCUMENTS_PROMPT_VERSION}"
+        if settings.analysis_cache_enabled:
+            cached = await analysis_cache.get(key)
+            info["analysis_cache"] = "miss" if cached is None else "hit"
+            if cached is not None:
+                info["attachments"]["analyzed"] = [a.file_name for a in candidates]
+                return GuaranteeDocExtract.model_validate(cached), primary
+        else:
+            info["analysis_cache"] = "off"
+
+        extracted = await asyncio.gather(*(extract_pool.extract(a) for a in candidates))
+        chosen = choose_for_gemini(
+            list(zip(candidates, extracted)),
+            max_files=settings.analyze_max_attachments,
+            max_inline_bytes=settings.analyze_max_inline_bytes,
+        )
+        info["attachments"]["analyzed"] = [a.file_name for a, _ex in chosen]
+        info["extract"] = {"route": chosen[0][1].route, "reason": chosen[0][1].inline_reason}
+
+        texts = [(a.file_name, ex.text) for a, ex in chosen if ex.text is not None]
+        if texts and settings.compact_enabled:
+            # Бюджет промпта общий на письмо — делим между текстовыми документами
+            budget = max(1, settings.compact_token_budget // len(texts))
+            compacted = [compact_document(text, token_budget=budget) for _name, text in texts]
+            info["doc_tokens"] = {
+                "before": sum(c.tokens_before for c in compacted),
+                "after": sum(c.tokens_after for c in compacted),
+            }
+            texts = [(name, c.text) for (name, _text), c in zip(texts, compacted)]
+        files = [(a.file_name, ex.mime_type, a.base64_text()) for a, ex in chosen if ex.text is None]
+        raw_answer = await gemini_generate_from_documents(
+            texts=texts, files=files, subject=email.subject, snippet=email.snippet
+        )
+        ai = parse_gemini_json_text(raw_answer)
+        if settings.analysis_cache_enabled:
+            await analysis_cache.put(key, ai.model_dump(), tag=digests[0])
+        return ai, primary
+    except UPSTREAM_ERRORS:
+        raise
+    except Exception as e:
+        names = ", ".join(f"'{a.file_name}'" for a in candidates)
+        return GuaranteeDocExtract(summary=f"⚠️ Не удалось обработать вложения {names}: {str(e)}"), primary
+
+
+def analyze_meta(infos: list[dict[str, Any]]) -> dict[str, Any]:
+    """Сводка по `info` из `step_analyze_attachment` для `meta` батча."""
+
+    routes = {"text": 0, "inline": 0}
+    reasons: dict[str, int] = {}
+    for i in infos:
+        if "extract" in i:
+            routes[i["extract"]["route"]] += 1
+            if i["extract"]["reason"]:
+                reasons[i["extract"]["reason"]] = reasons.get(i["extract"]["reason"], 0) + 1
+    return {
+        "analysis_cache": {
+            "hits": sum(1 for i in infos if i.get("analysis_cache") == "hit"),
+            "misses": sum(1 for i in infos if i.get("analysis_cache") == "miss"),
+        },
+        "extract": {"routes": routes, "inline_reasons": reasons},
+        "doc_tokens": {
+            "before": sum(i["doc_tokens"]["before"] for i in infos if "doc_tokens" in i),
+            "after": sum(i["doc_tokens"]["after"] for i in infos if "doc_tokens" in i),
+        },
+        "attachments": {
+            "multi_items": sum(1 for i in infos if "attachments" in i),
+            "analyzed": sum(len(i["attachments"]["analyzed"]) for i in infos if "attachments" in i),
+            "skipped": sum(len(i["attachments"]["skipped"]) for i in infos if "attachments" in i),
+        },
+    }
 
 
 def step_no_attachment_fallback(email: Email) -> GuaranteeDocExtract:
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+from .settings import settings
+
+
+@dataclass(frozen=True)
+class Watermark:
+    """Последнее обработанное письмо треда: время (unix ts) и Gmail id."""
+
+    ts: float
+    message_id: str
+
+
+class WatermarkStore:
+    """
+    Персистентные "водяные знаки" по threadId (SQLite): что из треда уже обработано
+    в прошлых запусках n8n. Двигаются только вперёд.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._db: sqlite3.Connection | None = None
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS watermarks ("
+                " thread_id TEXT PRIMARY KEY, ts REAL NOT NULL, message_id TEXT NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            db.commit()
+            self._db = db
+        return self._db
+
+    def get_many(self, thread_ids: list[str]) -> dict[str, Watermark]:
+        if not thread_ids:
+            return {}
+        out: dict[str, Watermark] = {}
+        with self._lock:
+            db = self._conn()
+            # SQLite ограничивает число параметров — идём пачками
+            for i in range(0, len(thread_ids), 500):
+                chunk = thread_ids[i : i + 500]
+                rows = db.execute(
+                    f"SELECT thread_id, ts, message_id FROM watermarks"
+                    f" WHERE thread_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                out.update({tid: Watermark(ts=ts, message_id=mid) for tid, ts, mid in rows})
+        return out
+
+    def advance(self, marks: dict[str, Watermark]) -> int:
+        """Сдвигает водяные знаки вперёд (более старые не перезаписывают новые). Возвращает число сдвинутых."""
+
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            moved = 0
+            for tid, wm in marks.items():
+                cur = db.execute(
+                    "INSERT INTO watermarks (thread_id, ts, message_id, updated_at) VALUES (?, ?, ?, ?)"
+                    " ON CONFLICT(thread_id) DO UPDATE SET"
+                    "  ts = excluded.ts, message_id = excluded.message_id, updated_at = excluded.updated_at"
+                    " WHERE excluded.ts > watermarks.ts",
+                    (tid, wm.ts, wm.message_id, now),
+                )
+                moved += cur.rowcount
+            db.commit()
+            return moved
+
+
+# None — водяные знаки выключены (GL_WATERMARK_DB не задан)
+watermark_store = WatermarkStore(settings.watermark_db) if settings.watermark_db else None
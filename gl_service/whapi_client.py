@@ -1,15 +1,29 @@
 from __future__ import annotations
 
-import base64
-
-import httpx
+import asyncio
+import time
+from typing import Awaitable, Callable
 
+from .http_clients import http_clients
+from .resilience import retry_after_s
 from .models import Attachment, WhatsAppSendResult
+from .send_ledger import send_key, send_ledger
 from .settings import settings
 
 
 class WhapiError(RuntimeError):
-    pass
+    def __init__(self, message: str, *, status_code: int | None = None, retry_after: float | None = None) -> None:
+        super().__init__(message)
+        # HTTP-статус ответа Whapi (None — ошибка не от Whapi): очередь отправки ретраит 429 и 5xx
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class SendInProgressError(WhapiError):
+    """Ту же часть с тем же ключом журнала сейчас отправляет другой вызов (HTTP 409)."""
+
+    def __init__(self, message: str) -> None:
+        super().__init__(message, status_code=409)
 
 
 def _auth_headers() -> dict[str, str]:
@@ -19,21 +33,21 @@ def _auth_headers() -> dict[str, str]:
 
 
 async def send_text(*, to: str, body: str) -> str | None:
-    url = f"{settings.whapi_base_url.rstrip('/')}/messages/text"
     payload = {"to": to, "body": body}
-    async with httpx.AsyncClient(timeout=60) as client:
-        resp = await client.post(url, json=payload, headers=_auth_headers())
-        if resp.status_code >= 400:
-            raise WhapiError(f"Whapi HTTP {resp.status_code}: {resp.text}")
-        data = resp.json()
+    resp = await http_clients.get("whapi").post("/messages/text", json=payload, headers=_auth_headers())
+    if resp.status_code >= 400:
+        raise WhapiError(
+            f"Whapi HTTP {resp.status_code}: {resp.text}",
+            status_code=resp.status_code,
+            retry_after=retry_after_s(resp),
+        )
+    data = resp.json()
     # В разных версиях API поле id может называться по-разному — оставляем best-effort
     return data.get("id") or data.get("message", {}).get("id")
 
 
 async def send_document(*, to: str, caption: str, attachment: Attachment) -> str | None:
-    url = f"{settings.whapi_base_url.rstrip('/')}/messages/document"
-
-    raw = base64.b64decode(attachment.data_base64, validate=False)
+    raw = attachment.raw_bytes()
     files = {
         "media": (attachment.file_name, raw, attachment.mime_type or "application/octet-stream"),
     }
@@ -42,11 +56,20 @@ async def send_document(*, to: str, caption: str, attachment: Attachment) -> str
         "caption": caption,
     }
 
-    async with httpx.AsyncClient(timeout=120) as client:
-        resp = await client.post(url, data=data, files=files, headers=_auth_headers())
-        if resp.status_code >= 400:
-            raise WhapiError(f"Whapi HTTP {resp.status_code}: {resp.text}")
-        js = resp.json()
+    resp = await http_clients.get("whapi").post(
+        "/messages/document",
+        data=data,
+        files=files,
+        headers=_auth_headers(),
+        timeout=settings.whapi_document_timeout_s,
+    )
+    if resp.status_code >= 400:
+        raise WhapiError(
+            f"Whapi HTTP {resp.status_code}: {resp.text}",
+            status_code=resp.status_code,
+            retry_after=retry_after_s(resp),
+        )
+    js = resp.json()
 
     return js.get("id") or js.get("message", {}).get("id")
 
@@ -56,11 +79,73 @@ async def send_text_and_optional_doc(
     to: str,
     text: str,
     attachment: Attachment | None,
+    email_id: str | None = None,
+    sent: dict[str, str | None] | None = None,
+    on_part: Callable[[str, str | None], Awaitable[None]] | None = None,
 ) -> WhatsAppSendResult:
-    text_id = await send_text(to=to, body=text)
-    doc_id = None
+    """
+    Текст и документ уходят параллельно.
+
+    С `email_id` и включённым журналом (GL_SEND_LEDGER_DB) отправка идемпотентна:
+    уже отправленные части не повторяются, их message id берутся из журнала. Часть, которую
+    прямо сейчас отправляет другой вызов, ждём до `GL_SEND_LEDGER_WAIT_S`, затем `SendInProgressError`.
+
+    `sent` — части, уже отправленные раньше ({"text": message_id, ...}), они не повторяются;
+    `on_part(part, message_id)` вызывается сразу после отправки каждой части (очередь отправок
+    сохраняет их в своём задании и без журнала).
+    """
+
+    key = None
+    if send_ledger is not None and email_id:
+        key = send_key(email_id=email_id, to=to, text=text, attachment=attachment)
+    reused: set[str] = set()
+
+    async def part(name: str, send: Callable[[], Awaitable[str | None]]) -> str | None:
+        if sent and name in sent:
+            reused.add(name)
+            return sent[name]
+        message_id = await send_part(name, send)
+        if on_part is not None:
+            await on_part(name, message_id)
+        return message_id
+
+    async def send_part(name: str, send: Callable[[], Awaitable[str | None]]) -> str | None:
+        if key is None:
+            return await send()
+        deadline = time.monotonic() + settings.send_ledger_wait_s
+        while True:
+            state, message_id = await asyncio.to_thread(send_ledger.reserve, key, name)
+            if state == "sent":
+                reused.add(name)
+                return message_id
+            if state == "reserved":
+                break
+            if time.monotonic() >= deadline:
+                raise SendInProgressError(f"{name} for {email_id} is being sent by another request")
+            await asyncio.sleep(0.25)
+        try:
+            message_id = await send()
+        except BaseException:
+            # Синхронно: при отмене задачи await здесь уже мог бы не выполниться
+            send_ledger.release(key, name)
+            raise
+        await asyncio.to_thread(send_ledger.record, key, name, message_id)
+        return message_id
+
+    parts = [part("text", lambda: send_text(to=to, body=text))]
     if attachment is not None:
-        doc_id = await send_document(to=to, caption=f"📎 {attachment.file_name}", attachment=attachment)
-    return WhatsAppSendResult(ok=True, text_message_id=text_id, document_message_id=doc_id)
+        caption = f"📎 {attachment.file_name}"
+        parts.append(part("document", lambda: send_document(to=to, caption=caption, attachment=attachment)))
+    # return_exceptions: упавшая часть не бросает вторую на полпути — успешная успевает попасть в журнал
+    results = await asyncio.gather(*parts, return_exceptions=True)
+    for r in results:
+        if isinstance(r, BaseException):
+            raise r
+    return WhatsAppSendResult(
+        ok=True,
+        text_message_id=results[0],
+        document_message_id=results[1] if attachment is not None else None,
+        deduplicated=len(reused) == len(parts),
+    )
 
 
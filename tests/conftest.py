@@ -0,0 +1,30 @@
+import asyncio
+
+import pytest
+
+from gl_service import whapi_client
+
+
+@pytest.fixture
+def whapi(monkeypatch):
+    """
+    Подменяет отправку в Whapi: считает вызовы, message id — "text-N" / "doc-N".
+    Документ "заливается" `doc_delay` секунд; `doc_errors` — исключения для следующих документов по очереди.
+    """
+
+    calls = {"text": 0, "document": 0, "doc_delay": 0.0, "doc_errors": []}
+
+    async def send_text(*, to, body):
+        calls["text"] += 1
+        return f"text-{calls['text']}"
+
+    async def send_document(*, to, caption, attachment):
+        calls["document"] += 1
+        await asyncio.sleep(calls["doc_delay"])
+        if calls["doc_errors"]:
+            raise calls["doc_errors"].pop(0)
+        return f"doc-{calls['document']}"
+
+    monkeypatch.setattr(whapi_client, "send_text", send_text)
+    monkeypatch.setattr(whapi_client, "send_document", send_document)
+    return calls
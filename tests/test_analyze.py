@@ -0,0 +1,72 @@
+import asyncio
+import base64
+import os
+
+import pytest
+
+from gl_service import pipeline, steps
+from gl_service.models import Attachment, Email, GuaranteeDocExtract
+from gl_service.resilience import CircuitOpenError
+
+
+def _email(*attachments: Attachment) -> Email:
+    return Email(id="m1", thread_id="t1", subject="Гарантийное письмо", attachments=list(attachments))
+
+
+def _scan(name: str = "scan.jpg") -> Attachment:
+    # Уникальные байты: кэш анализа не мешает соседним тестам
+    return Attachment.from_bytes(b"\xff\xd8\xff\xe0" + os.urandom(20_000), file_name=name, mime_type="image/jpeg")
+
+
+class FakeGemini:
+    def __init__(self) -> None:
+        self.error: Exception | None = None
+        self.calls: list[dict] = []
+
+    async def analyze(self, **kw) -> GuaranteeDocExtract:
+        self.calls.append(kw)
+        if self.error is not None:
+            raise self.error
+        return GuaranteeDocExtract(summary="ok", policy_number="0099-1")
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    fake = FakeGemini()
+    monkeypatch.setattr(steps, "analyze_document_with_gemini", fake.analyze)
+    return fake
+
+
+def test_upstream_error_propagates(gemini):
+    gemini.error = CircuitOpenError("gemini: circuit open after 5 failures")
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(steps.step_analyze_attachment(_email(_scan())))
+
+
+def test_broken_document_gets_fallback_summary(gemini):
+    broken = Attachment(data_base64="!!!not base64!!!", file_name="letter.pdf", mime_type="application/pdf")
+    ai, _att = asyncio.run(steps.step_analyze_attachment(_email(broken)))
+    assert ai.summary.startswith("⚠️ Не удалось обработать вложение")
+    assert gemini.calls == []
+
+
+def test_pipeline_skips_message_and_send_on_upstream_error(gemini, monkeypatch):
+    gemini.error = CircuitOpenError("gemini: circuit open after 5 failures")
+    sent = []
+
+    async def send(**kw):
+        sent.append(kw)
+
+    monkeypatch.setattr(pipeline, "send_text_and_optional_doc", send)
+    item = {
+        "json": {"id": "m1", "threadId": "t1", "subject": "Гарантийное письмо", "date": "2025-03-01T10:00:00Z"},
+        "binary": {"attachment_0": {"data": base64.b64encode(_scan().raw_bytes()).decode(), "mimeType": "image/jpeg",
+                                    "fileName": "scan.jpg"}},
+    }
+    results, _meta = asyncio.run(
+        pipeline.run_pipeline([item], dedupe=False, classify=False, send=True)
+    )
+    assert results[0]["analyze_error"].startswith("CircuitOpenError")
+    assert "message_text" not in results[0]
+    assert "ai_response" not in results[0]
+    assert sent == []
@@ -0,0 +1,132 @@
+import asyncio
+import base64
+import os
+
+from gl_service import attachments, blob_store, pipeline, steps
+from gl_service.attachments import choose_for_gemini, rank_attachments
+from gl_service.blob_store import BlobStore, externalize_item
+from gl_service.extract import Extracted
+from gl_service.models import Attachment, GuaranteeDocExtract
+from gl_service.n8n_adapter import email_from_n8n_item
+
+
+def _binary(name: str, mime: str, raw: bytes) -> dict:
+    return {"data": base64.b64encode(raw).decode("ascii"), "fileName": name, "mimeType": mime, "fileSize": len(raw)}
+
+
+LOGO = _binary("image001.png", "image/png", os.urandom(40_000))
+LETTER = _binary("scan.pdf", "application/pdf", b"%PDF-1.4 " + os.urandom(1000))
+
+
+def _att(name: str, mime: str, size: int) -> Attachment:
+    return Attachment.from_bytes(b"x" * size, file_name=name, mime_type=mime)
+
+
+def test_attachment_keys_sorted_numerically():
+    item = {
+        "json": {"id": "m1"},
+        "binary": {
+            "attachment_10": _binary("c.pdf", "application/pdf", b"c"),
+            "attachment_2": _binary("b.pdf", "application/pdf", b"b"),
+            "attachment_0": _binary("a.pdf", "application/pdf", b"a"),
+            "attachment_1": {"fileName": "empty.pdf"},  # без data — не вложение
+            "other": _binary("x.pdf", "application/pdf", b"x"),
+        },
+    }
+    email = email_from_n8n_item(item)
+    assert [a.file_name for a in email.attachments] == ["a.pdf", "b.pdf", "c.pdf"]
+    assert [a.binary_key for a in email.attachments] == ["attachment_0", "attachment_2", "attachment_10"]
+    assert email.attachment is email.attachments[0]
+
+
+def test_rank_drops_junk_and_prefers_letter():
+    sig = _att("image001.png", "image/png", 40_000)
+    icon = _att("photo.jpg", "image/jpeg", 2_000)
+    p7s = _att("smime.p7s", "application/pkcs7-signature", 5_000)
+    other = _att("price.pdf", "application/pdf", 10_000)
+    letter = _att("Гарантийное письмо.pdf", "application/pdf", 10_000)
+    candidates, skipped = rank_attachments([sig, icon, p7s, other, letter])
+    assert candidates == [letter, other]
+    assert skipped == [sig, icon, p7s]
+
+
+def test_rank_keeps_input_order_on_ties():
+    a, b = _att("a.pdf", "application/pdf", 1000), _att("b.pdf", "application/pdf", 1000)
+    assert rank_attachments([a, b])[0] == [a, b]
+
+
+def _ex(text: str | None, size: int) -> Extracted:
+    return Extracted(mode="pdf", text=text, mime_type="application/pdf", raw_bytes=b"x" * size)
+
+
+def test_choose_for_gemini_limits():
+    text = (_att("a.pdf", "application/pdf", 1), _ex("текст", 10_000_000))
+    big = (_att("b.jpg", "image/jpeg", 1), _ex(None, 9_000))
+    small = (_att("c.jpg", "image/jpeg", 1), _ex(None, 2_000))
+    extra = (_att("d.jpg", "image/jpeg", 1), _ex(None, 500))
+    # Текст не тратит inline-бюджет; не влезший скан пропускается, следующий берётся
+    assert choose_for_gemini([text, big, small, extra], max_files=3, max_inline_bytes=10_000) == [text, big, extra]
+    # Первый кандидат берётся всегда, даже больше бюджета
+    assert choose_for_gemini([big], max_files=3, max_inline_bytes=100) == [big]
+    assert len(choose_for_gemini([text, big, small, extra], max_files=2, max_inline_bytes=10**9)) == 2
+
+
+def test_all_ranked_out_falls_back_to_first(monkeypatch):
+    calls = []
+
+    async def analyze(**kw):
+        calls.append(kw)
+        return GuaranteeDocExtract(summary="ok")
+
+    monkeypatch.setattr(steps, "analyze_document_with_gemini", analyze)
+    item = {"json": {"id": "m1"}, "binary": {
+        "attachment_0": _binary("image001.png", "image/png", os.urandom(1000)),
+        "attachment_1": _binary("logo.png", "image/png", os.urandom(1000)),
+    }}
+    ai, att = asyncio.run(steps.step_analyze_attachment(email_from_n8n_item(item)))
+    assert ai.summary == "ok"
+    assert att.binary_key == "attachment_0"
+    assert len(calls) == 1
+
+
+def test_pipeline_sends_ranked_primary_not_signature(monkeypatch):
+    async def analyze(**kw):
+        return GuaranteeDocExtract(summary="ok")
+
+    monkeypatch.setattr(steps, "analyze_document_with_gemini", analyze)
+    sent = []
+
+    class Sent:
+        def model_dump(self):
+            return {"ok": True}
+
+    async def send(*, attachment, **kw):
+        sent.append(attachment.file_name)
+        return Sent()
+
+    monkeypatch.setattr(pipeline, "send_text_and_optional_doc", send)
+    item = {"json": {"id": "m1", "subject": "ГП"}, "binary": {"attachment_0": LOGO, "attachment_1": LETTER}}
+    asyncio.run(pipeline.run_pipeline([item], dedupe=False, classify=False, send=True))
+    assert sent == ["scan.pdf"]
+
+
+def test_send_attachment_by_primary_key():
+    email = email_from_n8n_item({"json": {"id": "m1"}, "binary": {"attachment_0": LOGO, "attachment_1": LETTER}})
+    assert email.send_attachment("attachment_1").file_name == "scan.pdf"
+    assert email.send_attachment(None).file_name == "image001.png"
+    assert email.send_attachment("attachment_9").file_name == "image001.png"
+
+
+def test_blob_ref_scan_without_file_size_is_not_a_logo(tmp_path, monkeypatch):
+    store = BlobStore(root=str(tmp_path / "blobs"), max_bytes=10**8, max_age_s=3600)
+    monkeypatch.setattr(blob_store, "blob_store", store)
+    monkeypatch.setattr(attachments, "blob_store", store)
+    scan = {**_binary("scan.jpg", "image/jpeg", os.urandom(200_000)), "fileSize": None}
+    logo = {**_binary("logo.png", "image/png", os.urandom(2_000)), "fileSize": None}
+    item = {"json": {"id": "m1"}, "binary": {"attachment_0": logo, "attachment_1": scan}}
+
+    # С GL_BLOB_REFS и без — одно и то же ранжирование
+    for it in (item, externalize_item(item)):
+        ranked, skipped = rank_attachments(email_from_n8n_item(it).attachments)
+        assert [a.file_name for a in ranked] == ["scan.jpg"]
+        assert [a.file_name for a in skipped] == ["logo.png"]
@@ -0,0 +1,39 @@
+import base64
+
+import pytest
+
+from gl_service import blob_store as blob_store_module
+from gl_service.blob_store import BlobStore, externalize_item
+from gl_service.n8n_adapter import email_from_n8n_item
+
+
+RAW = b"%PDF-1.4 " + bytes(range(256)) * 4
+STRICT = base64.b64encode(RAW).decode("ascii")
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = BlobStore(root=str(tmp_path / "blobs"), max_bytes=10**8, max_age_s=3600)
+    monkeypatch.setattr(blob_store_module, "blob_store", store)
+    return store
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        STRICT,
+        STRICT.replace("+", "-").replace("/", "_"),  # URL-safe
+        "data:application/pdf;base64," + STRICT,
+        "\n".join(STRICT[i : i + 76] for i in range(0, len(STRICT), 76)),
+    ],
+)
+def test_externalized_blob_matches_inline_bytes(store, data):
+    item = {"json": {"id": "m1"}, "binary": {"attachment_0": {"data": data, "fileName": "letter.pdf"}}}
+
+    out = externalize_item(item)
+
+    ref = out["binary"]["attachment_0"]["data"]
+    assert ref.startswith("gl-blob:sha256:")
+    assert store.get(ref) == RAW == email_from_n8n_item(item).attachments[0].raw_bytes()
+    # Исходный item не меняется
+    assert item["binary"]["attachment_0"]["data"] == data
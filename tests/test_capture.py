@@ -0,0 +1,27 @@
+import base64
+import hashlib
+import json
+
+import pytest
+
+from gl_service.capture import CaptureWriter
+
+
+RAW = b"%PDF-1.4 " + bytes(range(256)) * 4
+STRICT = base64.b64encode(RAW).decode("ascii")
+
+
+@pytest.mark.parametrize(
+    "data",
+    [STRICT, STRICT.replace("+", "-").replace("/", "_"), "data:application/pdf;base64," + STRICT],
+)
+def test_captured_attachment_is_the_processed_bytes(tmp_path, data):
+    writer = CaptureWriter(str(tmp_path / "capture.jsonl"), attachments_dir=str(tmp_path / "att"), max_bytes=10**8)
+    body = json.dumps({"items": [{"json": {"id": "m1"}, "binary": {"attachment_0": {"data": data}}}]}).encode()
+
+    att = writer.sanitize(body)["items"][0]["binary"]["attachment_0"]
+
+    digest = hashlib.sha256(RAW).hexdigest()
+    assert "data" not in att
+    assert (att["sha256"], att["size"]) == (digest, len(RAW))
+    assert writer.attachments.get(f"gl-blob:sha256:{digest}") == RAW
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from gl_service import steps
+from gl_service.models import ClassifyResult, Email
+
+
+@pytest.fixture
+def openai(monkeypatch):
+    """Фейковый OpenAI: батч отвечает только по чётным письмам, m5 по одному падает."""
+
+    state = {"in_flight": 0, "max_in_flight": 0, "batch_calls": 0, "single_calls": 0}
+
+    async def track():
+        state["in_flight"] += 1
+        state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+        await asyncio.sleep(0.02)
+        state["in_flight"] -= 1
+
+    async def classify_batch(rows):
+        state["batch_calls"] += 1
+        await track()
+        return {r["id"]: ClassifyResult(is_guarantee_letter=True) for r in rows if int(r["id"]) % 2 == 0}
+
+    async def step_classify(email):
+        state["single_calls"] += 1
+        await track()
+        if email.id == "m5":
+            raise RuntimeError("OpenAI HTTP 500")
+        return ClassifyResult(is_guarantee_letter=False)
+
+    monkeypatch.setattr(steps, "classify_batch", classify_batch)
+    monkeypatch.setattr(steps, "step_classify", step_classify)
+    monkeypatch.setattr(steps, "rule_classifier", lambda: None)
+    monkeypatch.setattr(steps.settings, "classify_cache_enabled", False)
+    monkeypatch.setattr(steps.settings, "classify_batch_size", 4)
+    monkeypatch.setattr(steps.settings, "classify_concurrency", 2)
+    return state
+
+
+def _emails(n: int) -> list[Email]:
+    return [Email(id=f"m{i}", subject=f"Письмо {i}") for i in range(n)]
+
+
+async def _collect(emails):
+    out = {}
+    async for j, res in steps.iter_classify(emails):
+        out[j] = res
+    return out
+
+
+def test_fallback_error_stays_per_item(openai):
+    out = asyncio.run(_collect(_emails(8)))
+    assert isinstance(out[5], RuntimeError)
+    # Ответы батча по тому же чанку не потерялись
+    assert out[4].is_guarantee_letter and out[6].is_guarantee_letter
+    assert out[7].is_guarantee_letter is False
+    assert len(out) == 8
+
+
+def test_openai_calls_share_one_limit(openai):
+    asyncio.run(_collect(_emails(16)))
+    assert openai["single_calls"] == 8
+    assert openai["max_in_flight"] <= 2
@@ -0,0 +1,105 @@
+from gl_service.compact import compact_document
+
+
+LETTER = "\f".join([
+    "\n".join([
+        "Тел. +7 495 000-00-00, www.insurer.example",
+        "ООО «Страховая компания»",
+        "Услуги предназначены для Иванова И.И. по полису 777",
+        "0012345678",
+        "12/2025",
+        "Стр. 1 из 2",
+    ]),
+    "\n".join([
+        "Тел. +7 495 000-00-00, www.insurer.example",
+        "ООО «Страховая компания»",
+        "Данное сообщение конфиденциально и предназначено только для адресата",
+        "Общий текст",
+        "Общий текст",
+        "0012345678",
+        "Стр. 2 из 2",
+    ]),
+])
+
+
+def test_keeps_policy_patient_and_dates():
+    out = compact_document(LETTER, token_budget=0).text.splitlines()
+    assert "Услуги предназначены для Иванова И.И. по полису 777" in out
+    assert "0012345678" in out
+    assert "12/2025" in out
+
+
+def test_strips_only_explicit_page_markers_and_footer():
+    out = compact_document(LETTER, token_budget=0).text.splitlines()
+    assert not any(ln.startswith("Стр.") for ln in out)
+    assert not any("конфиденциальн" in ln for ln in out)
+
+
+def test_dedupes_only_lines_repeated_across_pages():
+    out = compact_document(LETTER, token_budget=0).text.splitlines()
+    # Колонтитул на обеих страницах — остаётся одно вхождение
+    assert out.count("Тел. +7 495 000-00-00, www.insurer.example") == 1
+    # Шапка без значений полей — тоже колонтитул
+    assert out.count("ООО «Страховая компания»") == 1
+    # Строки со значениями (полис, даты) как повторы не выкидываются
+    assert out.count("0012345678") == 2
+    # Повтор в пределах одной страницы — не колонтитул
+    assert out.count("Общий текст") == 2
+
+
+def test_single_page_keeps_repeated_lines():
+    out = compact_document("Пункт\nПункт\n42", token_budget=0).text.splitlines()
+    assert out == ["Пункт", "Пункт", "42"]
+
+
+def test_budget_keeps_values_first():
+    filler = "\n".join(f"строка текста без полей номер {'x' * 40}" for _ in range(50))
+    text = filler + "\nПолис № 0099-1\n01.02.2025"
+    res = compact_document(text, token_budget=30)
+    out = res.text.splitlines()
+    assert "Полис № 0099-1" in out
+    assert "01.02.2025" in out
+    assert res.tokens_after <= 30
+
+
+def _real_letter(pages: int) -> str:
+    page = [
+        "ООО «Страховая компания «Надёжная защита»",
+        "Лицензия ЦБ РФ СЛ № 1234 от 01.01.2020. 123100, г. Москва, Пресненская наб., д. 10",
+        "Директору ООО «Клиника Здоровье» Петрову П.П.",
+        "ГАРАНТИЙНОЕ ПИСЬМО № 2025/ДМС-{n}",
+        "Страховая компания гарантирует оплату медицинских услуг, оказанных застрахованному лицу",
+        "Пациент: Сидорова Анна Викторовна, дата рождения 14.05.1987",
+        "Полис ДМС № 0099-77{n}, срок действия с 01.02.2025 по 31.12.2025",
+        "Объём услуг: консультации специалистов, лабораторная и инструментальная диагностика,",
+        "физиотерапия, лечебные манипуляции в соответствии с программой страхования.",
+        "Лимит ответственности страховщика по настоящему письму — 150 000 руб.",
+        "Счета на оплату направлять в адрес страховой компании с приложением реестра услуг.",
+        *[f"Пункт {k} программы страхования: услуги оказываются в пределах лимита и срока действия полиса "
+          f"при наличии медицинских показаний, подтверждённых лечащим врачом." for k in range(1, 40)],
+        "Данное сообщение конфиденциально и предназначено только для адресата.",
+        "Если вы получили это письмо по ошибке, просим сообщить отправителю и удалить его.",
+        "Согласие на обработку персональных данных получено в соответствии с 152-ФЗ от 27.07.2006.",
+        "Стр. {n} из {total}",
+    ]
+    return "\f".join("\n".join(page).format(n=n, total=pages) for n in range(1, pages + 1))
+
+
+def test_realistic_letter_meets_budget_and_drops_disclaimers():
+    text = _real_letter(3)
+    res = compact_document(text, token_budget=1000)
+    out = res.text
+
+    assert res.tokens_before > 3 * 1000
+    assert res.tokens_after <= 1000
+    assert "конфиденциальн" not in out and "152-ФЗ" not in out and "по ошибке" not in out
+    for value in ("Полис ДМС № 0099-771", "Сидорова Анна Викторовна", "ГАРАНТИЙНОЕ ПИСЬМО № 2025/ДМС-1",
+                  "150 000 руб."):
+        assert value in out
+
+
+def test_budget_holds_even_when_every_line_is_a_value():
+    text = "\n".join(f"Полис № 0099-{n:05d}, срок с 01.02.2025 по 31.12.2025" for n in range(500))
+    res = compact_document(text, token_budget=200)
+    assert res.tokens_after <= 200
+    assert res.text.startswith("Полис № 0099-00000")
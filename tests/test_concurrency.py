@@ -0,0 +1,89 @@
+import asyncio
+import random
+import time
+
+import pytest
+
+from gl_service.concurrency import BatchStats, TokenBucket, gather_bounded, iter_bounded
+
+
+def _worker(state):
+    async def fn(n: int) -> int:
+        state["in_flight"] += 1
+        state["max"] = max(state["max"], state["in_flight"])
+        # Разная задержка: задачи завершаются не в порядке запуска
+        await asyncio.sleep(random.uniform(0.001, 0.02))
+        state["in_flight"] -= 1
+        if n == 7:
+            raise ValueError("boom")
+        return n * 10
+
+    return fn
+
+
+def test_gather_bounded_keeps_order_and_limit():
+    state = {"in_flight": 0, "max": 0}
+    items = [n for n in range(20) if n != 7]
+
+    results, stats = asyncio.run(gather_bounded(items, _worker(state), limit=3))
+
+    assert results == [n * 10 for n in items]
+    assert state["max"] == stats.max_in_flight == 3
+    assert stats.items == len(items)
+
+
+def test_gather_bounded_raises_first_error():
+    with pytest.raises(ValueError, match="boom"):
+        asyncio.run(gather_bounded(list(range(10)), _worker({"in_flight": 0, "max": 0}), limit=4))
+
+
+def test_iter_bounded_yields_every_index_with_per_item_errors():
+    state = {"in_flight": 0, "max": 0}
+    stats = BatchStats()
+
+    async def collect():
+        return [row async for row in iter_bounded(list(range(20)), _worker(state), limit=4, stats=stats)]
+
+    rows = asyncio.run(collect())
+
+    assert sorted(i for i, _ in rows) == list(range(20))
+    by_index = dict(rows)
+    assert isinstance(by_index.pop(7), ValueError)
+    assert by_index == {n: n * 10 for n in by_index}
+    assert state["max"] == stats.max_in_flight == 4
+
+
+def test_iter_bounded_cancels_pending_when_abandoned():
+    started: list[int] = []
+    cancelled: list[int] = []
+
+    async def fn(n: int) -> int:
+        started.append(n)
+        try:
+            await asyncio.sleep(0 if n == 0 else 10)
+        except asyncio.CancelledError:
+            cancelled.append(n)
+            raise
+        return n
+
+    async def first_only():
+        agen = iter_bounded(list(range(5)), fn, limit=5)
+        first = await agen.__anext__()
+        await agen.aclose()
+        await asyncio.sleep(0)
+        return first
+
+    assert asyncio.run(first_only()) == (0, 0)
+    assert sorted(cancelled) == [1, 2, 3, 4]
+
+
+def test_token_bucket_acquire_more_than_burst():
+    bucket = TokenBucket(rate=100, burst=1)
+
+    async def main():
+        started = time.perf_counter()
+        await asyncio.wait_for(bucket.acquire(3), timeout=2)
+        return time.perf_counter() - started
+
+    # Первый токен есть сразу, ещё два — по 10 мс
+    assert 0.015 <= asyncio.run(main()) < 1
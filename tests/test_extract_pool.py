@@ -0,0 +1,61 @@
+import asyncio
+import time
+
+import pytest
+
+from gl_service import extract_pool as extract_pool_module
+from gl_service.extract_pool import ExtractPool
+
+
+def _fake_extract(mode, raw: bytes, max_pages, max_chars) -> str:
+    # Выполняется в воркере пула (spawn): функция должна импортироваться по имени модуля
+    if raw == b"hang":
+        time.sleep(60)
+    return raw.decode()
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(extract_pool_module, "extract_text", _fake_extract)
+    p = ExtractPool(workers=1, timeout_s=1.0, max_tasks_per_child=0)
+    p.start()
+    yield p
+    p.shutdown()
+
+
+def test_timeout_kills_worker_and_recycles_pool(pool):
+    async def run():
+        old = pool._executor
+        assert await pool._run("pdf", b"warm") == "warm"
+        old_procs = list(old._processes.values())
+
+        with pytest.raises(TimeoutError):
+            await pool._run("pdf", b"hang")
+
+        assert pool._executor is not None and pool._executor is not old
+        for p in old_procs:
+            p.join(5)
+            assert not p.is_alive()
+        # Следующий документ не ждёт зависший воркер
+        started = time.perf_counter()
+        assert await pool._run("pdf", b"ok") == "ok"
+        return time.perf_counter() - started
+
+    assert asyncio.run(run()) < 30
+
+
+def test_max_tasks_per_child_rotates_pool(monkeypatch):
+    monkeypatch.setattr(extract_pool_module, "extract_text", _fake_extract)
+    p = ExtractPool(workers=1, timeout_s=10.0, max_tasks_per_child=2)
+    p.start()
+    try:
+        async def run():
+            first = p._executor
+            assert [await p._run("pdf", b"a"), await p._run("pdf", b"b")] == ["a", "b"]
+            assert p._executor is first
+            assert await p._run("pdf", b"c") == "c"
+            return first
+
+        assert asyncio.run(run()) is not p._executor
+    finally:
+        p.shutdown()
@@ -0,0 +1,122 @@
+import asyncio
+
+from gl_service.jobs import INTERRUPTED_SEND_ERROR, JobQueue
+
+
+def _queue(path, **kw) -> JobQueue:
+    opts = dict(workers=2, ttl_s=3600, max_queued=10, lease_s=0.3)
+    opts.update(kw)
+    return JobQueue(str(path), **opts)
+
+
+def _blocking_handler(gate: asyncio.Event):
+    async def handler(body, params, on_item):
+        await on_item(0, {"n": 1})
+        await gate.wait()
+        return {"ok": True}
+
+    return handler
+
+
+async def _wait_status(q: JobQueue, job_id: str, status: str, timeout: float = 2.0) -> dict:
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        job = q.get(job_id)
+        if job["status"] == status or asyncio.get_running_loop().time() > deadline:
+            return job
+        await asyncio.sleep(0.02)
+
+
+def test_live_owner_keeps_its_job(tmp_path):
+    async def main():
+        gate = asyncio.Event()
+        a, b = _queue(tmp_path / "jobs.db"), _queue(tmp_path / "jobs.db")
+        for q in (a, b):
+            q.register("analyze", _blocking_handler(gate))
+        job_id = await a.submit("analyze", {"items": [{}]}, {})
+        await a.start()
+        assert (await _wait_status(a, job_id, "running"))["status"] == "running"
+        # Второй процесс на том же файле стартует дольше аренды — задание a не перехватывается
+        await b.start()
+        await asyncio.sleep(1.0)
+        await b._recover()
+        job = b.get(job_id)
+        assert job["status"] == "running"
+        assert job["progress"]["done"] == 1
+        gate.set()
+        assert (await _wait_status(a, job_id, "done"))["result"] == {"ok": True}
+        await a.stop()
+        await b.stop()
+
+    asyncio.run(main())
+
+
+def test_expired_lease_requeues_and_reruns(tmp_path):
+    async def main():
+        gate = asyncio.Event()
+        a, b = _queue(tmp_path / "jobs.db"), _queue(tmp_path / "jobs.db", workers=1)
+        for q in (a, b):
+            q.register("analyze", _blocking_handler(gate))
+        job_id = await a.submit("analyze", {"items": [{}]}, {})
+        await a.start()
+        await _wait_status(a, job_id, "running")
+        await a.stop()  # процесс "умер": аренда больше не продлевается
+        await asyncio.sleep(0.4)
+        await b.start()
+        gate.set()
+        job = await _wait_status(b, job_id, "done")
+        assert job["status"] == "done"
+        # Частичные результаты прерванного прогона сброшены, item-ы — только нового
+        assert job["progress"] == {"total": 1, "done": 1, "failed": 0}
+        await b.stop()
+
+    asyncio.run(main())
+
+
+def test_interrupted_send_job_fails_without_ledger(tmp_path):
+    async def main():
+        gate = asyncio.Event()
+        a, b = _queue(tmp_path / "jobs.db"), _queue(tmp_path / "jobs.db")
+        sent = []
+
+        async def send(body, params, on_item):
+            sent.append(1)
+            await gate.wait()
+            return {}
+
+        for q in (a, b):
+            q.register("send_whatsapp", send)
+        job_id = await a.submit("send_whatsapp", {"items": [{}]}, {}, sends=True)
+        await a.start()
+        await _wait_status(a, job_id, "running")
+        await a.stop()
+        await asyncio.sleep(0.4)
+        await b.start()
+        await asyncio.sleep(0.2)
+        job = b.get(job_id)
+        assert job["status"] == "failed"
+        assert job["error"] == INTERRUPTED_SEND_ERROR
+        assert sent == [1]
+        await b.stop()
+
+    asyncio.run(main())
+
+
+def test_interrupted_send_job_reruns_with_ledger(tmp_path):
+    async def main():
+        a = _queue(tmp_path / "jobs.db")
+        b = _queue(tmp_path / "jobs.db", resend_safe=True)
+        gate = asyncio.Event()
+        for q in (a, b):
+            q.register("send_whatsapp", _blocking_handler(gate))
+        job_id = await a.submit("send_whatsapp", {"items": [{}]}, {}, sends=True)
+        await a.start()
+        await _wait_status(a, job_id, "running")
+        await a.stop()
+        await asyncio.sleep(0.4)
+        gate.set()
+        await b.start()
+        assert (await _wait_status(b, job_id, "done"))["status"] == "done"
+        await b.stop()
+
+    asyncio.run(main())
@@ -0,0 +1,36 @@
+import base64
+
+import pytest
+
+from gl_service.models import Attachment
+
+
+RAW = bytes(range(256)) * 20
+STRICT = base64.b64encode(RAW).decode("ascii")
+
+
+def test_strict_base64_passed_through_as_is():
+    att = Attachment(file_name="a.pdf", data_base64=STRICT)
+    assert att.base64_text() is STRICT
+    assert att.raw_bytes() == RAW
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        "\n".join(STRICT[i : i + 76] for i in range(0, len(STRICT), 76)),  # MIME-переносы
+        " " + STRICT + " ",
+        STRICT.rstrip("="),  # без padding
+        STRICT.replace("+", "-").replace("/", "_"),  # URL-safe
+        "data:application/pdf;base64," + STRICT,
+    ],
+)
+def test_loose_base64_is_normalized(data):
+    att = Attachment(file_name="a.pdf", data_base64=data)
+    assert att.raw_bytes() == RAW
+    assert att.base64_text() == STRICT
+
+
+def test_blob_and_bytes_attachments_are_encoded():
+    att = Attachment.from_bytes(RAW, file_name="a.pdf", mime_type="application/pdf")
+    assert att.base64_text() == STRICT
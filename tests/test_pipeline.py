@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+
+from gl_service import pipeline
+from gl_service.models import GuaranteeDocExtract
+from gl_service.resilience import CircuitOpenError
+
+
+def _item(n: int) -> dict:
+    return {
+        "json": {"id": f"m{n}", "threadId": f"t{n}", "subject": f"Письмо {n}", "date": f"2025-03-0{n}T10:00:00Z"},
+        "binary": {},
+    }
+
+
+@pytest.fixture
+def committed(monkeypatch):
+    out: list[str] = []
+
+    async def commit(emails):
+        out.extend(e.id for e in emails)
+        return len(emails)
+
+    monkeypatch.setattr(pipeline, "step_commit_watermarks", commit)
+    return out
+
+
+def _analyze_fails_for(monkeypatch, failing: set[str]):
+    async def analyze(email, info=None):
+        if email.id in failing:
+            raise CircuitOpenError("gemini: circuit open")
+        return GuaranteeDocExtract(summary="ok"), None
+
+    monkeypatch.setattr(pipeline, "step_analyze_attachment", analyze)
+
+
+def test_commit_skips_failed_analysis(monkeypatch, committed):
+    _analyze_fails_for(monkeypatch, {"m2"})
+    asyncio.run(pipeline.run_pipeline([_item(1), _item(2)], dedupe=False, classify=False, commit_watermark=True))
+    assert committed == ["m1"]
+
+
+def test_commit_with_send_only_sent(monkeypatch, committed):
+    _analyze_fails_for(monkeypatch, set())
+
+    class Sent:
+        def model_dump(self):
+            return {"ok": True}
+
+    async def send_ok(*, email_id, **kw):
+        if email_id == "m2":
+            raise RuntimeError("Whapi HTTP 500")
+        return Sent()
+
+    monkeypatch.setattr(pipeline, "send_text_and_optional_doc", send_ok)
+    asyncio.run(
+        pipeline.run_pipeline([_item(1), _item(2)], dedupe=False, classify=False, send=True, commit_watermark=True)
+    )
+    assert committed == ["m1"]
+
+
+def test_commit_without_analysis_commits_nothing(monkeypatch, committed):
+    asyncio.run(
+        pipeline.run_pipeline([_item(1)], dedupe=False, classify=False, analyze=False, commit_watermark=True)
+    )
+    assert committed == []
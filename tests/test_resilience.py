@@ -0,0 +1,146 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from gl_service.resilience import CircuitOpenError, UpstreamGuard
+
+
+def _guard(**kw) -> UpstreamGuard:
+    opts = dict(max_attempts=3, base_delay_s=0.001, max_delay_s=0.5, breaker_threshold=2, breaker_cooldown_s=0.2)
+    return UpstreamGuard("test", **{**opts, **kw})
+
+
+def _client(responses: list, delay_s: float = 0.0):
+    """Локальный upstream: отдаёт `responses` по очереди (int — статус, исключение — бросает), дальше 200."""
+
+    calls = {"n": 0}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls["n"] += 1
+        await asyncio.sleep(delay_s)
+        r = responses.pop(0) if responses else 200
+        if isinstance(r, Exception):
+            raise r
+        if isinstance(r, httpx.Response):
+            return r
+        return httpx.Response(r, json={"n": calls["n"]})
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://upstream"), calls
+
+
+def _run(guard: UpstreamGuard, client: httpx.AsyncClient) -> httpx.Response:
+    return asyncio.run(guard.request(lambda: client.post("/v1")))
+
+
+def test_retries_5xx_and_429_then_succeeds():
+    guard = _guard()
+    client, calls = _client([503, 429])
+
+    resp = _run(guard, client)
+
+    assert resp.status_code == 200
+    assert calls["n"] == 3 and guard.retries == 2
+
+
+def test_gives_up_after_max_attempts_and_returns_last_response():
+    guard = _guard(breaker_threshold=10)
+    client, calls = _client([500, 502, 503, 200])
+
+    assert _run(guard, client).status_code == 503
+    assert calls["n"] == 3
+    assert guard.stats()["consecutive_failures"] == 1
+
+
+def test_retry_after_is_honored():
+    guard = _guard(base_delay_s=0.0)
+    client, calls = _client([httpx.Response(429, headers={"Retry-After": "0.2"})])
+
+    started = time.monotonic()
+    assert _run(guard, client).status_code == 200
+    assert time.monotonic() - started >= 0.2
+    assert calls["n"] == 2
+
+
+def test_retry_after_longer_than_max_delay_is_not_awaited():
+    guard = _guard(max_delay_s=0.5)
+    client, calls = _client([httpx.Response(429, headers={"Retry-After": "120"})])
+
+    assert _run(guard, client).status_code == 429
+    assert calls["n"] == 1
+
+
+def test_transport_errors_are_retried_then_raised():
+    guard = _guard(breaker_threshold=10)
+    client, calls = _client([httpx.ConnectError("refused")] * 3)
+
+    with pytest.raises(httpx.ConnectError):
+        _run(guard, client)
+    assert calls["n"] == 3
+
+
+def test_breaker_opens_then_lets_one_probe_through():
+    guard = _guard(max_attempts=1, breaker_threshold=2, breaker_cooldown_s=0.2)
+
+    async def main():
+        client, calls = _client([500, 500], delay_s=0.05)
+        send = lambda: client.post("/v1")  # noqa: E731
+        assert (await guard.request(send)).status_code == 500
+        assert (await guard.request(send)).status_code == 500
+        assert guard.stats()["circuit"] == "open"
+        with pytest.raises(CircuitOpenError):
+            await guard.request(send)
+        assert calls["n"] == 2
+
+        await asyncio.sleep(0.25)
+        # half-open: проходит один пробный запрос, параллельный отклоняется
+        probe = asyncio.create_task(guard.request(send))
+        await asyncio.sleep(0.01)
+        with pytest.raises(CircuitOpenError):
+            await guard.request(send)
+        assert (await probe).status_code == 200
+        assert guard.stats()["circuit"] == "closed"
+        assert (await guard.request(send)).status_code == 200
+        return calls["n"]
+
+    assert asyncio.run(main()) == 4
+    assert guard.rejected == 2
+
+
+def test_breaker_threshold_zero_disables_breaker():
+    guard = _guard(max_attempts=1, breaker_threshold=0)
+
+    async def main():
+        client, calls = _client([500, 500, 500], delay_s=0.02)
+        send = lambda: client.post("/v1")  # noqa: E731
+        statuses = [r.status_code for r in await asyncio.gather(*(guard.request(send) for _ in range(5)))]
+        return sorted(statuses), calls["n"]
+
+    statuses, n = asyncio.run(main())
+    assert statuses == [200, 200, 500, 500, 500]
+    assert n == 5
+    assert guard.rejected == 0
+    assert guard.stats()["circuit"] == "disabled"
+
+
+def test_hedging_takes_the_faster_duplicate():
+    guard = _guard(hedge=True, hedge_min_samples=1)
+    guard._latencies.extend([0.05] * 20)
+    delays = [1.0, 0.0]
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        delay = delays.pop(0)
+        await asyncio.sleep(delay)
+        return httpx.Response(200, json={"delay": delay})
+
+    async def main():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://upstream")
+        started = time.monotonic()
+        resp = await guard.request(lambda: client.post("/v1"))
+        return resp, time.monotonic() - started
+
+    resp, elapsed = asyncio.run(main())
+    assert resp.json() == {"delay": 0.0}
+    assert elapsed < 0.5
+    assert guard.hedged == 1
@@ -0,0 +1,48 @@
+import pytest
+
+from gl_service import rules
+from gl_service.models import Email
+from gl_service.rules import DEFAULT_RULES, RuleClassifier
+
+
+def _email(subject: str, sender: str = "Иванова Анна <a.ivanova@clinic-zdorovie.ru>", labels=None) -> Email:
+    return Email(id="m1", subject=subject, **{"from": sender}, label_ids=labels or ["INBOX"])
+
+
+@pytest.mark.parametrize(
+    ("subject", "sender", "labels", "expected"),
+    [
+        # Однозначное "да"
+        ("Гарантийное письмо № 123/45 на пациента Петров П.П.", "ОСО <oso@alfastrah.ru>", None, True),
+        ("ГАРАНТИЙНЫЕ ПИСЬМА от 12.03.2024", "noreply@mail.sogaz.ru", None, True),
+        ("ГП Сидорова А.А. полис 0012-345", "Отдел ДМС <dms@ingos.ru>", None, True),
+        ("RE: гарантия на лечение, полис 77-123", "Менеджер <manager@mail.vsk.ru>", None, True),
+        # Однозначное "нет"
+        ("Акт сверки за 1 квартал", "buh@reso.ru", None, False),
+        ("Счет-фактура № 15 от 01.04", "Бухгалтерия <buh@supplier.ru>", None, False),
+        ("Гарантийное письмо", "Промо <promo@shop.ru>", ["CATEGORY_PROMOTIONS"], False),
+        ("Новости клиники: рассылка за март", "news@clinic.ru", None, False),
+        # Неоднозначно — решает модель
+        ("гарантия на ремонт кондиционера", "service@climat.ru", None, None),
+        ("Запрос по пациенту Петрову", "oso@alfastrah.ru", None, None),
+        ("Fwd: документы", "a.ivanova@clinic-zdorovie.ru", None, None),
+        # «гп» строчными — не аббревиатура гарантийного письма
+        ("гп-2 насос, счёт на оплату", "sales@pumps.ru", None, None),
+    ],
+)
+def test_default_rules_on_real_subjects(subject, sender, labels, expected):
+    clf = RuleClassifier.from_config(DEFAULT_RULES)
+
+    assert clf.decide(_email(subject, sender, labels)) is expected
+
+
+def test_rules_are_opt_in(monkeypatch):
+    rules.rule_classifier.cache_clear()
+    try:
+        assert rules.rule_classifier() is None
+
+        monkeypatch.setattr(rules.settings, "classify_rules_enabled", True)
+        rules.rule_classifier.cache_clear()
+        assert rules.rule_classifier().classify(_email("Гарантийное письмо")).decided_by == "rules"
+    finally:
+        rules.rule_classifier.cache_clear()
@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from gl_service import whapi_client
+from gl_service.models import Attachment
+from gl_service.send_ledger import SendLedger
+from gl_service.whapi_client import SendInProgressError, WhapiError, send_text_and_optional_doc
+
+
+@pytest.fixture
+def ledger(tmp_path, monkeypatch):
+    ledger = SendLedger(str(tmp_path / "ledger.db"))
+    monkeypatch.setattr(whapi_client, "send_ledger", ledger)
+    return ledger
+
+
+def _send(**kw):
+    att = Attachment.from_bytes(b"%PDF-1.4 letter", file_name="letter.pdf", mime_type="application/pdf")
+    return send_text_and_optional_doc(to="chat@g.us", text="Гарантийное письмо", attachment=att, email_id="m1", **kw)
+
+
+def test_reserve_states(ledger):
+    assert ledger.reserve("k", "text") == ("reserved", None)
+    assert ledger.reserve("k", "text") == ("pending", None)
+    ledger.record("k", "text", "id-1")
+    assert ledger.reserve("k", "text") == ("sent", "id-1")
+    assert ledger.get("k") == {"text": "id-1"}
+
+
+def test_release_and_stale_takeover(ledger):
+    assert ledger.reserve("k", "document")[0] == "reserved"
+    ledger.release("k", "document")
+    assert ledger.reserve("k", "document")[0] == "reserved"
+    # Брошенный резерв (процесс упал) перехватывается после pending_s
+    ledger.pending_s = 0.0
+    assert ledger.reserve("k", "document")[0] == "reserved"
+
+
+def test_retry_does_not_resend(ledger, whapi):
+    async def main():
+        first = await _send()
+        second = await _send()
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert (whapi["text"], whapi["document"]) == (1, 1)
+    assert second.deduplicated
+    assert second.document_message_id == first.document_message_id
+
+
+def test_concurrent_retry_waits_for_inflight_send(ledger, whapi):
+    whapi["doc_delay"] = 0.5
+
+    async def main():
+        first = asyncio.create_task(_send())
+        await asyncio.sleep(0.1)  # документ первого ещё заливается
+        return await first, await _send()
+
+    first, second = asyncio.run(main())
+    assert (whapi["text"], whapi["document"]) == (1, 1)
+    assert second.deduplicated
+    assert second.document_message_id == first.document_message_id
+
+
+def test_concurrent_retry_gets_conflict_after_wait(ledger, whapi, monkeypatch):
+    monkeypatch.setattr(whapi_client.settings, "send_ledger_wait_s", 0.2)
+    whapi["doc_delay"] = 1.0
+
+    async def main():
+        first = asyncio.create_task(_send())
+        await asyncio.sleep(0.1)
+        with pytest.raises(SendInProgressError):
+            await _send()
+        await first
+
+    asyncio.run(main())
+    assert whapi["document"] == 1
+
+
+def test_failed_part_releases_reservation(ledger, whapi):
+    whapi["doc_errors"].append(WhapiError("Whapi HTTP 503", status_code=503))
+
+    async def main():
+        with pytest.raises(WhapiError):
+            await _send()
+        return await _send()
+
+    res = asyncio.run(main())
+    # Текст ушёл в первый раз и не повторяется; документ дошёл со второй попытки
+    assert (whapi["text"], whapi["document"]) == (1, 2)
+    assert res.text_message_id == "text-1"
@@ -0,0 +1,115 @@
+import asyncio
+import sqlite3
+
+from gl_service.send_queue import SendQueue
+from gl_service.whapi_client import WhapiError
+
+
+def _queue(path, *, burst: float = 100) -> SendQueue:
+    return SendQueue(
+        str(path),
+        workers=1,
+        max_attempts=3,
+        retry_base_s=0.01,
+        retry_max_s=0.05,
+        account_rate=1000,
+        account_burst=burst,
+        recipient_rate=1000,
+        recipient_burst=burst,
+    )
+
+
+JOB = {"to": "chat@g.us", "text": "Гарантийное письмо", "email_id": "m1", "file_name": "letter.pdf",
+       "mime_type": "application/pdf", "data": b"%PDF-1.4 letter"}
+
+
+async def _wait(q: SendQueue, job_id: str, status: str) -> dict:
+    for _ in range(200):
+        job = q.get_many([job_id])[0]
+        if job["status"] == status:
+            return job
+        await asyncio.sleep(0.01)
+    return job
+
+
+def test_document_retry_does_not_resend_text(tmp_path, whapi):
+    whapi["doc_errors"].append(WhapiError("Whapi HTTP 503", status_code=503))
+
+    async def main():
+        q = _queue(tmp_path / "queue.db")
+        await q.start()
+        [job_id] = await q.submit([JOB])
+        job = await _wait(q, job_id, "sent")
+        await q.stop()
+        return job
+
+    job = asyncio.run(main())
+    assert job["status"] == "sent"
+    assert job["attempts"] == 2
+    assert (whapi["text"], whapi["document"]) == (1, 2)
+    assert job["result"]["text_message_id"] == "text-1"
+
+
+def test_restart_requeue_skips_sent_parts(tmp_path, whapi):
+    path = tmp_path / "queue.db"
+
+    async def main():
+        q = _queue(path)
+        [job_id] = await q.submit([JOB])
+        # Процесс упал после отправки текста: задание в "sending", текст записан в parts
+        with sqlite3.connect(path) as db:
+            db.execute("UPDATE send_jobs SET status = 'sending', parts = ? WHERE id = ?", ('{"text": "text-0"}', job_id))
+        q2 = _queue(path)
+        await q2.start()
+        job = await _wait(q2, job_id, "sent")
+        await q2.stop()
+        return job
+
+    job = asyncio.run(main())
+    assert job["status"] == "sent"
+    assert (whapi["text"], whapi["document"]) == (0, 1)
+    assert job["result"]["text_message_id"] == "text-0"
+
+
+def test_result_saved_after_transient_sqlite_error(tmp_path, whapi):
+
+    async def main():
+        q = _queue(tmp_path / "queue.db")
+        update = q._update
+        failures = [sqlite3.OperationalError("database is locked")]
+
+        def flaky_update(job_id, **fields):
+            if fields.get("status") == "sent" and failures:
+                raise failures.pop()
+            update(job_id, **fields)
+
+        q._update = flaky_update
+        await q.start()
+        [job_id] = await q.submit([JOB])
+        for _ in range(300):
+            job = q.get_many([job_id])[0]
+            if job["status"] == "sent":
+                break
+            await asyncio.sleep(0.01)
+        await q.stop()
+        return job
+
+    job = asyncio.run(main())
+    assert job["status"] == "sent"
+    assert (whapi["text"], whapi["document"]) == (1, 1)
+
+
+def test_document_job_with_burst_one(tmp_path, whapi):
+    # Текст + документ — два токена при burst=1 (GL_WHAPI_BURST=1): задание не должно зависнуть
+
+    async def main():
+        q = _queue(tmp_path / "queue.db", burst=1)
+        await q.start()
+        [job_id] = await q.submit([JOB])
+        job = await _wait(q, job_id, "sent")
+        await q.stop()
+        return job
+
+    job = asyncio.run(main())
+    assert job["status"] == "sent"
+    assert (whapi["text"], whapi["document"]) == (1, 1)